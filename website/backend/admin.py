@@ -0,0 +1,268 @@
+"""
+Admin/operations API: live inspection of jobs, executor, storage and caches,
+plus runtime controls (drain, pause, resize the worker pool).
+
+Endpoints are only enabled when ADMIN_TOKEN is set, and require it as
+`Authorization: Bearer <token>`.
+"""
+import asyncio
+import hmac
+import os
+import re
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from pydantic import BaseModel
+
+from structured_log import get_logger
+from file_manager import ACTIVE_STATUSES, JobStatus, file_manager
+from downloader import executor_stats, info_cache_stats, resize_executor
+from scratch import scratch_space
+from webhooks import webhook_dispatcher
+from thumbnails import thumbnail_cache
+from prefetch import prefetcher
+
+
+log = get_logger('admin')
+
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# How many failed jobs are kept for /api/admin/failures
+RECENT_FAILURES = 200
+
+# Error message patterns -> failure class, first match wins
+ERROR_CLASSES = [
+    (re.compile(r'cancelled', re.I), 'cancelled'),
+    (re.compile(r'quota exceeded', re.I), 'quota'),
+    (re.compile(r'HTTP Error 403'), 'http_403'),
+    (re.compile(r'HTTP Error 429|Too Many Requests', re.I), 'http_429'),
+    (re.compile(r'HTTP Error 5\d\d'), 'http_5xx'),
+    (re.compile(r'Private video|Video unavailable|not available', re.I), 'unavailable'),
+    (re.compile(r'Sign in|login|age-restricted|confirm your age', re.I), 'login_required'),
+    (re.compile(r'Unsupported URL|is not a valid URL', re.I), 'bad_url'),
+    (re.compile(r'ffmpeg|Postprocessing|Conversion failed', re.I), 'ffmpeg'),
+    (re.compile(r'timed out|Connection|Temporary failure', re.I), 'network'),
+    (re.compile(r'file not found', re.I), 'missing_output'),
+    (re.compile(r'interrupted by a server restart', re.I), 'restart'),
+]
+
+
+class Controls:
+    """Runtime switches shared by the download pipeline and the admin API."""
+    
+    def __init__(self):
+        # Draining: new downloads are refused, running ones finish
+        self.draining = False
+        # Cleared while paused: jobs wait before their download step
+        self.running = asyncio.Event()
+        self.running.set()
+    
+    @property
+    def paused(self) -> bool:
+        return not self.running.is_set()
+
+
+controls = Controls()
+
+# (time, job_id, error class, message), newest last
+recent_failures: deque = deque(maxlen=RECENT_FAILURES)
+
+
+def classify_error(message: str) -> str:
+    """Map an error message to a coarse failure class."""
+    for pattern, error_class in ERROR_CLASSES:
+        if pattern.search(message or ''):
+            return error_class
+    return 'other'
+
+
+def record_failure(job_id: str, message: str):
+    """Remember a failed job for the failures report."""
+    recent_failures.append((time.time(), job_id, classify_error(message), message))
+
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Dependency: reject the request unless it carries the admin token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    expected = f"Bearer {ADMIN_TOKEN}"
+    if not authorization or not hmac.compare_digest(authorization.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Admin token required")
+
+
+router = APIRouter(prefix="/api/admin", dependencies=[Depends(require_admin)])
+
+
+class DrainRequest(BaseModel):
+    enabled: bool = True
+
+
+class WorkersRequest(BaseModel):
+    max_workers: int
+
+
+def _job_summary(job_id: str, now: float) -> Dict:
+    job = file_manager.jobs[job_id]
+    return {
+        'job_id': job_id,
+        'status': job.status,
+        'stage': job.stage,
+        'progress': job.progress,
+        'downloaded_bytes': job.downloaded_bytes,
+        'total_bytes': job.total_bytes,
+        'speed': job.speed,
+        'age_seconds': round(now - job.created_at),
+        'idle_seconds': round(now - job.last_seen),
+        'client': job.client,
+        'url': job.request['url'] if job.request else None,
+        'format': job.plan['format'] if job.plan else None,
+        'error': job.error,
+    }
+
+
+def disk_usage() -> Dict:
+    """Bytes and file counts in the download directory, by what the files belong to."""
+    usage = {state: {'files': 0, 'bytes': 0} for state in ('partial', 'ready', 'orphaned', 'journal')}
+    active_prefixes = tuple(f"{job_id}." for job_id in file_manager.active_job_ids())
+    journal_file = os.path.abspath(file_manager.journal.path) if file_manager.journal else None
+    try:
+        entries = list(os.scandir(file_manager.download_dir))
+    except OSError:
+        entries = []
+    for entry in entries:
+        if not entry.is_file():
+            continue
+        if journal_file and os.path.abspath(entry.path).startswith(journal_file):
+            state = 'journal'
+        elif active_prefixes and entry.name.startswith(active_prefixes):
+            state = 'partial'
+        elif file_manager.is_file_referenced(entry.path):
+            state = 'ready'
+        else:
+            state = 'orphaned'
+        try:
+            size = entry.stat().st_size
+        except OSError:
+            continue
+        usage[state]['files'] += 1
+        usage[state]['bytes'] += size
+    return usage
+
+
+def failure_report(limit: int = 20) -> Dict:
+    """Recent failures grouped by class, with the latest examples of each."""
+    groups: Dict[str, Dict] = {}
+    for failed_at, job_id, error_class, message in reversed(recent_failures):
+        group = groups.setdefault(error_class, {'count': 0, 'latest': []})
+        group['count'] += 1
+        if len(group['latest']) < limit:
+            group['latest'].append({
+                'job_id': job_id,
+                'age_seconds': round(time.time() - failed_at),
+                'error': message,
+            })
+    return dict(sorted(groups.items(), key=lambda item: item[1]['count'], reverse=True))
+
+
+@router.get("/jobs")
+async def list_jobs(status: Optional[str] = None, limit: int = 100):
+    """
+    List jobs, newest first.
+    
+    Args:
+        status: Only jobs in this state (default: pending and processing)
+        limit: Maximum number of jobs returned
+    """
+    try:
+        statuses = [JobStatus(status)] if status else list(ACTIVE_STATUSES)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Unknown status: {status}")
+    job_ids = file_manager.jobs_with_status(*statuses)
+    job_ids.sort(key=lambda job_id: file_manager.jobs[job_id].created_at, reverse=True)
+    now = time.time()
+    return {
+        'total': len(job_ids),
+        'jobs': [_job_summary(job_id, now) for job_id in job_ids[:limit]],
+    }
+
+
+@router.get("/stats")
+async def stats(request: Request):
+    """Overview of jobs, executor, storage, caches and rate limiting."""
+    return {
+        'jobs': {status.value: len(ids) for status, ids in file_manager.jobs_by_status.items()},
+        'tokens': len(file_manager.tokens),
+        'executor': executor_stats(),
+        'queue': await asyncio.to_thread(request.app.state.job_queue.stats) if request.app.state.job_queue else None,
+        'controls': {'draining': controls.draining, 'paused': controls.paused},
+        'disk': disk_usage(),
+        'scratch': scratch_space.stats(),
+        'journal': file_manager.journal.stats() if file_manager.journal else None,
+        'webhooks': webhook_dispatcher.stats(),
+        'thumbnails': thumbnail_cache.stats(),
+        'prefetch': {k: v for k, v in prefetcher.stats().items() if k != 'top'},
+        'info_cache': {k: v for k, v in info_cache_stats().items() if k != 'items'},
+        'rate_limit': request.app.state.rate_limiter.stats(),
+        'failures': {error_class: group['count'] for error_class, group in failure_report(0).items()},
+    }
+
+
+@router.get("/executor")
+async def executor():
+    return executor_stats()
+
+
+@router.get("/disk")
+async def disk():
+    return {**disk_usage(), 'scratch': scratch_space.stats()}
+
+
+@router.get("/cache")
+async def cache():
+    return info_cache_stats()
+
+
+@router.get("/prefetch")
+async def prefetch():
+    return prefetcher.stats()
+
+
+@router.get("/failures")
+async def failures(limit: int = 20):
+    return failure_report(limit)
+
+
+@router.post("/drain")
+async def drain(body: DrainRequest):
+    """Stop (or resume) accepting new downloads; running jobs finish."""
+    controls.draining = body.enabled
+    log.info("Draining changed", extra={'draining': body.enabled})
+    return {'draining': controls.draining, 'active_jobs': len(file_manager.active_job_ids())}
+
+
+@router.post("/pause")
+async def pause():
+    """Hold jobs before their download step; running downloads continue."""
+    controls.running.clear()
+    log.info("Downloads paused")
+    return {'paused': True}
+
+
+@router.post("/resume")
+async def resume():
+    """Release jobs held by /pause."""
+    controls.running.set()
+    log.info("Downloads resumed")
+    return {'paused': False}
+
+
+@router.post("/workers")
+async def workers(body: WorkersRequest):
+    """Resize the executor that runs extractions and downloads."""
+    if not 1 <= body.max_workers <= 64:
+        raise HTTPException(status_code=400, detail="max_workers must be between 1 and 64")
+    resize_executor(body.max_workers)
+    log.info("Executor resized", extra={'max_workers': body.max_workers})
+    return executor_stats()
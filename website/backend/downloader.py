@@ -2,25 +2,156 @@
 YouTube video downloader core functionality using yt-dlp.
 Adapted from the original youtube_downloader.py for web usage.
 """
-import yt_dlp
 import os
+import signal
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, Optional, Tuple
 import asyncio
+import contextvars
 from concurrent.futures import ThreadPoolExecutor
 
+from ffmpeg_probe import (
+    get_ffmpeg_capabilities,
+    ydl_audio_options,
+    ydl_ffmpeg_options,
+    ydl_section_options,
+)
+from format_planner import plan_audio, plan_format
+from structured_log import bind_log_context, get_logger
+from stream_merge import StreamMergeError, stream_merge, streamable_formats
+from fragment_downloader import fragment_engine, merge_fragments, supported_formats
+from video_url import cache_key
 
-# Thread pool for running blocking yt-dlp operations
-executor = ThreadPoolExecutor(max_workers=4)
+log = get_logger('downloader')
 
 
-def get_format_string(quality: str) -> str:
+# Thread pool for running blocking yt-dlp operations (see resize_executor)
+executor_workers = 4
+executor = ThreadPoolExecutor(max_workers=executor_workers)
+
+# Work submitted through _run_in_executor that is waiting / running
+_executor_lock = threading.Lock()
+_executor_queued = 0
+_executor_running = 0
+
+# Quality value for audio-only downloads
+AUDIO_QUALITY = "audio"
+
+# Format fields kept from extraction for planning (the rest is dropped to save memory)
+_FORMAT_FIELDS = (
+    'format_id', 'ext', 'vcodec', 'acodec', 'height', 'width', 'fps',
+    'tbr', 'vbr', 'abr', 'filesize', 'filesize_approx', 'format_note', 'protocol',
+)
+
+# Qualities offered by the frontend; /api/info estimates each of them
+OFFERED_QUALITIES = ("2160p", "1440p", "1080p", "720p", "480p", "best", AUDIO_QUALITY)
+
+# Extracted metadata (with its per-quality estimates) is reused for this long,
+# so the info request and the download that follows only extract once
+INFO_CACHE_SECONDS = int(os.environ.get('INFO_CACHE_SECONDS', '600'))
+INFO_CACHE_SIZE = int(os.environ.get('INFO_CACHE_SIZE', '256'))
+
+# video cache key (see video_url) -> (cached_at, info), oldest first
+_info_cache: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+_info_cache_hits = 0
+_info_cache_misses = 0
+
+# video cache key -> extraction in progress, shared by concurrent requests
+_info_inflight: Dict[str, asyncio.Future] = {}
+
+# Leftovers from yt-dlp that are never the final output file
+_INTERMEDIATE_SUFFIXES = ('.part', '.ytdl', '.temp', '.tmp')
+
+# job_id -> cancellation flag for downloads in progress
+_cancel_events: Dict[str, threading.Event] = {}
+
+CANCELLED_MESSAGE = "Download cancelled"
+
+# Pipe video+audio pairs into one FFmpeg process instead of merging separate files
+STREAMING_MERGE = os.environ.get('STREAMING_MERGE', '1') != '0'
+
+# Download DASH/HLS fragments on the event loop instead of yt-dlp's fragment threads
+ASYNC_FRAGMENTS = os.environ.get('ASYNC_FRAGMENTS', '0') == '1'
+
+# yt-dlp is imported inside the functions that use it so the app can start
+# serving before it has loaded; warm_up() loads it in the background.
+
+
+def _preload():
+    """Import yt-dlp and probe FFmpeg so the first request does not pay for it."""
+    import yt_dlp  # noqa: F401
+    
+    capabilities = get_ffmpeg_capabilities()
+    if capabilities:
+        log.info("FFmpeg detected", extra={'ffmpeg_version': capabilities['version']})
+    else:
+        log.warning("FFmpeg not found - only single-file formats can be downloaded")
+
+
+async def warm_up():
+    """Load yt-dlp and FFmpeg capabilities on the executor without blocking startup."""
+    await _run_in_executor(_preload)
+
+
+def _tracked(fn, *args):
+    global _executor_queued, _executor_running
+    with _executor_lock:
+        _executor_queued -= 1
+        _executor_running += 1
+    try:
+        return fn(*args)
+    finally:
+        with _executor_lock:
+            _executor_running -= 1
+
+
+async def _run_in_executor(fn, *args):
+    """Run a blocking function on the executor, counting queued and running work."""
+    global _executor_queued
+    with _executor_lock:
+        _executor_queued += 1
+    loop = asyncio.get_event_loop()
+    # Run in a copy of the caller's context so the job's log context follows it
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, context.run, _tracked, fn, *args)
+
+
+def executor_stats() -> Dict:
+    """Executor size and how much work is waiting for / occupying it."""
+    return {
+        'max_workers': executor_workers,
+        'running': _executor_running,
+        'queued': _executor_queued,
+        'saturation': round(_executor_running / executor_workers, 2),
+    }
+
+
+def resize_executor(max_workers: int):
+    """
+    Replace the executor with one of a different size.
+    
+    Work already handed to the old executor (running or queued) still runs
+    there; its threads exit once that work is done.
+    """
+    global executor, executor_workers
+    old = executor
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    executor_workers = max_workers
+    old.shutdown(wait=False)
+
+
+def get_format_string(quality: str, can_merge: bool = True) -> str:
     """
     Get the format string based on selected quality.
     
     Args:
-        quality: Quality setting (e.g., '1080p', '720p', '480p', 'best')
+        quality: Quality setting (e.g., '1080p', '720p', '480p', 'best').
+            Audio-only downloads use ydl_audio_options() instead.
+        can_merge: Whether FFmpeg is available to merge separate video/audio streams
     
     Returns:
         Format string for yt-dlp
@@ -36,7 +167,12 @@ def get_format_string(quality: str) -> str:
     
     height = quality_map.get(quality.lower(), 1080)
     
-    if height == 9999:
+    if not can_merge:
+        # Without FFmpeg only single-file formats can be saved
+        if height == 9999:
+            return 'best[ext=mp4]/best'
+        return f'best[height<={height}][ext=mp4]/best[height<={height}]/best'
+    elif height == 9999:
         return 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best'
     else:
         return f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<={height}]+bestaudio/best[height<={height}]/best'
@@ -52,6 +188,8 @@ def _sync_get_video_info(url: str) -> Dict:
     Returns:
         Dictionary with video metadata
     """
+    import yt_dlp
+    
     ydl_opts = {
         'quiet': True,
         'no_warnings': True,
@@ -62,7 +200,7 @@ def _sync_get_video_info(url: str) -> Dict:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=False)
             
-            return {
+            result = {
                 'success': True,
                 'title': info.get('title', 'Unknown'),
                 'duration': info.get('duration', 0),
@@ -70,7 +208,14 @@ def _sync_get_video_info(url: str) -> Dict:
                 'uploader': info.get('uploader', 'Unknown'),
                 'view_count': info.get('view_count', 0),
                 'upload_date': info.get('upload_date', ''),
+                'id': info.get('id'),
+                'formats': [
+                    {k: f.get(k) for k in _FORMAT_FIELDS}
+                    for f in info.get('formats') or []
+                ],
             }
+            result['estimates'] = estimate_qualities(result)
+            return result
     except Exception as e:
         return {
             'success': False,
@@ -78,45 +223,460 @@ def _sync_get_video_info(url: str) -> Dict:
         }
 
 
+def _cached_info(key: str) -> Optional[Dict]:
+    entry = _info_cache.get(key)
+    if entry is None:
+        return None
+    cached_at, info = entry
+    if time.time() - cached_at > INFO_CACHE_SECONDS:
+        del _info_cache[key]
+        return None
+    return info
+
+
+def _cache_info(key: str, info: Dict):
+    _info_cache[key] = (time.time(), info)
+    _info_cache.move_to_end(key)
+    while len(_info_cache) > INFO_CACHE_SIZE:
+        _info_cache.popitem(last=False)
+
+
 async def get_video_info(url: str) -> Dict:
     """
     Get video information without downloading.
     
+    Results are keyed by the video (every URL form of it shares one entry).
+    Successful results are cached for INFO_CACHE_SECONDS, so a download
+    started right after an info request reuses the same extraction, and
+    concurrent requests for a video wait for one extraction.
+    
     Args:
         url: YouTube video URL
     
     Returns:
-        Dictionary with video metadata or error
+        Dictionary with video metadata (including per-quality 'estimates') or error
     """
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, _sync_get_video_info, url)
+    global _info_cache_hits, _info_cache_misses
+    key = cache_key(url)
+    info = _cached_info(key)
+    if info is not None:
+        _info_cache_hits += 1
+        return info
+    
+    _info_cache_misses += 1
+    pending = _info_inflight.get(key)
+    if pending is None:
+        pending = _info_inflight[key] = asyncio.ensure_future(_run_in_executor(_sync_get_video_info, url))
+        pending.add_done_callback(lambda _: _info_inflight.pop(key, None))
+    # Shielded so one caller giving up does not cancel the others' extraction
+    info = await asyncio.shield(pending)
+    if info['success'] and INFO_CACHE_SECONDS > 0:
+        _cache_info(key, info)
+    return info
+
+
+def info_cached(url: str) -> bool:
+    """Whether metadata for the video at `url` is cached (and fresh)."""
+    return _cached_info(cache_key(url)) is not None
+
+
+def info_cache_stats() -> Dict:
+    """Metadata cache size, hit rate and contents (oldest first)."""
+    lookups = _info_cache_hits + _info_cache_misses
+    now = time.time()
+    return {
+        'entries': len(_info_cache),
+        'max_entries': INFO_CACHE_SIZE,
+        'ttl_seconds': INFO_CACHE_SECONDS,
+        'hits': _info_cache_hits,
+        'misses': _info_cache_misses,
+        'hit_rate': round(_info_cache_hits / lookups, 3) if lookups else None,
+        'items': [
+            {'key': key, 'title': info.get('title'), 'age_seconds': round(now - cached_at)}
+            for key, (cached_at, info) in list(_info_cache.items())
+        ],
+    }
+
+
+def estimate_qualities(info: Dict) -> Dict[str, Optional[Dict]]:
+    """
+    Plan every offered quality for a video.
+    
+    Args:
+        info: Video metadata including 'formats'
+    
+    Returns:
+        Dictionary of quality -> format plan (None if nothing suitable was found)
+    """
+    return {quality: _plan_quality(info, quality) for quality in OFFERED_QUALITIES}
+
 
+def _plan_quality(info: Dict, quality: str) -> Optional[Dict]:
+    capabilities = get_ffmpeg_capabilities()
+    if quality.lower() == AUDIO_QUALITY:
+        return plan_audio(info, capabilities)
+    return plan_format(info, quality, capabilities)
 
-def _sync_download_video(url: str, output_path: str, quality: str, job_id: str) -> Tuple[bool, str, Optional[str]]:
+
+def plan_download(
+    info: Dict,
+    quality: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+) -> Optional[Dict]:
+    """
+    Pick the cheapest format meeting the quality request from extracted info.
+    
+    Args:
+        info: Result of get_video_info (including 'formats')
+        quality: Quality setting ('audio' for audio only)
+        start: Optional clip start in seconds
+        end: Optional clip end in seconds
+    
+    Returns:
+        Format plan (see format_planner) or None to fall back to a format string
+    """
+    estimates = info.get('estimates') or {}
+    if quality.lower() in estimates:
+        # Planned when the metadata was extracted; copy so the cached plan stays intact
+        plan = dict(estimates[quality.lower()]) if estimates[quality.lower()] else None
+    else:
+        plan = _plan_quality(info, quality)
+    
+    # A clip only downloads its share of the streams
+    duration = info.get('duration')
+    if plan and plan['estimated_bytes'] and duration and (start is not None or end is not None):
+        clip_end = min(end if end is not None else duration, duration)
+        fraction = max(0.0, clip_end - (start or 0.0)) / duration
+        plan['estimated_bytes'] = int(plan['estimated_bytes'] * fraction)
+    return plan
+
+
+def _find_output_file(output_path: str, job_id: str) -> Optional[str]:
+    """
+    Find the finished file for a job.
+    
+    The extension depends on the mode (mp4 video, m4a/opus audio, or the
+    source container when FFmpeg is unavailable), so match on the job ID.
+    """
+    prefix = f"{job_id}."
+    candidates = []
+    for name in os.listdir(output_path):
+        if not name.startswith(prefix) or name.endswith(_INTERMEDIATE_SUFFIXES):
+            continue
+        # Skip per-format intermediates like {job_id}.f137.mp4
+        middle = name[len(prefix):].split('.')
+        if len(middle) > 1 and middle[0].startswith('f') and middle[0][1:].isdigit():
+            continue
+        candidates.append(os.path.join(output_path, name))
+    if not candidates:
+        return None
+    # Prefer the most recently written file (the merge/extract output)
+    return max(candidates, key=os.path.getmtime)
+
+
+def cancel_download(job_id: str) -> bool:
+    """
+    Ask a running download to stop.
+    
+    The flag is checked by the yt-dlp progress hooks, which raise inside
+    yt-dlp; an FFmpeg process already working on the job is killed.
+    
+    Args:
+        job_id: Job identifier
+    
+    Returns:
+        True if a download was running for the job
+    """
+    event = _cancel_events.get(job_id)
+    if event is None:
+        return False
+    event.set()
+    _kill_job_processes(job_id)
+    return True
+
+
+def _kill_job_processes(job_id: str):
+    """
+    Kill FFmpeg child processes writing this job's files.
+    
+    Child processes are found through /proc, so this only works on Linux;
+    elsewhere a running merge finishes and its output is then discarded.
+    """
+    if not os.path.isdir('/proc'):
+        return
+    parent = str(os.getpid())
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat', 'r') as f:
+                # Field 4 is the parent PID; the command name may contain spaces
+                ppid = f.read().rsplit(')', 1)[1].split()[1]
+            if ppid != parent:
+                continue
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read()
+            if b'ffmpeg' in cmdline and job_id.encode() in cmdline:
+                os.kill(int(pid), signal.SIGKILL)
+        except (OSError, IndexError):
+            continue
+
+
+def remove_job_files(output_path: str, job_id: str):
+    """Delete every file of a job: output, .part files and fragments."""
+    prefix = f"{job_id}."
+    try:
+        names = os.listdir(output_path)
+    except OSError:
+        return
+    for name in names:
+        if name.startswith(prefix):
+            try:
+                os.remove(os.path.join(output_path, name))
+            except OSError as e:
+                log.warning("Error deleting partial file", extra={'file': name, 'error': str(e)})
+
+
+def _extract_selected(url: str, format_spec: str) -> Dict:
+    """Extract a video with its planned formats selected (requested_formats, URLs, headers)."""
+    import yt_dlp
+    
+    with yt_dlp.YoutubeDL({'format': format_spec, 'quiet': True, 'no_warnings': True}) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def _try_stream_merge(
+    url: str,
+    output_path: str,
+    job_id: str,
+    format_spec: str,
+    ffmpeg_caps: Dict,
+    cancel_event: threading.Event,
+    on_progress: Optional[Callable[..., None]] = None,
+) -> Optional[str]:
+    """
+    Download a planned video+audio pair through the streaming merge.
+    
+    Returns:
+        Path of the finished MP4, or None if the pair cannot be streamed or
+        the attempt failed (the regular download path is used instead)
+    """
+    output_file = os.path.join(output_path, f"{job_id}.mp4")
+    if os.path.exists(output_file):
+        # Finished before a restart (the streamed output only appears when complete)
+        return output_file
+    
+    pair = streamable_formats(_extract_selected(url, format_spec))
+    if pair is None:
+        return None
+    
+    def report(downloaded, total, speed):
+        log.debug("Download progress", extra={
+            'sample': 'progress', 'downloaded_bytes': downloaded, 'total_bytes': total, 'speed': speed,
+        })
+        if on_progress:
+            on_progress(stage='downloading', downloaded=downloaded, total=total, speed=speed)
+    
+    log.info("Streaming merge", extra={'format': format_spec})
+    try:
+        stream_merge(*pair, ffmpeg_caps['ffmpeg'], output_file, cancel_event.is_set, report)
+    except StreamMergeError as e:
+        if not cancel_event.is_set():
+            log.warning("Streaming merge failed, downloading separate files", extra={'error': str(e)})
+        return None
+    return output_file
+
+
+async def _try_fragment_engine(
+    url: str,
+    output_path: str,
+    job_id: str,
+    format_spec: str,
+    on_progress: Optional[Callable[..., None]] = None,
+) -> Optional[Tuple[bool, str, Optional[str]]]:
+    """
+    Download a planned format whose streams are all fragmented (DASH/HLS) on the event loop.
+    
+    Only the extraction runs on the executor; fragments are fetched by the
+    shared fragment engine and the streams are muxed by an FFmpeg
+    subprocess, so the job holds no thread while it downloads.
+    
+    Returns:
+        The download result, or None if the formats are not fragmented or
+        the attempt failed (the yt-dlp path is used instead)
+    """
+    cancel_event = _cancel_events[job_id]
+    output_file = os.path.join(output_path, f"{job_id}.mp4")
+    if os.path.exists(output_file):
+        # Finished before a restart (the output only appears when complete)
+        return True, "Download completed successfully", output_file
+    
+    try:
+        info = await _run_in_executor(_extract_selected, url, format_spec)
+    except Exception as e:
+        log.warning("Format extraction failed, downloading with yt-dlp", extra={'error': str(e)})
+        return None
+    formats = supported_formats(info)
+    ffmpeg_caps = get_ffmpeg_capabilities()
+    if formats is None or (len(formats) > 1 and not ffmpeg_caps):
+        return None
+    
+    os.makedirs(output_path, exist_ok=True)
+    sizes = [fmt.get('filesize') or fmt.get('filesize_approx') for fmt in formats]
+    total = int(sum(sizes)) if all(sizes) else None
+    started = time.monotonic()
+    downloaded = 0
+    
+    def on_bytes(count: int):
+        nonlocal downloaded
+        downloaded += count
+        speed = downloaded / max(time.monotonic() - started, 1e-3)
+        log.debug("Download progress", extra={
+            'sample': 'progress', 'downloaded_bytes': downloaded, 'total_bytes': total, 'speed': speed,
+        })
+        if on_progress:
+            on_progress(stage='downloading', downloaded=downloaded, total=total, speed=speed)
+    
+    bind_log_context(stage='downloading')
+    log.info("Download started", extra={'format': format_spec, 'engine': 'fragments'})
+    if on_progress:
+        on_progress(stage='downloading')
+    
+    # Numbered like yt-dlp's per-format files so _find_output_file skips them
+    paths = [
+        os.path.join(output_path, f"{job_id}.f{index}.{fmt.get('ext') or 'mp4'}")
+        for index, fmt in enumerate(formats)
+    ]
+    downloads = [
+        asyncio.ensure_future(fragment_engine.download(fmt, path, on_bytes, cancel_event.is_set))
+        for fmt, path in zip(formats, paths)
+    ]
+    try:
+        try:
+            await asyncio.gather(*downloads)
+        finally:
+            # One stream failed: stop the other before its files are removed
+            for task in downloads:
+                task.cancel()
+            await asyncio.gather(*downloads, return_exceptions=True)
+        
+        if ffmpeg_caps:
+            bind_log_context(stage='postprocessing')
+            if on_progress:
+                on_progress(stage='postprocessing')
+            # The job ID is on FFmpeg's command line, so cancel_download can kill it
+            await merge_fragments(ffmpeg_caps['ffmpeg'], paths, output_file + '.part')
+            os.replace(output_file + '.part', output_file)
+        else:
+            output_file = os.path.join(output_path, f"{job_id}.{formats[0].get('ext') or 'mp4'}")
+            os.replace(paths[0], output_file)
+    except Exception as e:
+        remove_job_files(output_path, job_id)
+        if cancel_event.is_set():
+            return False, CANCELLED_MESSAGE, None
+        log.warning("Fragment download failed, downloading with yt-dlp", extra={'error': str(e)})
+        return None
+    
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return True, "Download completed successfully", output_file
+
+
+def _sync_download_video(
+    url: str,
+    output_path: str,
+    quality: str,
+    job_id: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    precise_cut: bool = False,
+    format_spec: Optional[str] = None,
+    on_progress: Optional[Callable[..., None]] = None,
+) -> Tuple[bool, str, Optional[str]]:
     """
     Synchronous function to download video.
     
     Args:
         url: YouTube video URL
         output_path: Directory to save video
-        quality: Quality setting
+        quality: Quality setting ('audio' for audio only)
         job_id: Unique job identifier
+        start: Optional clip start in seconds
+        end: Optional clip end in seconds
+        precise_cut: Re-encode around the cut points for frame accuracy
+        format_spec: Planned format (e.g. '137+140'); the quality-based
+            format string is kept as a fallback
+        on_progress: Called from the download thread with stage and, while
+            downloading, downloaded/total bytes and speed
     
     Returns:
         Tuple of (success, message, filepath)
     """
+    import yt_dlp
+    from yt_dlp.utils import DownloadCancelled
+    
+    cancel_event = _cancel_events.get(job_id) or threading.Event()
+    
+    def check_cancelled(d):
+        # Raising from a hook aborts yt-dlp between chunks and post-processors
+        if cancel_event.is_set():
+            raise DownloadCancelled(CANCELLED_MESSAGE)
+    
+    def download_hook(d):
+        check_cancelled(d)
+        if d['status'] != 'downloading':
+            return
+        downloaded = d.get('downloaded_bytes') or 0
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        # Called for every chunk; the log sampler keeps one record every few seconds
+        log.debug("Download progress", extra={
+            'sample': 'progress', 'downloaded_bytes': downloaded, 'total_bytes': total, 'speed': d.get('speed'),
+        })
+        if on_progress:
+            on_progress(stage='downloading', downloaded=downloaded, total=total, speed=d.get('speed'))
+    
+    def postprocessor_hook(d):
+        check_cancelled(d)
+        if d['status'] == 'started':
+            bind_log_context(stage='postprocessing')
+            log.info("Postprocessing", extra={'postprocessor': d.get('postprocessor')})
+            if on_progress:
+                on_progress(stage='postprocessing')
+    
     try:
+        if cancel_event.is_set():
+            return False, CANCELLED_MESSAGE, None
+        bind_log_context(stage='downloading')
+        log.info("Download started", extra={'quality': quality, 'format': format_spec})
+        if on_progress:
+            on_progress(stage='downloading')
+        
         # Create output directory if it doesn't exist
         os.makedirs(output_path, exist_ok=True)
         
-        # Generate unique filename
-        filename = f"{job_id}.mp4"
-        output_template = os.path.join(output_path, filename)
+        # Generate unique filename; the extension depends on the mode
+        output_template = os.path.join(output_path, f"{job_id}.%(ext)s")
+        
+        # Merge/convert strategy comes from the cached FFmpeg capabilities
+        ffmpeg_caps = get_ffmpeg_capabilities()
+        
+        # A whole (unclipped) video+audio pair is muxed while it downloads, in one write
+        if (STREAMING_MERGE and ffmpeg_caps and format_spec and '+' in format_spec
+                and start is None and end is None and quality.lower() != AUDIO_QUALITY):
+            output_file = _try_stream_merge(
+                url, output_path, job_id, format_spec, ffmpeg_caps, cancel_event, on_progress
+            )
+            if output_file:
+                return True, "Download completed successfully", output_file
+            if cancel_event.is_set():
+                return False, CANCELLED_MESSAGE, None
         
         ydl_opts = {
-            'format': get_format_string(quality),
             'outtmpl': output_template,
-            'merge_output_format': 'mp4',
             
             # Speed optimizations
             'concurrent_fragment_downloads': 8,
@@ -124,57 +684,88 @@ def _sync_download_video(url: str, output_path: str, quality: str, job_id: str)
             'retries': 10,
             'fragment_retries': 10,
             'buffersize': 1024 * 1024 * 2,  # 2MB buffer
+            'continuedl': True,  # resume .part/fragment files left by an interrupted run
             
             'prefer_free_formats': False,
             
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }],
-            
             'quiet': True,
             'no_warnings': True,
+            
+            'progress_hooks': [download_hook],
+            'postprocessor_hooks': [postprocessor_hook],
         }
+        if quality.lower() == AUDIO_QUALITY:
+            ydl_opts.update(ydl_audio_options(ffmpeg_caps))
+        else:
+            ydl_opts['format'] = get_format_string(quality, can_merge=ffmpeg_caps is not None)
+            ydl_opts.update(ydl_ffmpeg_options(ffmpeg_caps))
+        if format_spec:
+            ydl_opts['format'] = f"{format_spec}/{ydl_opts['format']}"
+        
+        # Clip mode: only the requested time range is downloaded
+        ydl_opts.update(ydl_section_options(start, end, precise_cut))
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             ydl.download([url])
         
-        # Find the actual output file (yt-dlp might have added extra extensions)
-        output_file = output_template
-        if not os.path.exists(output_file):
-            # Check for common variations
-            possible_files = [
-                output_template,
-                output_template.replace('.mp4', '.mp4.mp4'),
-                output_template.replace('.mp4', '.webm'),
-            ]
-            for pf in possible_files:
-                if os.path.exists(pf):
-                    output_file = pf
-                    break
+        if cancel_event.is_set():
+            remove_job_files(output_path, job_id)
+            return False, CANCELLED_MESSAGE, None
         
-        if os.path.exists(output_file):
+        output_file = _find_output_file(output_path, job_id)
+        if output_file:
             return True, "Download completed successfully", output_file
         else:
             return False, "Download completed but file not found", None
             
     except Exception as e:
+        if cancel_event.is_set():
+            # A killed FFmpeg surfaces as a post-processing error
+            remove_job_files(output_path, job_id)
+            return False, CANCELLED_MESSAGE, None
         return False, f"Download failed: {str(e)}", None
 
 
-async def download_video(url: str, output_path: str, quality: str, job_id: str) -> Tuple[bool, str, Optional[str]]:
+async def download_video(
+    url: str,
+    output_path: str,
+    quality: str,
+    job_id: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    precise_cut: bool = False,
+    format_spec: Optional[str] = None,
+    on_progress: Optional[Callable[..., None]] = None,
+) -> Tuple[bool, str, Optional[str]]:
     """
     Download video asynchronously.
     
     Args:
         url: YouTube video URL
         output_path: Directory to save video
-        quality: Quality setting
+        quality: Quality setting ('audio' for audio only)
         job_id: Unique job identifier
+        start: Optional clip start in seconds
+        end: Optional clip end in seconds
+        precise_cut: Re-encode around the cut points for frame accuracy
+        format_spec: Planned format spec from plan_download
+        on_progress: Progress callback (see _sync_download_video)
     
     Returns:
         Tuple of (success, message, filepath)
     """
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, _sync_download_video, url, output_path, quality, job_id)
-
+    # Registered before the executor picks the job up so cancel_download sees it
+    _cancel_events[job_id] = threading.Event()
+    try:
+        # Whole DASH/HLS downloads can run on the event loop, without an executor thread
+        if (ASYNC_FRAGMENTS and format_spec and start is None and end is None
+                and quality.lower() != AUDIO_QUALITY and fragment_engine.available()):
+            result = await _try_fragment_engine(url, output_path, job_id, format_spec, on_progress)
+            if result:
+                return result
+        return await _run_in_executor(
+            _sync_download_video, url, output_path, quality, job_id, start, end, precise_cut, format_spec,
+            on_progress
+        )
+    finally:
+        _cancel_events.pop(job_id, None)
@@ -0,0 +1,335 @@
+"""
+FFmpeg/ffprobe discovery and capability detection shared by the CLI, the GUI
+and the web backend.
+
+The probe runs once per machine: results are written to a small JSON cache
+keyed on the ffmpeg binary's path, size and mtime, so later launches only
+need a stat() call. Upgrading or moving ffmpeg invalidates the cache.
+"""
+import os
+import json
+import math
+import shutil
+import subprocess
+import threading
+
+
+# Persistent capability cache (override with FFMPEG_CACHE_FILE)
+CACHE_FILE = os.environ.get(
+    'FFMPEG_CACHE_FILE',
+    os.path.join(os.path.expanduser('~'), '.youtube_downloader_ffmpeg.json')
+)
+
+# Bump when the cached record layout changes
+CACHE_VERSION = 1
+
+# Encoders we care about when deciding between remuxing and converting
+INTERESTING_ENCODERS = ('libx264', 'h264', 'aac', 'libopus', 'opus', 'libmp3lame')
+
+# In-process memo so repeated calls are free
+_capabilities = None
+_probed = False
+_lock = threading.Lock()
+
+
+def _exe(name):
+    return name + '.exe' if os.name == 'nt' else name
+
+
+def _validity_key(path):
+    """Return a key that changes whenever the binary is replaced."""
+    st = os.stat(path)
+    return {'path': path, 'size': st.st_size, 'mtime': st.st_mtime}
+
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('cache_version') != CACHE_VERSION:
+        return None
+    return data
+
+
+def _save_cache(capabilities):
+    try:
+        tmp_path = CACHE_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(capabilities, f, indent=2)
+        os.replace(tmp_path, CACHE_FILE)
+    except OSError:
+        pass
+
+
+def _find_in_winget():
+    """Search the winget packages tree for ffmpeg.exe (slow; result is cached)."""
+    winget_base = os.path.join(os.environ.get('LOCALAPPDATA', ''),
+                               'Microsoft', 'WinGet', 'Packages')
+    if not os.path.exists(winget_base):
+        return None
+    for item in os.listdir(winget_base):
+        if 'ffmpeg' in item.lower():
+            # Look for ffmpeg.exe in subdirectories
+            package_dir = os.path.join(winget_base, item)
+            for root, dirs, files in os.walk(package_dir):
+                if 'ffmpeg.exe' in files:
+                    return os.path.join(root, 'ffmpeg.exe')
+    return None
+
+
+def _find_ffmpeg(cached):
+    """
+    Locate the ffmpeg binary.
+
+    Order: PATH, the location recorded in the cache, then the winget
+    packages tree.
+    """
+    path = shutil.which('ffmpeg')
+    if path:
+        return os.path.abspath(path)
+    if cached and cached.get('ffmpeg') and os.path.isfile(cached['ffmpeg']):
+        return cached['ffmpeg']
+    return _find_in_winget()
+
+
+def _run(args):
+    result = subprocess.run(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace',
+        check=True,
+        timeout=30,
+    )
+    return result.stdout
+
+
+def _parse_encoders(output):
+    """Parse `ffmpeg -encoders` output into a set of encoder names."""
+    encoders = set()
+    in_list = False
+    for line in output.splitlines():
+        if line.strip().startswith('------'):
+            in_list = True
+            continue
+        parts = line.split()
+        if in_list and len(parts) >= 2:
+            encoders.add(parts[1])
+    return encoders
+
+
+def _parse_muxers(output):
+    """Parse `ffmpeg -muxers` output into a set of muxer names."""
+    muxers = set()
+    in_list = False
+    for line in output.splitlines():
+        if line.strip() == '--':
+            in_list = True
+            continue
+        parts = line.split()
+        if in_list and len(parts) >= 2 and 'E' in parts[0]:
+            muxers.update(parts[1].split(','))
+    return muxers
+
+
+def _probe_binary(ffmpeg):
+    """Run ffmpeg once to collect version, encoders and muxers."""
+    version_output = _run([ffmpeg, '-hide_banner', '-version'])
+    version = version_output.splitlines()[0] if version_output else ''
+    encoders = _parse_encoders(_run([ffmpeg, '-hide_banner', '-encoders']))
+    muxers = _parse_muxers(_run([ffmpeg, '-hide_banner', '-muxers']))
+
+    ffprobe = os.path.join(os.path.dirname(ffmpeg), _exe('ffprobe'))
+    if not os.path.isfile(ffprobe):
+        ffprobe = shutil.which('ffprobe')
+
+    return {
+        'cache_version': CACHE_VERSION,
+        'key': _validity_key(ffmpeg),
+        'ffmpeg': ffmpeg,
+        'ffprobe': ffprobe,
+        'version': version,
+        'encoders': sorted(e for e in encoders if e in INTERESTING_ENCODERS),
+        # Stream copy needs no encoder, only a muxer for the container
+        'stream_copy_mp4': 'mp4' in muxers,
+        'stream_copy_m4a': 'ipod' in muxers or 'mp4' in muxers,
+        'stream_copy_webm': 'webm' in muxers,
+    }
+
+
+def get_ffmpeg_capabilities(refresh=False):
+    """
+    Find ffmpeg and return its capabilities, or None if it is not installed.
+
+    Also puts ffmpeg's directory on PATH for this process so yt-dlp finds it.
+
+    Args:
+        refresh: Ignore the in-process memo and the on-disk cache
+
+    Returns:
+        Capability dict (see _probe_binary) or None
+    """
+    global _capabilities, _probed
+    with _lock:
+        if _probed and not refresh:
+            return _capabilities
+
+        cached = None if refresh else _load_cache()
+        ffmpeg = _find_ffmpeg(cached)
+        capabilities = None
+        if ffmpeg:
+            try:
+                key = _validity_key(ffmpeg)
+                if cached and cached.get('key') == key:
+                    capabilities = cached
+                else:
+                    capabilities = _probe_binary(ffmpeg)
+                    _save_cache(capabilities)
+            except (OSError, subprocess.SubprocessError):
+                capabilities = None
+
+        if capabilities:
+            ffmpeg_dir = os.path.dirname(capabilities['ffmpeg'])
+            if shutil.which('ffmpeg') is None:
+                os.environ['PATH'] = ffmpeg_dir + os.pathsep + os.environ.get('PATH', '')
+
+        _capabilities = capabilities
+        _probed = True
+        return capabilities
+
+
+def check_ffmpeg():
+    """
+    Check if ffmpeg is installed and accessible.
+    Returns True if available, False otherwise.
+    Also adds FFmpeg to PATH if found in common winget locations.
+    """
+    return get_ffmpeg_capabilities() is not None
+
+
+def ydl_ffmpeg_options(capabilities):
+    """
+    yt-dlp options for merging and post-processing with the detected ffmpeg.
+
+    Without ffmpeg nothing can be merged, so callers must fall back to a
+    single-file format. When ffmpeg has no H.264/AAC encoders a conversion
+    would fail mid-job, so the output is only remuxed (stream copy) to MP4.
+
+    Args:
+        capabilities: Result of get_ffmpeg_capabilities()
+
+    Returns:
+        Dictionary of yt-dlp options
+    """
+    if not capabilities:
+        return {'postprocessors': []}
+
+    opts = {
+        'ffmpeg_location': capabilities['ffmpeg'],
+        'merge_output_format': 'mp4',
+    }
+    encoders = set(capabilities.get('encoders', ()))
+    can_convert = encoders & {'libx264', 'h264'} and 'aac' in encoders
+    if can_convert:
+        opts['postprocessors'] = [{
+            'key': 'FFmpegVideoConvertor',
+            'preferedformat': 'mp4',
+        }]
+    elif capabilities.get('stream_copy_mp4'):
+        opts['postprocessors'] = [{
+            'key': 'FFmpegVideoRemuxer',
+            'preferedformat': 'mp4',
+        }]
+    else:
+        opts['postprocessors'] = []
+    return opts
+
+
+def ydl_audio_options(capabilities):
+    """
+    yt-dlp options for audio-only downloads.
+
+    Prefers an m4a (AAC) stream, then Opus. With FFmpeg the audio is
+    extracted by stream copy into .m4a/.opus (no transcode); without it the
+    selected audio stream is saved as-is.
+
+    Args:
+        capabilities: Result of get_ffmpeg_capabilities()
+
+    Returns:
+        Dictionary of yt-dlp options (including 'format')
+    """
+    opts = {
+        'format': 'bestaudio[ext=m4a]/bestaudio[acodec=opus]/bestaudio/best',
+        'postprocessors': [],
+    }
+    if capabilities and capabilities.get('stream_copy_m4a'):
+        opts['ffmpeg_location'] = capabilities['ffmpeg']
+        # 'best' keeps the source codec, so this is a container change only
+        opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'best',
+        }]
+    return opts
+
+
+def parse_timestamp(value):
+    """
+    Parse a clip timestamp given as seconds ('90', '90.5') or [H:]MM:SS.
+
+    Returns:
+        Seconds as float, or None for an empty value
+
+    Raises:
+        ValueError: If the value is not a valid timestamp
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        value = value.strip()
+        if not value:
+            return None
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+    if not math.isfinite(seconds):
+        raise ValueError(f"Timestamp must be a finite number: {value}")
+    if seconds < 0:
+        raise ValueError(f"Timestamp must not be negative: {value}")
+    return seconds
+
+
+def ydl_section_options(start=None, end=None, precise=False):
+    """
+    yt-dlp options to download only the [start, end) time range.
+
+    Only the fragments/byte ranges covering the section are fetched. By
+    default cuts snap to the nearest keyframes so the streams are copied
+    without re-encoding; precise=True forces keyframes at the exact cut
+    points, which re-encodes the edges.
+
+    Args:
+        start: Start time in seconds (None for the beginning)
+        end: End time in seconds (None for the end of the video)
+        precise: Re-encode around the cuts for frame-accurate boundaries
+
+    Returns:
+        Dictionary of yt-dlp options (empty when no range is given)
+    """
+    if start is None and end is None:
+        return {}
+    start = start or 0.0
+    end = float('inf') if end is None else end
+    if end <= start:
+        raise ValueError("Clip end must be after clip start")
+
+    from yt_dlp.utils import download_range_func
+    return {
+        'download_ranges': download_range_func(None, [(start, end)]),
+        'force_keyframes_at_cuts': precise,
+    }
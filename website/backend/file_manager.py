@@ -2,86 +2,429 @@
 File manager for handling temporary downloads with expiring links.
 """
 import os
+import sys
 import time
 import uuid
+from dataclasses import dataclass, fields
+from enum import Enum
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Set
 from datetime import datetime, timedelta
 import asyncio
 
+from job_journal import JobJournal
+from scratch import scratch_space
+from structured_log import get_logger
+
+log = get_logger('file_manager')
+
+# A job interrupted by this many restarts in a row is failed instead of resumed
+MAX_RESUMES = 3
+
+
+class JobStatus(str, Enum):
+    """Job states. Members are shared by every job and compare equal to their string values."""
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+
+ACTIVE_STATUSES = frozenset((JobStatus.PENDING, JobStatus.PROCESSING))
+
+
+@dataclass(slots=True)
+class Job:
+    """A download job. Slotted, so unknown fields are rejected and no per-job dict is kept."""
+    created_at: float
+    last_seen: float  # last time a client asked about the job
+    status: JobStatus = JobStatus.PENDING
+    progress: int = 0
+    filepath: Optional[str] = None
+    error: Optional[str] = None
+    token: Optional[str] = None
+    request: Optional[Dict] = None  # download parameters, for resuming after a restart
+    client: Optional[str] = None  # rate-limit key of the client that started the job
+    plan: Optional[Dict] = None  # format plan (see format_planner)
+    resumes: int = 0
+    callback_url: Optional[str] = None  # receives a webhook when the job finishes
+    # Live progress, updated from the download thread and not journaled
+    stage: Optional[str] = None  # extracting, queued (waiting for a worker), downloading, postprocessing
+    downloaded_bytes: int = 0
+    total_bytes: Optional[int] = None
+    speed: Optional[float] = None  # bytes per second
+    version: int = 0  # bumped on every status/progress/stage change, for long-polling
+    
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+    
+    def to_dict(self) -> Dict:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Job':
+        known = {f.name for f in fields(cls)}
+        job = cls(**{k: v for k, v in data.items() if k in known})
+        job.status = JobStatus(job.status)
+        return job
+
+
+JOB_FIELDS = frozenset(f.name for f in fields(Job))
+
+
+@dataclass(slots=True)
+class Token:
+    """A one-time download link for a finished file."""
+    filepath: str
+    original_filename: str
+    created_at: float
+    downloaded: bool = False
+    job_id: Optional[str] = None  # job that produced the file
+    
+    def to_dict(self) -> Dict:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Token':
+        known = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in known})
+
 
 class FileManager:
     """Manages temporary download files with token-based access and expiration."""
     
-    def __init__(self, download_dir: str = "downloads", expiry_hours: int = 1):
+    def __init__(self, download_dir: str = "downloads", expiry_hours: int = 1,
+                 journal_path: Optional[str] = None):
         """
         Initialize the file manager.
         
         Args:
             download_dir: Directory for temporary downloads
             expiry_hours: Hours until files/tokens expire
+            journal_path: Write-ahead journal for jobs and tokens (None keeps them in memory only)
         """
         self.download_dir = download_dir
         self.expiry_hours = expiry_hours
         self.expiry_seconds = expiry_hours * 3600
         
-        # Token storage: token -> {filepath, created_at, downloaded, original_filename}
-        self.tokens: Dict[str, Dict] = {}
+        # Token storage: token -> Token
+        self.tokens: Dict[str, Token] = {}
+        
+        # Job storage: job_id -> Job (insertion order is creation order)
+        self.jobs: Dict[str, Job] = {}
+        
+        # Secondary indexes, kept in step by every method that changes a record
+        # (job -> token is Job.token, token -> job is Token.job_id)
+        self.jobs_by_status: Dict[JobStatus, Set[str]] = {status: set() for status in JobStatus}
+        self.active_jobs_by_client: Dict[str, Set[str]] = {}  # unfinished jobs only
+        self.token_count_by_path: Dict[str, int] = {}  # a count, not a set per file, to keep it small
+        
+        self.journal = JobJournal(journal_path) if journal_path else None
         
-        # Job storage: job_id -> {status, progress, filepath, error, token}
-        self.jobs: Dict[str, Dict] = {}
+        # Change notification: long-poll waiters per job, and status listeners
+        # (webhooks). Changes can come from download threads, so waking
+        # happens on the event loop that owns the waiters.
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._listeners: List[Callable[[str, Job], None]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
         
         # Create download directory
         os.makedirs(download_dir, exist_ok=True)
         
-    def create_job(self) -> str:
+    def recover(self) -> List[str]:
+        """
+        Reload jobs and tokens from the journal after a restart.
+        
+        Unfinished jobs go back to 'pending' with their original job ID so
+        they can be re-queued; their .part and fragment files are kept and
+        the download resumes from them.
+        
+        Returns:
+            IDs of the jobs to resume
+        """
+        if not self.journal:
+            return []
+        
+        job_records, token_records = self.journal.replay()
+        now = time.time()
+        resumable = []
+        for job_id, record in job_records.items():
+            job = self.jobs[job_id] = Job.from_dict(record)
+            if not job.active:
+                continue
+            if not job.request or job.resumes >= MAX_RESUMES:
+                job.status = JobStatus.FAILED
+                job.error = 'Download interrupted by a server restart'
+            else:
+                # Give the client a fresh abandonment window to reconnect
+                job.status = JobStatus.PENDING
+                job.resumes += 1
+                job.last_seen = now
+                resumable.append(job_id)
+        
+        for token, record in token_records.items():
+            self.tokens[token] = Token.from_dict(record)
+        self._rebuild_indexes()
+        self.journal.compact(self.jobs, self.tokens)
+        return resumable
+    
+    def _rebuild_indexes(self):
+        for job_ids in self.jobs_by_status.values():
+            job_ids.clear()
+        self.active_jobs_by_client.clear()
+        self.token_count_by_path.clear()
+        for job_id, job in self.jobs.items():
+            self._index_job(job_id, job)
+        for token, info in self.tokens.items():
+            _add_count(self.token_count_by_path, info.filepath, 1)
+    
+    def _index_job(self, job_id: str, job: Job):
+        self.jobs_by_status[job.status].add(job_id)
+        if job.client and job.active:
+            self.active_jobs_by_client.setdefault(job.client, set()).add(job_id)
+    
+    def _delete_job(self, job_id: str):
+        job = self.jobs.pop(job_id)
+        self.jobs_by_status[job.status].discard(job_id)
+        if job.client:
+            _discard(self.active_jobs_by_client, job.client, job_id)
+        self._journal('job', job_id)
+    
+    def clear(self):
+        """Drop every job and token (without touching files or the journal)."""
+        self.jobs.clear()
+        self.tokens.clear()
+        self._rebuild_indexes()
+    
+    def _journal(self, kind: str, record_id: str, fields: Optional[Dict] = None):
+        """Queue a job/token change for the journal's writer thread (a deletion if fields is None)."""
+        if not self.journal:
+            return
+        if fields is None:
+            self.journal.record_delete(kind, record_id)
+        else:
+            self.journal.record(kind, record_id, fields)
+    
+    def create_job(self, request: Optional[Dict] = None, client: Optional[str] = None,
+                   callback_url: Optional[str] = None) -> str:
         """
         Create a new download job.
         
+        Args:
+            request: Download parameters, kept so the job can be resumed after a restart
+            client: Rate-limit key of the client that started the job
+            callback_url: URL notified when the job finishes
+        
         Returns:
             Job ID
         """
         job_id = str(uuid.uuid4())
-        self.jobs[job_id] = {
-            'status': 'pending',  # pending, processing, completed, failed
-            'progress': 0,
-            'filepath': None,
-            'error': None,
-            'token': None,
-            'created_at': time.time(),
-        }
+        now = time.time()
+        job = self.jobs[job_id] = Job(
+            created_at=now,
+            last_seen=now,
+            request=request,
+            # Many jobs share a client key; keep one copy of it
+            client=sys.intern(client) if client else None,
+            callback_url=callback_url,
+        )
+        self._index_job(job_id, job)
+        self._journal('job', job_id, job.to_dict())
         return job_id
     
     def update_job(self, job_id: str, **kwargs):
-        """Update job status and information."""
-        if job_id in self.jobs:
-            self.jobs[job_id].update(kwargs)
+        """
+        Update job status and information.
+        
+        Raises:
+            AttributeError: If a keyword is not a Job field
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        unknown = kwargs.keys() - JOB_FIELDS
+        if unknown:
+            raise AttributeError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        status_changed = False
+        if 'status' in kwargs:
+            kwargs['status'] = status = JobStatus(kwargs['status'])
+            if status is not job.status:
+                self.jobs_by_status[job.status].discard(job_id)
+                self.jobs_by_status[status].add(job_id)
+                if job.client and status not in ACTIVE_STATUSES:
+                    _discard(self.active_jobs_by_client, job.client, job_id)
+                elif job.client:
+                    self.active_jobs_by_client.setdefault(job.client, set()).add(job_id)
+                status_changed = True
+        for name, value in kwargs.items():
+            setattr(job, name, value)
+        self._journal('job', job_id, kwargs)
+        self._changed(job_id, job, status_changed)
     
-    def get_job(self, job_id: str) -> Optional[Dict]:
+    def set_progress(self, job_id: str, stage: Optional[str] = None, downloaded: Optional[int] = None,
+                     total: Optional[int] = None, speed: Optional[float] = None):
+        """
+        Record live download progress.
+        
+        Called many times a second from the download thread, so it only sets
+        attributes (no journal write). While downloading, the job's progress
+        moves from 25% to 95%.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        before = (job.stage, job.progress)
+        if stage is not None:
+            job.stage = stage
+        if downloaded is not None:
+            job.downloaded_bytes = downloaded
+            job.total_bytes = total
+            job.speed = speed
+            if total:
+                job.progress = max(job.progress, 25 + int(70 * min(downloaded / total, 1.0)))
+        # Byte counts alone do not wake long-polls; a new stage or percentage does
+        if (job.stage, job.progress) != before:
+            self._changed(job_id, job)
+    
+    def subscribe(self, listener: Callable[[str, Job], None]):
+        """
+        Register a function called with (job_id, job) whenever a job's status changes.
+        
+        Listeners run on the event loop and must not block.
+        """
+        self._listeners.append(listener)
+    
+    def _changed(self, job_id: str, job: Job, status_changed: bool = False):
+        """Bump a job's version and wake its waiters (and listeners on a status change)."""
+        job.version += 1
+        if not self._waiters.get(job_id) and not (status_changed and self._listeners):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            self._loop = loop
+            self._wake(job_id, status_changed)
+        elif self._loop is not None and not self._loop.is_closed():
+            # Called from a download thread
+            self._loop.call_soon_threadsafe(self._wake, job_id, status_changed)
+        else:
+            self._wake(job_id, status_changed)
+    
+    def _wake(self, job_id: str, status_changed: bool):
+        for waiter in self._waiters.pop(job_id, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+        job = self.jobs.get(job_id)
+        if status_changed and job is not None:
+            for listener in self._listeners:
+                try:
+                    listener(job_id, job)
+                except Exception:
+                    log.exception("Job listener raised", extra={'job_id': job_id})
+    
+    async def wait_for_change(self, job_id: str, version: int, timeout: float) -> Optional[Job]:
+        """
+        Wait until a job's version differs from `version` (long-poll).
+        
+        Returns at once if it already differs or the job has finished.
+        
+        Args:
+            job_id: Job identifier
+            version: Version the client last saw
+            timeout: Maximum seconds to wait
+        
+        Returns:
+            The job (unchanged if the wait timed out), or None if it does not exist
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.version != version or not job.active:
+            return job
+        self._loop = asyncio.get_running_loop()
+        waiter = self._loop.create_future()
+        self._waiters.setdefault(job_id, set()).add(waiter)
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        finally:
+            waiters = self._waiters.get(job_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[job_id]
+        return self.jobs.get(job_id)
+    
+    def get_job(self, job_id: str) -> Optional[Job]:
         """Get job information."""
         return self.jobs.get(job_id)
     
-    def create_token(self, filepath: str, original_filename: str) -> str:
+    def touch_job(self, job_id: str):
+        """Record that a client is still interested in a job."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.last_seen = time.time()
+    
+    def jobs_with_status(self, *statuses: str) -> List[str]:
+        """IDs of the jobs in any of the given states."""
+        return [job_id for status in statuses for job_id in self.jobs_by_status[JobStatus(status)]]
+    
+    def active_job_ids(self) -> List[str]:
+        """IDs of the pending and processing jobs."""
+        return self.jobs_with_status(*ACTIVE_STATUSES)
+    
+    def count_active_jobs(self, client: str) -> int:
+        """Count a client's unfinished jobs."""
+        return len(self.active_jobs_by_client.get(client, ()))
+    
+    def is_file_referenced(self, filepath: str) -> bool:
+        """Whether any live token still points at a file."""
+        return filepath in self.token_count_by_path
+    
+    def find_abandoned_jobs(self, timeout: float) -> List[str]:
+        """
+        Find unfinished jobs that no client has asked about recently.
+        
+        Jobs with a callback URL are never abandoned: their client waits
+        for the webhook instead of polling.
+        
+        Args:
+            timeout: Seconds without a status request after which a job is abandoned
+        
+        Returns:
+            List of job IDs
+        """
+        cutoff = time.time() - timeout
+        return [
+            job_id for job_id in self.active_job_ids()
+            if self.jobs[job_id].last_seen < cutoff and not self.jobs[job_id].callback_url
+        ]
+    
+    def create_token(self, filepath: str, original_filename: str, job_id: Optional[str] = None) -> str:
         """
         Create a download token for a file.
         
         Args:
             filepath: Path to the downloaded file
             original_filename: Original video title for download
+            job_id: Job that produced the file
         
         Returns:
             Download token
         """
         token = str(uuid.uuid4())
-        self.tokens[token] = {
-            'filepath': filepath,
-            'created_at': time.time(),
-            'downloaded': False,
-            'original_filename': original_filename,
-        }
+        self.tokens[token] = Token(
+            filepath=filepath,
+            original_filename=original_filename,
+            created_at=time.time(),
+            job_id=job_id,
+        )
+        _add_count(self.token_count_by_path, filepath, 1)
+        self._journal('token', token, self.tokens[token].to_dict())
         return token
     
-    def get_file_by_token(self, token: str) -> Optional[Dict]:
+    def get_file_by_token(self, token: str) -> Optional[Token]:
         """
         Get file information by token.
         
@@ -89,7 +432,7 @@ class FileManager:
             token: Download token
         
         Returns:
-            File info dict or None if token invalid/expired
+            Token record or None if token invalid/expired
         """
         if token not in self.tokens:
             return None
@@ -97,16 +440,16 @@ class FileManager:
         token_info = self.tokens[token]
         
         # Check if token expired
-        if time.time() - token_info['created_at'] > self.expiry_seconds:
+        if time.time() - token_info.created_at > self.expiry_seconds:
             self.invalidate_token(token)
             return None
         
         # Check if already downloaded (one-time use)
-        if token_info['downloaded']:
+        if token_info.downloaded:
             return None
         
         # Check if file exists
-        if not os.path.exists(token_info['filepath']):
+        if not os.path.exists(token_info.filepath):
             self.invalidate_token(token)
             return None
         
@@ -115,12 +458,18 @@ class FileManager:
     def mark_downloaded(self, token: str):
         """Mark a token as used (downloaded)."""
         if token in self.tokens:
-            self.tokens[token]['downloaded'] = True
+            self.tokens[token].downloaded = True
+            self._journal('token', token, {'downloaded': True})
     
     def invalidate_token(self, token: str):
         """Remove a token from valid tokens."""
         if token in self.tokens:
-            del self.tokens[token]
+            self._delete_token(token)
+    
+    def _delete_token(self, token: str):
+        info = self.tokens.pop(token)
+        _add_count(self.token_count_by_path, info.filepath, -1)
+        self._journal('token', token)
     
     def cleanup_old_files(self):
         """Remove expired files and tokens."""
@@ -129,43 +478,65 @@ class FileManager:
         # Clean up expired tokens
         expired_tokens = []
         for token, info in self.tokens.items():
-            if current_time - info['created_at'] > self.expiry_seconds:
+            if current_time - info.created_at > self.expiry_seconds:
                 expired_tokens.append(token)
-                # Delete the file
-                try:
-                    if os.path.exists(info['filepath']):
-                        os.remove(info['filepath'])
-                except Exception as e:
-                    print(f"Error deleting file {info['filepath']}: {e}")
         
         for token in expired_tokens:
-            del self.tokens[token]
+            filepath = self.tokens[token].filepath
+            self._delete_token(token)
+            # Delete the file unless another live token still serves it
+            if self.is_file_referenced(filepath):
+                continue
+            try:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            except Exception as e:
+                log.warning("Error deleting file", extra={'filepath': filepath, 'error': str(e)})
         
-        # Clean up old jobs (keep for 24 hours)
+        # Clean up old jobs (keep for 24 hours). Jobs are stored in creation
+        # order, so the scan stops at the first job that is young enough.
         job_expiry = 24 * 3600
         expired_jobs = []
         for job_id, job_info in self.jobs.items():
-            if current_time - job_info['created_at'] > job_expiry:
-                expired_jobs.append(job_id)
+            if current_time - job_info.created_at <= job_expiry:
+                break
+            expired_jobs.append(job_id)
         
         for job_id in expired_jobs:
-            del self.jobs[job_id]
+            self._delete_job(job_id)
+        
+        # Partial files of unfinished jobs are still needed, however old they are
+        active_prefixes = tuple(f"{job_id}." for job_id in self.active_job_ids())
+        journal_file = os.path.abspath(self.journal.path) if self.journal else None
         
         # Clean up orphaned files in download directory
         try:
             for filename in os.listdir(self.download_dir):
                 filepath = os.path.join(self.download_dir, filename)
+                if active_prefixes and filename.startswith(active_prefixes):
+                    continue
+                if journal_file and os.path.abspath(filepath).startswith(journal_file):
+                    continue
+                if self.is_file_referenced(filepath):
+                    continue
                 if os.path.isfile(filepath):
                     file_age = current_time - os.path.getctime(filepath)
                     if file_age > self.expiry_seconds:
                         try:
                             os.remove(filepath)
                         except Exception as e:
-                            print(f"Error deleting orphaned file {filepath}: {e}")
-        except Exception as e:
-            print(f"Error cleaning up download directory: {e}")
+                            log.warning("Error deleting orphaned file",
+                                        extra={'filepath': filepath, 'error': str(e)})
+        except Exception:
+            log.exception("Error cleaning up download directory")
         
-        print(f"Cleanup complete: Removed {len(expired_tokens)} expired tokens, {len(expired_jobs)} old jobs")
+        # Files that crashed or abandoned jobs left in the scratch directory
+        scratch_space.sweep(self.expiry_seconds, self.active_job_ids())
+        
+        log.info("Cleanup complete", extra={
+            'expired_tokens': len(expired_tokens),
+            'expired_jobs': len(expired_jobs),
+        })
     
     async def start_cleanup_task(self):
         """Background task to periodically clean up old files."""
@@ -174,6 +545,26 @@ class FileManager:
             self.cleanup_old_files()
 
 
-# Global file manager instance
-file_manager = FileManager()
+def _discard(index: Dict[str, Set[str]], key: str, value: str):
+    """Remove a value from an index set, dropping the set once it is empty."""
+    values = index.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del index[key]
+
+
+def _add_count(index: Dict[str, int], key: str, delta: int):
+    """Adjust a count in an index, dropping the key once it reaches zero."""
+    count = index.get(key, 0) + delta
+    if count > 0:
+        index[key] = count
+    else:
+        index.pop(key, None)
+
+
+# Global file manager instance; the journal lets jobs survive restarts (empty JOB_JOURNAL_FILE disables it)
+file_manager = FileManager(
+    journal_path=os.environ.get('JOB_JOURNAL_FILE', os.path.join('downloads', '.jobs.journal')) or None
+)
 
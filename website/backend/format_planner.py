@@ -0,0 +1,250 @@
+"""
+Format planner: picks the cheapest-to-produce format that meets a quality
+request, using the `formats` list yt-dlp already returns from extraction.
+
+Candidates (progressive formats and video+audio pairs) are scored on:
+  - estimated bytes to download (filesize, filesize_approx or bitrate x duration)
+  - whether the result can be stream-copied into MP4 or needs a transcode
+  - how widely the codecs play back inside an MP4 container
+
+The resulting plan carries an explicit format spec ("137+140") plus its
+expected cost, so the job can report what it will download up front.
+"""
+
+# Video codecs that can be stream-copied into MP4, best playback support first
+MP4_VIDEO_CODECS = ('avc1', 'h264', 'av01', 'hvc1', 'hev1', 'vp09', 'vp9')
+
+# Audio codecs that can be stream-copied into MP4, best playback support first
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'opus', 'mp3', 'ec-3', 'ac-3')
+
+# Relative penalty (as a fraction of the candidate's size) for codecs that
+# mux into MP4 but play back on fewer devices
+COMPATIBILITY_PENALTY = {
+    'avc1': 0.0, 'h264': 0.0, 'mp4a': 0.0, 'aac': 0.0, 'mp3': 0.0,
+    'av01': 0.15, 'hvc1': 0.2, 'hev1': 0.2, 'vp09': 0.25, 'vp9': 0.25,
+    'opus': 0.05, 'ec-3': 0.2, 'ac-3': 0.2,
+}
+
+# A transcode costs far more than any realistic size difference
+TRANSCODE_PENALTY = 10.0
+
+# Target audio quality: the best available bitrate, capped at this (kbps)
+AUDIO_TARGET_ABR = 128
+
+# Height used for "best"
+BEST_HEIGHT = 99999
+
+QUALITY_HEIGHTS = {
+    "2160p": 2160,
+    "1440p": 1440,
+    "1080p": 1080,
+    "720p": 720,
+    "480p": 480,
+    "best": BEST_HEIGHT,
+}
+
+
+def quality_to_height(quality):
+    """Map a quality label ('1080p', 'best', ...) to a maximum height."""
+    return QUALITY_HEIGHTS.get((quality or '').lower(), 1080)
+
+
+def _codec_family(codec):
+    """Normalise a codec string like 'avc1.640028' to its family ('avc1')."""
+    if not codec or codec == 'none':
+        return None
+    return codec.split('.')[0].lower()
+
+
+def _has_video(fmt):
+    return fmt.get('vcodec') not in (None, 'none')
+
+
+def _has_audio(fmt):
+    return fmt.get('acodec') not in (None, 'none')
+
+
+def estimate_bytes(fmt, duration):
+    """
+    Estimate a format's download size in bytes.
+
+    Returns:
+        Size in bytes, or None if neither size nor bitrate is known
+    """
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    bitrate = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
+
+
+def _penalty(codec):
+    family = _codec_family(codec)
+    if family is None:
+        return 0.0
+    return COMPATIBILITY_PENALTY.get(family, 0.5)
+
+
+def _mp4_copyable(vcodec, acodec):
+    """True if both streams can be put in an MP4 container without re-encoding."""
+    v = _codec_family(vcodec)
+    a = _codec_family(acodec)
+    return (v is None or v in MP4_VIDEO_CODECS) and (a is None or a in MP4_AUDIO_CODECS)
+
+
+def _is_downloadable(fmt):
+    # Storyboards and other image-only "formats" are not media
+    if fmt.get('format_note') == 'storyboard' or fmt.get('ext') == 'mhtml':
+        return False
+    return bool(fmt.get('format_id'))
+
+
+def _candidate(video, audio, duration, has_ffmpeg):
+    """Build a scored plan for a progressive format or a video+audio pair."""
+    needs_merge = video is not None and audio is not None
+    if needs_merge and not has_ffmpeg:
+        return None
+
+    vcodec = video.get('vcodec') if video else None
+    if audio is not None:
+        acodec = audio.get('acodec')
+    else:
+        acodec = video.get('acodec') if video and _has_audio(video) else None
+
+    parts = [f for f in (video, audio) if f is not None]
+    sizes = [estimate_bytes(f, duration) for f in parts]
+    size = sum(sizes) if all(s is not None for s in sizes) else None
+
+    # Merged output is muxed straight into MP4; a progressive file in another
+    # container goes through the MP4 converter, which re-encodes
+    copyable = _mp4_copyable(vcodec, acodec)
+    if not needs_merge and parts[0].get('ext') != 'mp4':
+        copyable = False
+    needs_transcode = has_ffmpeg and not copyable
+
+    penalty = _penalty(vcodec) + _penalty(acodec)
+    if needs_transcode:
+        penalty += TRANSCODE_PENALTY
+
+    return {
+        'format': '+'.join(f['format_id'] for f in parts),
+        'height': (video or {}).get('height'),
+        'fps': (video or {}).get('fps'),
+        'vcodec': _codec_family(vcodec),
+        'acodec': _codec_family(acodec),
+        'ext': 'mp4' if has_ffmpeg else parts[0].get('ext'),
+        'estimated_bytes': size,
+        'needs_merge': needs_merge,
+        'needs_transcode': needs_transcode,
+        # Unknown sizes rank after every candidate with a known size
+        '_score': size * (1 + penalty) if size is not None else float('inf'),
+    }
+
+
+def plan_format(info, quality='1080p', capabilities=None):
+    """
+    Choose the cheapest format that satisfies a video quality request.
+
+    The chosen height is the highest one available at or below the request;
+    among candidates at that height the cheapest (size x compatibility, with
+    a heavy penalty for anything that would need a transcode) wins.
+
+    Args:
+        info: yt-dlp info dict (must include 'formats')
+        quality: Quality label ('2160p' ... '480p', 'best')
+        capabilities: FFmpeg capabilities (None means no FFmpeg: progressive only)
+
+    Returns:
+        Plan dict with 'format' (explicit yt-dlp spec), 'estimated_bytes',
+        'needs_merge', 'needs_transcode', codecs and output 'ext', or None if
+        no suitable format was found (callers fall back to a format string)
+    """
+    formats = [f for f in (info.get('formats') or []) if _is_downloadable(f)]
+    if not formats:
+        return None
+
+    duration = info.get('duration')
+    max_height = quality_to_height(quality)
+    has_ffmpeg = capabilities is not None
+
+    videos = [f for f in formats if _has_video(f) and (f.get('height') or 0) <= max_height]
+    if not videos:
+        return None
+    target_height = max(f.get('height') or 0 for f in videos)
+    at_height = [f for f in videos if (f.get('height') or 0) == target_height]
+
+    video_only = [f for f in at_height if not _has_audio(f)]
+    progressive = [f for f in at_height if _has_audio(f)]
+    audios = select_audio_candidates(formats)
+
+    candidates = [_candidate(f, None, duration, has_ffmpeg) for f in progressive]
+    for video in video_only:
+        for audio in audios:
+            candidates.append(_candidate(video, audio, duration, has_ffmpeg))
+    candidates = [c for c in candidates if c is not None]
+
+    if not candidates:
+        # No FFmpeg and no progressive format at the target height:
+        # settle for the best progressive format below it
+        progressive = [f for f in videos if _has_audio(f)]
+        if not progressive:
+            return None
+        best_height = max(f.get('height') or 0 for f in progressive)
+        candidates = [_candidate(f, None, duration, has_ffmpeg)
+                      for f in progressive if (f.get('height') or 0) == best_height]
+
+    best = min(candidates, key=lambda c: c['_score'])
+    best.pop('_score')
+    return best
+
+
+def select_audio_candidates(formats):
+    """Audio-only formats that meet the audio quality target."""
+    audios = [f for f in formats if _has_audio(f) and not _has_video(f)]
+    if not audios:
+        return []
+    best_abr = max((f.get('abr') or f.get('tbr') or 0) for f in audios)
+    floor = min(best_abr, AUDIO_TARGET_ABR) * 0.9
+    return [f for f in audios if (f.get('abr') or f.get('tbr') or 0) >= floor]
+
+
+def plan_audio(info, capabilities=None):
+    """
+    Choose the cheapest audio-only format that meets the audio quality target.
+
+    Returns:
+        Plan dict (same shape as plan_format) or None
+    """
+    formats = [f for f in (info.get('formats') or []) if _is_downloadable(f)]
+    audios = select_audio_candidates(formats)
+    if not audios:
+        return None
+
+    duration = info.get('duration')
+    has_ffmpeg = capabilities is not None
+    candidates = []
+    for audio in audios:
+        family = _codec_family(audio.get('acodec'))
+        size = estimate_bytes(audio, duration)
+        # m4a and opus are extracted by stream copy; anything else is transcoded
+        needs_transcode = has_ffmpeg and family not in ('mp4a', 'aac', 'opus')
+        penalty = _penalty(audio.get('acodec')) + (TRANSCODE_PENALTY if needs_transcode else 0)
+        candidates.append({
+            'format': audio['format_id'],
+            'height': None,
+            'fps': None,
+            'vcodec': None,
+            'acodec': family,
+            'ext': ('m4a' if family in ('mp4a', 'aac') else 'opus' if family == 'opus'
+                    else audio.get('ext')) if has_ffmpeg else audio.get('ext'),
+            'estimated_bytes': size,
+            'needs_merge': False,
+            'needs_transcode': needs_transcode,
+            '_score': size * (1 + penalty) if size is not None else float('inf'),
+        })
+
+    best = min(candidates, key=lambda c: c['_score'])
+    best.pop('_score')
+    return best
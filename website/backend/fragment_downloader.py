@@ -0,0 +1,320 @@
+"""
+Asyncio download engine for fragmented (DASH/HLS) formats.
+
+yt-dlp downloads fragmented formats with its own thread pool per job
+(concurrent_fragment_downloads), on top of the executor thread the job
+already holds. This engine fetches the fragments on the app's event loop
+instead: one shared keep-alive connection pool (HTTP/2 when the `h2`
+package is installed), a cap on concurrent requests per host, a window of
+in-flight fragments per job, and fragments written into the output file
+at their offsets as they complete (off the event loop). yt-dlp still does
+the extraction and format selection.
+
+Requires the `httpx` package (`pip install httpx[http2]`); without it the
+engine reports itself unavailable and downloads go through yt-dlp.
+"""
+import asyncio
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+from format_planner import MP4_AUDIO_CODECS, MP4_VIDEO_CODECS
+
+
+# Concurrent requests per origin host, shared by every job
+HOST_CONCURRENCY = int(os.environ.get('FRAGMENT_HOST_CONCURRENCY', '16'))
+
+# Fragments in flight per format (yt-dlp's concurrent_fragment_downloads)
+JOB_CONCURRENCY = 8
+
+# Attempts per fragment
+RETRIES = 10
+
+FRAGMENTED_PROTOCOLS = ('http_dash_segments', 'm3u8_native')
+
+# (url, Range header value or None)
+Fragment = Tuple[str, Optional[str]]
+
+
+class FragmentError(Exception):
+    """A fragmented download failed; the caller falls back to yt-dlp."""
+
+
+def _range_length(byte_range: Optional[str]) -> Optional[int]:
+    """Length of a `bytes=start-end` Range header value."""
+    match = re.fullmatch(r'bytes=(\d+)-(\d+)', byte_range or '')
+    return int(match.group(2)) - int(match.group(1)) + 1 if match else None
+
+
+def _codec(fmt: Dict, key: str) -> Optional[str]:
+    codec = fmt.get(key)
+    return codec.split('.')[0].lower() if codec and codec != 'none' else None
+
+
+def supported_formats(info: Dict) -> Optional[List[Dict]]:
+    """
+    Return the selected formats of a processed yt-dlp info dict if the engine can download them all.
+    
+    Every format must be fragmented, and a video+audio pair must be
+    muxable into MP4 without re-encoding.
+    """
+    formats = info.get('requested_formats') or [info]
+    if not all(fmt.get('protocol') in FRAGMENTED_PROTOCOLS for fmt in formats):
+        return None
+    if len(formats) == 2:
+        video, audio = formats
+        if _codec(video, 'vcodec') not in MP4_VIDEO_CODECS or _codec(audio, 'acodec') not in MP4_AUDIO_CODECS:
+            return None
+    elif len(formats) != 1:
+        return None
+    return formats
+
+
+def parse_hls_playlist(text: str, base_url: str) -> Optional[List[Fragment]]:
+    """
+    List the fragments of an HLS media playlist.
+    
+    Returns:
+        Fragments in order (the EXT-X-MAP init section first), or None for
+        playlists the engine does not handle (encrypted, master playlists)
+    """
+    fragments: List[Fragment] = []
+    byte_range = None
+    next_offset = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-KEY'):
+            if 'METHOD=NONE' not in line:
+                return None
+        elif line.startswith('#EXT-X-STREAM-INF'):
+            return None
+        elif line.startswith('#EXT-X-MAP'):
+            uri = re.search(r'URI="([^"]+)"', line)
+            if not uri:
+                return None
+            map_range = re.search(r'BYTERANGE="(\d+)(?:@(\d+))?"', line)
+            header = None
+            if map_range:
+                start = int(map_range.group(2) or 0)
+                header = f"bytes={start}-{start + int(map_range.group(1)) - 1}"
+            fragments.append((urljoin(base_url, uri.group(1)), header))
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            length, _, offset = line.split(':', 1)[1].partition('@')
+            start = int(offset) if offset else next_offset
+            byte_range = f"bytes={start}-{start + int(length) - 1}"
+            next_offset = start + int(length)
+        elif not line.startswith('#'):
+            fragments.append((urljoin(base_url, line), byte_range))
+            byte_range = None
+    return fragments or None
+
+
+class FragmentEngine:
+    """Shared connection pool and per-host limits for fragment downloads."""
+    
+    def __init__(self, host_concurrency: int = HOST_CONCURRENCY, job_concurrency: int = JOB_CONCURRENCY):
+        self.host_concurrency = host_concurrency
+        self.job_concurrency = job_concurrency
+        self._client = None
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+    
+    @staticmethod
+    def available() -> bool:
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            return False
+        return True
+    
+    def client(self):
+        """The shared HTTP client, created on first use."""
+        if self._client is None:
+            import httpx
+            try:
+                import h2  # noqa: F401
+                http2 = True
+            except ImportError:
+                http2 = False
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                follow_redirects=True,
+                timeout=httpx.Timeout(30.0),
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.host_concurrency * 4),
+            )
+        return self._client
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _host(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.host_concurrency)
+        return semaphore
+    
+    async def fetch(
+        self,
+        url: str,
+        headers: Dict,
+        byte_range: Optional[str] = None,
+        on_size: Optional[Callable[[int], None]] = None,
+    ) -> bytes:
+        """
+        GET one fragment (retrying), holding a slot of its host's limit.
+        
+        on_size is called with the body length as soon as the response
+        headers declare it, before the body has arrived.
+        """
+        if byte_range:
+            headers = {**headers, 'Range': byte_range}
+        for attempt in range(RETRIES):
+            try:
+                async with self._host(url), self.client().stream('GET', url, headers=headers) as response:
+                    status = response.status_code
+                    if status < 400:
+                        if byte_range and status != 206:
+                            # A full body in place of the range would shift every later fragment
+                            raise FragmentError(f"HTTP {status} instead of 206 for ranged fragment {url}")
+                        length = response.headers.get('content-length')
+                        if on_size and length and response.headers.get('content-encoding', 'identity') == 'identity':
+                            on_size(int(length))
+                        return await response.aread()
+                if status < 500 and status != 429:
+                    raise FragmentError(f"HTTP {status} for fragment {url}")
+            except FragmentError:
+                raise
+            except Exception as e:
+                if attempt == RETRIES - 1:
+                    raise FragmentError(f"Fragment {url} failed: {e}") from e
+            await asyncio.sleep(min(2 ** attempt * 0.25, 5))
+        raise FragmentError(f"Fragment {url} failed after {RETRIES} attempts")
+    
+    async def fragments(self, fmt: Dict) -> List[Fragment]:
+        """Resolve a format's fragment list (fetching the playlist for HLS)."""
+        if fmt['protocol'] == 'http_dash_segments':
+            base = fmt.get('fragment_base_url') or fmt.get('url') or ''
+            return [(frag.get('url') or urljoin(base, frag['path']), None) for frag in fmt.get('fragments') or []]
+        headers = fmt.get('http_headers') or {}
+        playlist = (await self.fetch(fmt['url'], headers)).decode('utf-8', 'replace')
+        fragments = parse_hls_playlist(playlist, fmt['url'])
+        if fragments is None:
+            raise FragmentError("Unsupported HLS playlist")
+        return fragments
+    
+    async def download(
+        self,
+        fmt: Dict,
+        path: str,
+        on_bytes: Callable[[int], None],
+        cancelled: Callable[[], bool],
+    ) -> int:
+        """
+        Download a fragmented format into `path`.
+        
+        Up to job_concurrency fragments are fetched at once. A fragment's
+        offset is the sum of the sizes before it, which are known from the
+        ranges or response headers long before the bodies finish, so each
+        fragment is written at its offset (in a thread) as soon as it
+        arrives, in whatever order that is. At most job_concurrency
+        fragments are held in memory.
+        
+        Returns:
+            Bytes written
+        
+        Raises:
+            FragmentError: If a fragment failed or the job was cancelled
+        """
+        fragments = await self.fragments(fmt)
+        if not fragments:
+            raise FragmentError("Format has no fragments")
+        headers = fmt.get('http_headers') or {}
+        count = len(fragments)
+        sizes: List[Optional[int]] = [_range_length(byte_range) for _, byte_range in fragments]
+        # offsets[i] is set (and offset_known[i] fired) once sizes[0..i-1] are all known
+        offsets: List[Optional[int]] = [0] + [None] * count
+        offset_known = [asyncio.Event() for _ in range(count)]
+        offset_known[0].set()
+        known = 0
+        
+        def advance():
+            nonlocal known
+            while known < count and sizes[known] is not None:
+                offsets[known + 1] = offsets[known] + sizes[known]
+                known += 1
+                if known < count:
+                    offset_known[known].set()
+        
+        def set_size(index: int, size: int):
+            if sizes[index] is None:
+                sizes[index] = size
+                advance()
+            elif sizes[index] != size:
+                raise FragmentError(f"Fragment {index} is {size} bytes, expected {sizes[index]}")
+        
+        advance()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        writes = set()
+        
+        async def get(index: int):
+            url, byte_range = fragments[index]
+            data = await self.fetch(url, headers, byte_range, on_size=lambda size: set_size(index, size))
+            set_size(index, len(data))
+            # Fragments start in order, so every earlier one is in flight or done and this cannot stall
+            await offset_known[index].wait()
+            write = asyncio.ensure_future(asyncio.to_thread(os.pwrite, fd, data, offsets[index]))
+            writes.add(write)
+            write.add_done_callback(writes.discard)
+            # Shielded so a cancelled job still lets the write finish before the file is closed
+            await asyncio.shield(write)
+            on_bytes(len(data))
+        
+        pending = set()
+        next_index = 0
+        try:
+            while next_index < count or pending:
+                if cancelled():
+                    raise FragmentError("Cancelled")
+                while next_index < count and len(pending) < self.job_concurrency:
+                    pending.add(asyncio.ensure_future(get(next_index)))
+                    next_index += 1
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, *writes, return_exceptions=True)
+            os.close(fd)
+        return offsets[count]
+
+
+async def merge_fragments(ffmpeg: str, inputs: List[str], output_file: str):
+    """
+    Mux downloaded formats into an MP4 by stream copy, without blocking the event loop.
+    
+    Raises:
+        FragmentError: If FFmpeg failed
+    """
+    args = [ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error', '-y']
+    for path in inputs:
+        args += ['-i', path]
+    for index in range(len(inputs)):
+        args += ['-map', f'{index}']
+    args += ['-c', 'copy', '-f', 'mp4', output_file]
+    process = await asyncio.create_subprocess_exec(
+        *args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise FragmentError(f"FFmpeg exited with {process.returncode}: {stderr.decode('utf-8', 'replace')[-500:]}")
+
+
+# Shared by every job in this process
+fragment_engine = FragmentEngine()
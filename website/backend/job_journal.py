@@ -0,0 +1,249 @@
+"""
+Append-only journal of job and token changes.
+
+Every change to FileManager's jobs and tokens is appended to the journal
+so the state survives a restart or crash. Records are handed to a writer
+thread, which writes whatever has accumulated and fsyncs once per batch
+(group commit), so callers on the event loop never wait for the disk; a
+crash loses at most the batch being written.
+
+The journal is compacted once it has grown to COMPACT_RATIO times the
+size of its last snapshot, by folding the file itself into one record per
+live job and token. The fold runs in a child process (this module run as
+a script) while the writer thread waits for it, so parsing a large journal
+neither holds the server's GIL nor triggers its garbage collector; new
+records queue up meanwhile. On startup the journal is replayed and then
+compacted into a snapshot of the live records.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from structured_log import get_logger
+
+log = get_logger('journal')
+
+# Compact when the journal is this many times the size of its last snapshot
+COMPACT_RATIO = 2.0
+
+# ... but never while it is smaller than this
+MIN_COMPACT_BYTES = 1024 * 1024
+
+
+class JobJournal:
+    """Write-ahead log of job/token records in JSON lines."""
+    
+    def __init__(self, path: str, compact_ratio: float = COMPACT_RATIO,
+                 min_compact_bytes: int = MIN_COMPACT_BYTES):
+        """
+        Initialize the journal.
+        
+        Args:
+            path: Journal file path
+            compact_ratio: Journal size, relative to the last snapshot, that triggers compaction
+            min_compact_bytes: Journal size below which it is never compacted
+        """
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+        self.compactions = 0
+        # Lines waiting for the writer thread, and how many were queued / written so far
+        self._pending: List[str] = []
+        self._queued = 0
+        self._written = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        # Held for every file operation (writer batches, compaction, close)
+        self._io_lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._snapshot_size = 0
+    
+    def replay(self) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+        """
+        Rebuild jobs and tokens from the journal.
+        
+        A torn last line (crash in the middle of a write) is ignored.
+        
+        Returns:
+            Tuple of (jobs, tokens)
+        """
+        return _replay(self.path)
+    
+    def record(self, kind: str, record_id: str, fields: Dict):
+        """Append an update of a job ('job') or token ('token')."""
+        self._append({'kind': kind, 'id': record_id, 'set': fields})
+    
+    def record_delete(self, kind: str, record_id: str):
+        """Append the removal of a job or token."""
+        self._append({'kind': kind, 'id': record_id, 'deleted': True})
+    
+    def compact(self, jobs: Dict, tokens: Dict):
+        """
+        Replace the journal with one record per live job and token.
+        
+        Used at startup; afterwards the writer thread compacts on its own.
+        
+        Args:
+            jobs: job_id -> Job record (anything with to_dict())
+            tokens: token -> Token record
+        """
+        self.flush()
+        with self._io_lock:
+            self._close_file()
+            self._size = self._snapshot_size = _write_snapshot(
+                self.path,
+                [('job', job_id, job.to_dict()) for job_id, job in jobs.items()]
+                + [('token', token, info.to_dict()) for token, info in tokens.items()]
+            )
+    
+    def flush(self):
+        """Wait until every record appended so far is written and fsynced."""
+        with self._cond:
+            target = self._queued
+            while self._written < target and self._thread is not None and self._thread.is_alive():
+                self._cond.wait()
+    
+    def close(self):
+        """Write the remaining records and stop the writer thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        with self._io_lock:
+            self._close_file()
+    
+    def stats(self) -> Dict:
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'bytes': self._size,
+            'snapshot_bytes': self._snapshot_size,
+            'pending': pending,
+            'compactions': self.compactions,
+        }
+    
+    def _append(self, record: Dict):
+        line = json.dumps(record) + '\n'
+        with self._cond:
+            self._pending.append(line)
+            self._queued += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer, name='job-journal', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+    
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    self._thread = None
+                    self._cond.notify_all()
+                    return
+                batch, self._pending = self._pending, []
+            try:
+                with self._io_lock:
+                    self._write_batch(batch)
+                    if self._size > max(self.min_compact_bytes, self.compact_ratio * self._snapshot_size):
+                        self._compact_file()
+            except OSError:
+                log.exception("Journal write failed", extra={'records': len(batch)})
+            with self._cond:
+                self._written += len(batch)
+                self._cond.notify_all()
+    
+    def _write_batch(self, lines: List[str]):
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._size = self._file.tell()
+        data = ''.join(lines)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._size += len(data)
+    
+    def _compact_file(self):
+        """Fold the journal into a snapshot, in a child process if possible (writer thread)."""
+        self._close_file()
+        try:
+            done = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), self.path],
+                stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=600, check=True,
+            )
+            size = int(done.stdout.strip())
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            log.warning("Journal compaction process failed, compacting in-process", extra={'error': str(e)})
+            size = _compact(self.path)
+        self._size = self._snapshot_size = size
+        self.compactions += 1
+    
+    def _close_file(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def _replay(path: str) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    jobs: Dict[str, Dict] = {}
+    tokens: Dict[str, Dict] = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                table = jobs if record.get('kind') == 'job' else tokens
+                if record.get('deleted'):
+                    table.pop(record['id'], None)
+                else:
+                    table.setdefault(record['id'], {}).update(record['set'])
+    except OSError:
+        pass
+    return jobs, tokens
+
+
+def _write_snapshot(path: str, records: Iterable[Tuple[str, str, Dict]]) -> int:
+    """
+    Write one record per live job/token and rename it over the journal.
+    
+    The snapshot goes to a temporary file first, so a crash leaves either
+    the old or the new journal.
+    
+    Returns:
+        Size of the new journal in bytes
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for kind, record_id, fields in records:
+            f.write(json.dumps({'kind': kind, 'id': record_id, 'set': fields}) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+def _compact(path: str) -> int:
+    """Fold a journal file into a snapshot of its live records; returns the new size."""
+    jobs, tokens = _replay(path)
+    return _write_snapshot(
+        path,
+        [('job', job_id, fields) for job_id, fields in jobs.items()]
+        + [('token', token, fields) for token, fields in tokens.items()]
+    )
+
+
+if __name__ == '__main__':
+    # Compaction child process: python job_journal.py <journal path>
+    print(_compact(sys.argv[1]))
@@ -0,0 +1,346 @@
+"""
+Shared download queue between API nodes and worker processes.
+
+In worker mode (JOB_QUEUE_URL set) the API still extracts and plans a job,
+but instead of downloading it in-process it puts the download on this queue
+and follows its progress. Worker processes (worker.py) claim queued
+downloads, run them with downloader.download_video and report progress and
+the result back. Workers and API nodes must share the download directory.
+
+A claimed download is leased: the worker heartbeats while it runs, and a
+download whose worker stopped heartbeating for LEASE_SECONDS is handed to
+the next worker, which resumes from the partial files. A finished download
+whose result nobody read (its API node went away) is dropped after
+DONE_TTL_SECONDS.
+
+The queue methods block (disk or network round trips); JobQueue.run calls
+them in a thread so the API's event loop keeps serving.
+
+Backends: SQLite (one host, any number of processes) or Redis (several
+hosts; requires the `redis` package).
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional, Tuple
+
+
+# A running download whose worker has not heartbeated for this long is requeued
+LEASE_SECONDS = float(os.environ.get('JOB_QUEUE_LEASE_SECONDS', '60'))
+
+# A finished download whose result has not been read for this long is dropped
+DONE_TTL_SECONDS = int(os.environ.get('JOB_QUEUE_DONE_TTL_SECONDS', str(24 * 3600)))
+
+# How often the API checks a queued download for progress
+POLL_SECONDS = 0.5
+
+# Queue states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+
+
+class JobQueue(ABC):
+    """Download queue; subclasses store it somewhere several processes can reach."""
+    
+    @abstractmethod
+    def put(self, job_id: str, payload: Dict):
+        """
+        Queue a download (download_video arguments).
+        
+        Putting a job that is already queued, running or done does nothing,
+        so an API node that restarted can put its unfinished jobs again and
+        pick up where they are.
+        """
+    
+    @abstractmethod
+    def claim(self, worker: str) -> Optional[Tuple[str, Dict]]:
+        """
+        Take the oldest queued (or abandoned) download.
+        
+        Returns:
+            Tuple of (job_id, payload), or None if there is nothing to do
+        """
+    
+    @abstractmethod
+    def heartbeat(self, job_id: str, progress: Optional[Dict] = None) -> bool:
+        """
+        Extend a running download's lease, optionally with new progress.
+        
+        Returns:
+            False if the download was cancelled
+        """
+    
+    @abstractmethod
+    def finish(self, job_id: str, result: Dict):
+        """Store a download's result (success, message, filepath)."""
+    
+    @abstractmethod
+    def cancel(self, job_id: str):
+        """Ask the worker running a download to stop (or drop it if still queued)."""
+    
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return {'state', 'progress', 'result', 'cancelled', 'heartbeat'} of a download, or None."""
+    
+    @abstractmethod
+    def delete(self, job_id: str):
+        """Forget a download once its result has been read."""
+    
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Number of downloads per state."""
+    
+    async def run(self, job_id: str, payload: Dict,
+                  on_progress: Optional[Callable[..., None]] = None) -> Tuple[bool, str, Optional[str]]:
+        """
+        Queue a download and wait for a worker to finish it.
+        
+        Drop-in replacement for downloader.download_video: reported progress
+        is passed to on_progress and the result is returned the same way.
+        """
+        await asyncio.to_thread(self.put, job_id, payload)
+        reported = None
+        while True:
+            entry = await asyncio.to_thread(self.get, job_id)
+            if entry is None:
+                return False, "Download was removed from the queue", None
+            if entry['state'] == DONE:
+                await asyncio.to_thread(self.delete, job_id)
+                result = entry['result']
+                return result['success'], result['message'], result.get('filepath')
+            if (entry['cancelled'] and entry['state'] == RUNNING and entry['heartbeat'] is not None
+                    and time.time() - entry['heartbeat'] > LEASE_SECONDS):
+                # Cancelled, and its worker is gone: no one will finish it
+                await asyncio.to_thread(self.delete, job_id)
+                return False, "Download cancelled", None
+            progress = entry['progress']
+            if on_progress and progress and progress != reported:
+                on_progress(**progress)
+                reported = progress
+            await asyncio.sleep(POLL_SECONDS)
+
+
+class SQLiteQueue(JobQueue):
+    """Queue in a SQLite database (WAL mode), shared by processes on one host."""
+    
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS downloads ('
+            ' job_id TEXT PRIMARY KEY, payload TEXT NOT NULL, state TEXT NOT NULL,'
+            ' created_at REAL NOT NULL, worker TEXT, heartbeat REAL,'
+            ' progress TEXT, result TEXT, cancelled INTEGER NOT NULL DEFAULT 0, finished_at REAL)'
+        )
+        try:
+            # Databases created before finished_at existed
+            self._db.execute('ALTER TABLE downloads ADD COLUMN finished_at REAL')
+        except sqlite3.OperationalError:
+            pass
+        self._db.execute('CREATE INDEX IF NOT EXISTS downloads_state ON downloads (state, created_at)')
+    
+    def put(self, job_id: str, payload: Dict):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR IGNORE INTO downloads (job_id, payload, state, created_at) VALUES (?, ?, ?, ?)',
+                (job_id, json.dumps(payload), QUEUED, time.time())
+            )
+    
+    def claim(self, worker: str) -> Optional[Tuple[str, Dict]]:
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two workers never claim the same row
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT job_id, payload FROM downloads'
+                    ' WHERE cancelled = 0 AND (state = ? OR (state = ? AND heartbeat < ?))'
+                    ' ORDER BY created_at LIMIT 1',
+                    (QUEUED, RUNNING, now - LEASE_SECONDS)
+                ).fetchone()
+                if row:
+                    self._db.execute(
+                        'UPDATE downloads SET state = ?, worker = ?, heartbeat = ? WHERE job_id = ?',
+                        (RUNNING, worker, now, row[0])
+                    )
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return (row[0], json.loads(row[1])) if row else None
+    
+    def heartbeat(self, job_id: str, progress: Optional[Dict] = None) -> bool:
+        with self._lock:
+            if progress is None:
+                self._db.execute('UPDATE downloads SET heartbeat = ? WHERE job_id = ?', (time.time(), job_id))
+            else:
+                self._db.execute(
+                    'UPDATE downloads SET heartbeat = ?, progress = ? WHERE job_id = ?',
+                    (time.time(), json.dumps(progress), job_id)
+                )
+            row = self._db.execute('SELECT cancelled FROM downloads WHERE job_id = ?', (job_id,)).fetchone()
+        return bool(row) and not row[0]
+    
+    def finish(self, job_id: str, result: Dict):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'UPDATE downloads SET state = ?, result = ?, finished_at = ? WHERE job_id = ?',
+                (DONE, json.dumps(result), now, job_id)
+            )
+            # Results nobody collected
+            self._db.execute(
+                'DELETE FROM downloads WHERE state = ? AND finished_at < ?', (DONE, now - DONE_TTL_SECONDS)
+            )
+    
+    def cancel(self, job_id: str):
+        with self._lock:
+            self._db.execute('UPDATE downloads SET cancelled = 1 WHERE job_id = ?', (job_id,))
+            # Nobody is working on a queued download: finish it right away
+            self._db.execute(
+                'UPDATE downloads SET state = ?, result = ?, finished_at = ? WHERE job_id = ? AND state = ?',
+                (DONE, json.dumps({'success': False, 'message': 'Download cancelled'}), time.time(), job_id, QUEUED)
+            )
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT state, progress, result, cancelled, heartbeat FROM downloads WHERE job_id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'state': row[0],
+            'progress': json.loads(row[1]) if row[1] else None,
+            'result': json.loads(row[2]) if row[2] else None,
+            'cancelled': bool(row[3]),
+            'heartbeat': row[4],
+        }
+    
+    def delete(self, job_id: str):
+        with self._lock:
+            self._db.execute('DELETE FROM downloads WHERE job_id = ?', (job_id,))
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute('SELECT state, COUNT(*) FROM downloads GROUP BY state').fetchall()
+        return dict(rows)
+
+
+class RedisQueue(JobQueue):
+    """Queue in Redis, shared by API nodes and workers on any host (requires `redis`)."""
+    
+    PENDING = 'downloads:pending'  # list of queued job ids, oldest at the right
+    RUNNING = 'downloads:running'  # sorted set of running job ids by last heartbeat
+    # The last heartbeat is also kept in the job's hash, where it outlives the RUNNING entry
+    
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+    
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"download:{job_id}"
+    
+    def put(self, job_id: str, payload: Dict):
+        if self.client.hsetnx(self._key(job_id), 'payload', json.dumps(payload)):
+            pipe = self.client.pipeline()
+            pipe.hset(self._key(job_id), 'state', QUEUED)
+            pipe.lpush(self.PENDING, job_id)
+            pipe.execute()
+    
+    def _requeue_abandoned(self):
+        for job_id in self.client.zrangebyscore(self.RUNNING, 0, time.time() - LEASE_SECONDS):
+            # Only one worker wins the ZREM, so the job is requeued once
+            if self.client.zrem(self.RUNNING, job_id):
+                if self.client.hget(self._key(job_id), 'cancelled'):
+                    # Claim skips cancelled jobs, so finish it here or it would stay queued forever
+                    self.finish(job_id, {'success': False, 'message': 'Download cancelled'})
+                    continue
+                self.client.hset(self._key(job_id), 'state', QUEUED)
+                self.client.rpush(self.PENDING, job_id)
+    
+    def claim(self, worker: str) -> Optional[Tuple[str, Dict]]:
+        self._requeue_abandoned()
+        while True:
+            job_id = self.client.rpop(self.PENDING)
+            if job_id is None:
+                return None
+            entry = self.client.hgetall(self._key(job_id))
+            if not entry or entry.get('cancelled'):
+                continue
+            now = time.time()
+            pipe = self.client.pipeline()
+            pipe.hset(self._key(job_id), mapping={'state': RUNNING, 'worker': worker, 'heartbeat': now})
+            pipe.zadd(self.RUNNING, {job_id: now})
+            pipe.execute()
+            return job_id, json.loads(entry['payload'])
+    
+    def heartbeat(self, job_id: str, progress: Optional[Dict] = None) -> bool:
+        now = time.time()
+        # Only a running job is updated, so a deleted job's hash is not recreated
+        if self.client.zadd(self.RUNNING, {job_id: now}, xx=True, ch=True):
+            fields = {'heartbeat': now}
+            if progress is not None:
+                fields['progress'] = json.dumps(progress)
+            self.client.hset(self._key(job_id), mapping=fields)
+        return not self.client.hget(self._key(job_id), 'cancelled')
+    
+    def finish(self, job_id: str, result: Dict):
+        pipe = self.client.pipeline()
+        pipe.zrem(self.RUNNING, job_id)
+        pipe.hset(self._key(job_id), mapping={'state': DONE, 'result': json.dumps(result)})
+        pipe.expire(self._key(job_id), DONE_TTL_SECONDS)
+        pipe.execute()
+    
+    def cancel(self, job_id: str):
+        # Do not recreate a hash that was deleted or expired
+        if not self.client.exists(self._key(job_id)):
+            return
+        self.client.hset(self._key(job_id), 'cancelled', 1)
+        if self.client.lrem(self.PENDING, 0, job_id):
+            self.finish(job_id, {'success': False, 'message': 'Download cancelled'})
+    
+    def get(self, job_id: str) -> Optional[Dict]:
+        entry = self.client.hgetall(self._key(job_id))
+        if not entry:
+            return None
+        return {
+            'state': entry.get('state'),
+            'progress': json.loads(entry['progress']) if entry.get('progress') else None,
+            'result': json.loads(entry['result']) if entry.get('result') else None,
+            'cancelled': bool(entry.get('cancelled')),
+            'heartbeat': float(entry['heartbeat']) if entry.get('heartbeat') else None,
+        }
+    
+    def delete(self, job_id: str):
+        self.client.delete(self._key(job_id))
+    
+    def stats(self) -> Dict[str, int]:
+        return {QUEUED: self.client.llen(self.PENDING), RUNNING: self.client.zcard(self.RUNNING)}
+
+
+def queue_from_url(url: Optional[str]) -> Optional[JobQueue]:
+    """
+    Open the queue named by a URL.
+    
+    Args:
+        url: 'sqlite:///path/to/queue.db' or 'redis://host:port/db';
+            empty or None means no queue (download in-process)
+    """
+    if not url:
+        return None
+    if url.startswith('sqlite:///'):
+        return SQLiteQueue(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisQueue(url)
+    raise ValueError(f"Unsupported JOB_QUEUE_URL: {url}")
@@ -1,33 +1,94 @@
 """
 FastAPI backend for YouTube video downloader web application.
 """
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, HttpUrl
-from typing import Optional
+from typing import Dict, Optional
+import asyncio
+import math
 import os
-import uvicorn
 from contextlib import asynccontextmanager
 
-from file_manager import file_manager
-from downloader import get_video_info, download_video
+from structured_log import bind_log_context, get_logger, reset_log_context, setup_logging
+from job_queue import queue_from_url
+from scratch import scratch_space
+from webhooks import validate_callback_url, webhook_dispatcher
+from thumbnails import FORMATS, SIZES, ThumbnailError, ThumbnailNotFound, thumbnail_cache
+from static_assets import PrecompressedStaticFiles, static_directory
+from video_url import InvalidVideoURL, VideoKey, parse_video_url
+from admin import controls, record_failure, router as admin_router
+from file_manager import JobStatus, file_manager
+from rate_limiter import RateLimitMiddleware, limiter_from_env
+from downloader import (
+    CANCELLED_MESSAGE,
+    cancel_download,
+    download_video,
+    get_video_info,
+    plan_download,
+    remove_job_files,
+    warm_up,
+)
+from fragment_downloader import fragment_engine
+from prefetch import prefetcher
+
+setup_logging()
+log = get_logger('main')
+
+# Per-client budgets for extractions, concurrent jobs and daily bytes
+rate_limiter = limiter_from_env()
+
+# Worker mode: downloads go to this queue and worker.py processes run them
+job_queue = queue_from_url(os.environ.get('JOB_QUEUE_URL'))
+
+# Unfinished jobs whose status nobody has requested for this long are cancelled (0 disables)
+JOB_ABANDON_SECONDS = int(os.environ.get('JOB_ABANDON_SECONDS', '120'))
+
+# Longest a status request may wait for a change (?wait=)
+STATUS_MAX_WAIT_SECONDS = float(os.environ.get('STATUS_MAX_WAIT_SECONDS', '30'))
+
+# Finished jobs with a callback URL are announced by webhook
+file_manager.subscribe(webhook_dispatcher.notify)
 
 
 # Lifespan context manager for startup/shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Start cleanup task
-    import asyncio
     cleanup_task = asyncio.create_task(file_manager.start_cleanup_task())
+    # Re-queue jobs interrupted by the last shutdown; they resume from their partial files
+    resumed_tasks = []
+    for job_id in file_manager.recover():
+        log.info("Resuming after restart", extra={'job_id': job_id})
+        job = file_manager.get_job(job_id)
+        resumed_tasks.append(asyncio.create_task(
+            process_download(job_id=job_id, client=job.client, **job.request)
+        ))
+    # Load yt-dlp in the background so the server is ready immediately
+    warm_up_task = asyncio.create_task(warm_up())
+    abandon_task = asyncio.create_task(cancel_abandoned_jobs()) if JOB_ABANDON_SECONDS > 0 else None
+    webhook_dispatcher.start()
+    # Warm popular videos while the executor is idle (prefetched files are local, so not in worker mode)
+    prefetch_task = asyncio.create_task(prefetcher.run(
+        paused=lambda: controls.paused or controls.draining,
+        allow_downloads=job_queue is None,
+    ))
     yield
+    warm_up_task.cancel()
+    prefetch_task.cancel()
+    if abandon_task:
+        abandon_task.cancel()
     # Shutdown: Cancel cleanup task
     cleanup_task.cancel()
     try:
         await cleanup_task
     except asyncio.CancelledError:
         pass
+    if file_manager.journal:
+        file_manager.journal.close()
+    await fragment_engine.close()
+    await webhook_dispatcher.stop()
 
 
 # Initialize FastAPI app
@@ -38,7 +99,14 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-# CORS middleware
+# Rate limiting (rejects before any other work; inside CORS so browsers can read its 429s)
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    active_jobs=file_manager.count_active_jobs,
+)
+
+# CORS middleware (added last so it is outermost and answers preflights itself)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, specify your domain
@@ -47,9 +115,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
-static_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
-app.mount("/static", StaticFiles(directory=static_path), name="static")
+# Admin/operations API (enabled by ADMIN_TOKEN)
+app.state.rate_limiter = rate_limiter
+app.state.job_queue = job_queue
+app.include_router(admin_router)
+
+# Mount static files: the fingerprinted, precompressed build if there is one
+# (python backend/static_assets.py), else the sources
+static_path = static_directory()
+static_files = PrecompressedStaticFiles(directory=static_path)
+app.mount("/static", static_files, name="static")
+
+
+# Content types for the files we produce
+MEDIA_TYPES = {
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.mkv': 'video/x-matroska',
+    '.m4a': 'audio/mp4',
+    '.opus': 'audio/ogg',
+    '.ogg': 'audio/ogg',
+    '.mp3': 'audio/mpeg',
+}
 
 
 # Request/Response models
@@ -59,15 +146,33 @@ class VideoInfoRequest(BaseModel):
 
 class DownloadRequest(BaseModel):
     url: str
-    quality: str = "1080p"
+    quality: str = "1080p"  # or "audio" for audio only
+    start: Optional[float] = None  # clip start in seconds
+    end: Optional[float] = None  # clip end in seconds
+    precise_cut: bool = False  # re-encode cut edges instead of snapping to keyframes
+    callback_url: Optional[str] = None  # receives a signed POST when the job finishes
+
+
+class FormatPlan(BaseModel):
+    format: str  # explicit yt-dlp format spec, e.g. "137+140"
+    ext: Optional[str] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    vcodec: Optional[str] = None
+    acodec: Optional[str] = None
+    estimated_bytes: Optional[int] = None
+    needs_merge: bool = False
+    needs_transcode: bool = False
 
 
 class VideoInfoResponse(BaseModel):
     success: bool
+    video_id: Optional[str] = None  # thumbnails are served from /api/thumb/{video_id}
     title: Optional[str] = None
     duration: Optional[int] = None
     thumbnail: Optional[str] = None
     uploader: Optional[str] = None
+    estimates: Optional[Dict[str, Optional[FormatPlan]]] = None  # quality -> planned format and size
     error: Optional[str] = None
 
 
@@ -79,18 +184,32 @@ class DownloadResponse(BaseModel):
 
 
 class JobStatusResponse(BaseModel):
-    status: str  # pending, processing, completed, failed
+    status: str  # pending, processing, completed, failed, cancelled
     progress: int
     token: Optional[str] = None
     error: Optional[str] = None
+    plan: Optional[FormatPlan] = None
+    version: int = 0  # pass back as ?version= to wait for the next change
+
+
+class CancelResponse(BaseModel):
+    success: bool
+    status: str
+
+
+def video_key_or_400(url: str) -> VideoKey:
+    """Validate a request URL inline, before it can cost an executor slot."""
+    try:
+        return parse_video_url(url)
+    except InvalidVideoURL as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # Routes
 @app.get("/")
-async def root():
-    """Serve the main HTML page."""
-    html_path = os.path.join(static_path, "index.html")
-    return FileResponse(html_path)
+async def root(request: Request):
+    """Serve the main HTML page (precompressed, revalidated through its ETag)."""
+    return await static_files.get_response("index.html", request.scope)
 
 
 @app.post("/api/info", response_model=VideoInfoResponse)
@@ -102,18 +221,25 @@ async def get_info(request: VideoInfoRequest):
         request: Video URL
     
     Returns:
-        Video metadata
+        Video metadata with the estimated size, codecs and transcode need
+        of every offered quality
     """
+    key = video_key_or_400(request.url)
+    prefetcher.record(key)
     try:
-        info = await get_video_info(request.url)
+        info = await get_video_info(key.url)
         
         if info['success']:
+            if info.get('thumbnail'):
+                thumbnail_cache.register(key.video_id, info['thumbnail'])
             return VideoInfoResponse(
                 success=True,
+                video_id=key.video_id,
                 title=info['title'],
                 duration=info['duration'],
                 thumbnail=info['thumbnail'],
-                uploader=info['uploader']
+                uploader=info['uploader'],
+                estimates=info.get('estimates')
             )
         else:
             return VideoInfoResponse(
@@ -125,27 +251,60 @@ async def get_info(request: VideoInfoRequest):
 
 
 @app.post("/api/download", response_model=DownloadResponse)
-async def start_download(request: DownloadRequest, background_tasks: BackgroundTasks):
+async def start_download(request: DownloadRequest, background_tasks: BackgroundTasks, http_request: Request):
     """
     Start a video download job.
     
     Args:
         request: Download request with URL and quality
         background_tasks: FastAPI background tasks
+        http_request: Raw request (carries the rate-limit client key)
     
     Returns:
         Job ID for tracking download progress
     """
+    key = video_key_or_400(request.url)
+    if any(value is not None and not math.isfinite(value) for value in (request.start, request.end)):
+        return DownloadResponse(success=False, error="Clip start and end must be finite numbers")
+    if request.start is not None and request.start < 0:
+        return DownloadResponse(success=False, error="Clip start must not be negative")
+    if request.start is not None and request.end is not None and request.end <= request.start:
+        return DownloadResponse(success=False, error="Clip end must be after clip start")
+    if controls.draining:
+        return JSONResponse(
+            status_code=503,
+            content={'success': False, 'error': "Server is not accepting new downloads right now"}
+        )
+    if request.callback_url:
+        error = validate_callback_url(request.callback_url)
+        if error:
+            return DownloadResponse(success=False, error=error)
+    # Clips are counted towards the video but not its quality (they are never prefetched)
+    whole_video = request.start is None and request.end is None
+    prefetcher.record(key, request.quality if whole_video else None)
+    
+    client = getattr(http_request.state, 'rate_limit_client', None)
+    
     try:
         # Create a new job
-        job_id = file_manager.create_job()
+        job_id = file_manager.create_job(client=client, callback_url=request.callback_url, request={
+            'url': key.url,
+            'quality': request.quality,
+            'start': request.start,
+            'end': request.end,
+            'precise_cut': request.precise_cut,
+        })
         
         # Start download in background
         background_tasks.add_task(
             process_download,
-            request.url,
+            key.url,
             request.quality,
-            job_id
+            job_id,
+            request.start,
+            request.end,
+            request.precise_cut,
+            client
         )
         
         return DownloadResponse(
@@ -160,50 +319,141 @@ async def start_download(request: DownloadRequest, background_tasks: BackgroundT
         )
 
 
-async def process_download(url: str, quality: str, job_id: str):
+def fail_job(job_id: str, error: str):
+    """Mark a job as failed and record it for the admin failure report."""
+    file_manager.update_job(job_id, status='failed', error=error)
+    record_failure(job_id, error)
+
+
+def set_stage(job_id: str, stage: str):
+    """Record the stage a job is in, on the job and in the log context."""
+    file_manager.set_progress(job_id, stage=stage)
+    bind_log_context(stage=stage)
+
+
+async def process_download(
+    url: str,
+    quality: str,
+    job_id: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    precise_cut: bool = False,
+    client: Optional[str] = None
+):
     """
     Background task to process video download.
     
     Args:
         url: YouTube video URL
-        quality: Video quality
+        quality: Video quality ('audio' for audio only)
         job_id: Job identifier
+        start: Optional clip start in seconds
+        end: Optional clip end in seconds
+        precise_cut: Re-encode cut edges for frame accuracy
+        client: Rate-limit key charged for the downloaded bytes
     """
+    # Every record logged for this job (here and in its download thread) carries its job_id
+    log_context = bind_log_context(job_id=job_id)
     try:
+        if is_cancelled(job_id):
+            return
+        
         # Update job status
-        print(f"[{job_id}] Starting download for: {url}")
+        log.info("Starting download", extra={'url': url, 'quality': quality})
         file_manager.update_job(job_id, status='processing', progress=10)
+        set_stage(job_id, 'extracting')
         
         # Get video info first
-        print(f"[{job_id}] Fetching video info...")
         info = await get_video_info(url)
         if not info['success']:
             error_msg = info['error']
-            print(f"[{job_id}] Failed to get video info: {error_msg}")
-            file_manager.update_job(
-                job_id,
-                status='failed',
-                error=error_msg
-            )
+            log.warning("Failed to get video info", extra={'error': error_msg})
+            fail_job(job_id, error_msg)
+            return
+        bind_log_context(video_id=info.get('id'))
+        
+        if is_cancelled(job_id):
+            log.info("Cancelled before download")
             return
         
         video_title = info['title']
-        print(f"[{job_id}] Video: {video_title}")
-        file_manager.update_job(job_id, progress=25)
+        log.info("Video info fetched", extra={'title': video_title})
+        
+        # Pick the cheapest format that meets the request from the extracted formats.
+        # A resumed job keeps its earlier plan so the partial files still match.
+        plan = file_manager.get_job(job_id).plan or plan_download(info, quality, start, end)
+        if plan:
+            log.info("Format planned", extra={
+                'format': plan['format'],
+                'estimated_bytes': plan['estimated_bytes'],
+                'needs_transcode': plan['needs_transcode'],
+            })
+        # Charge the planned size against the client's daily quota (a resumed job was already charged)
+        resumed = file_manager.get_job(job_id).resumes
+        if plan and not resumed and not await rate_limiter.call(
+                rate_limiter.charge_bytes, client, plan['estimated_bytes']):
+            log.warning("Daily download quota exceeded", extra={'client': client})
+            fail_job(job_id, "Daily download quota exceeded")
+            return
+        file_manager.update_job(job_id, progress=25, plan=plan)
+        
+        # A popular video may already have been downloaded by the prefetcher
+        prefetched = None
+        if start is None and end is None and not resumed:
+            prefetched = await prefetcher.claim(url, quality, file_manager.download_dir, job_id)
+        
+        if not prefetched:
+            # Waiting for an executor worker (or held here while an admin has paused downloads)
+            set_stage(job_id, 'queued')
+            if controls.paused:
+                log.info("Downloads paused, waiting")
+                await controls.running.wait()
+                if is_cancelled(job_id):
+                    return
         
         # Download video
-        print(f"[{job_id}] Starting download (quality: {quality})...")
-        success, message, filepath = await download_video(
-            url,
-            file_manager.download_dir,
-            quality,
-            job_id
-        )
+        on_progress = lambda **progress: file_manager.set_progress(job_id, **progress)  # noqa: E731
+        if prefetched:
+            log.info("Serving prefetched file", extra={'filepath': prefetched})
+            success, message, filepath = True, "Served from the prefetch cache", prefetched
+        elif job_queue:
+            # Worker mode: a worker process downloads, this node follows its progress
+            success, message, filepath = await job_queue.run(job_id, {
+                'url': url,
+                'output_path': file_manager.download_dir,
+                'quality': quality,
+                'start': start,
+                'end': end,
+                'precise_cut': precise_cut,
+                'format_spec': plan['format'] if plan else None,
+                'estimated_bytes': plan['estimated_bytes'] if plan else None,
+            }, on_progress)
+        else:
+            # Downloads in the scratch directory (if configured) and publishes the finished file
+            success, message, filepath = await scratch_space.download(
+                download_video,
+                url,
+                file_manager.download_dir,
+                quality,
+                job_id,
+                start,
+                end,
+                precise_cut,
+                plan['format'] if plan else None,
+                on_progress=on_progress,
+                estimated_bytes=plan['estimated_bytes'] if plan else None
+            )
+        
+        if is_cancelled(job_id):
+            # Cancelled while finishing up: drop whatever was written
+            log.info(CANCELLED_MESSAGE)
+            remove_job_files(file_manager.download_dir, job_id)
+            return
         
         if success and filepath:
-            print(f"[{job_id}] Download successful: {filepath}")
+            log.info("Download successful", extra={'filepath': filepath})
             # Create download token
-            token = file_manager.create_token(filepath, video_title)
+            token = file_manager.create_token(filepath, video_title, job_id)
             file_manager.update_job(
                 job_id,
                 status='completed',
@@ -211,33 +461,35 @@ async def process_download(url: str, quality: str, job_id: str):
                 filepath=filepath,
                 token=token
             )
-            print(f"[{job_id}] Token created: {token}")
         else:
-            print(f"[{job_id}] Download failed: {message}")
-            file_manager.update_job(
-                job_id,
-                status='failed',
-                error=message
-            )
+            log.warning("Download failed", extra={'error': message})
+            fail_job(job_id, message)
     except Exception as e:
-        error_msg = str(e)
-        print(f"[{job_id}] Exception occurred: {error_msg}")
-        import traceback
-        traceback.print_exc()
-        file_manager.update_job(
-            job_id,
-            status='failed',
-            error=error_msg
-        )
+        log.exception("Download job raised")
+        fail_job(job_id, str(e))
+    finally:
+        reset_log_context(log_context)
 
 
 @app.get("/api/status/{job_id}", response_model=JobStatusResponse)
-async def get_job_status(job_id: str):
+async def get_job_status(
+    job_id: str,
+    wait: float = Query(0, ge=0),
+    version: Optional[int] = None,
+):
     """
     Get the status of a download job.
     
+    With `wait`, this is a long-poll: the response is held until the job
+    changes (status, stage or progress) or `wait` seconds (at most
+    STATUS_MAX_WAIT_SECONDS) pass. A change is relative to `version` from
+    the previous response, so nothing is missed between requests; without
+    it the request waits for the next change.
+    
     Args:
         job_id: Job identifier
+        wait: Seconds to wait for a change (0 answers at once)
+        version: Job version the client last saw
     
     Returns:
         Job status and download token if completed
@@ -247,14 +499,85 @@ async def get_job_status(job_id: str):
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     
+    file_manager.touch_job(job_id)
+    if wait > 0:
+        job = await file_manager.wait_for_change(
+            job_id,
+            job.version if version is None else version,
+            min(wait, STATUS_MAX_WAIT_SECONDS),
+        )
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        # A long-polling client is still interested when its request returns
+        file_manager.touch_job(job_id)
     return JobStatusResponse(
-        status=job['status'],
-        progress=job['progress'],
-        token=job.get('token'),
-        error=job.get('error')
+        status=job.status,
+        progress=job.progress,
+        token=job.token,
+        error=job.error,
+        plan=job.plan,
+        version=job.version
     )
 
 
+def is_cancelled(job_id: str) -> bool:
+    """Check whether a job has been cancelled."""
+    job = file_manager.get_job(job_id)
+    return job is not None and job.status == JobStatus.CANCELLED
+
+
+async def cancel_job(job_id: str, reason: str = CANCELLED_MESSAGE) -> bool:
+    """
+    Cancel an unfinished job.
+    
+    A running download is stopped and its partial files removed; a job
+    that has not reached the download step stops at its next status check.
+    
+    Args:
+        job_id: Job identifier
+        reason: Error message recorded on the job
+    
+    Returns:
+        True if the job was unfinished and is now cancelled
+    """
+    job = file_manager.get_job(job_id)
+    if not job or not job.active:
+        return False
+    file_manager.update_job(job_id, status='cancelled', error=reason)
+    cancel_download(job_id)
+    if job_queue:
+        await asyncio.to_thread(job_queue.cancel, job_id)
+    log.info("Job cancelled", extra={'job_id': job_id, 'reason': reason})
+    return True
+
+
+async def cancel_abandoned_jobs():
+    """Background task that cancels jobs no client is polling any more."""
+    interval = min(30, max(1, JOB_ABANDON_SECONDS // 2))
+    while True:
+        await asyncio.sleep(interval)
+        for job_id in file_manager.find_abandoned_jobs(JOB_ABANDON_SECONDS):
+            await cancel_job(job_id, "Download cancelled: no client polled the job")
+
+
+@app.post("/api/cancel/{job_id}", response_model=CancelResponse)
+async def cancel(job_id: str):
+    """
+    Cancel a download job.
+    
+    Args:
+        job_id: Job identifier
+    
+    Returns:
+        Whether the job was cancelled and its resulting status
+    """
+    if not file_manager.get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    success = await cancel_job(job_id)
+    return CancelResponse(success=success, status=file_manager.get_job(job_id).status)
+
+
 @app.get("/api/file/{token}")
 async def download_file(token: str):
     """
@@ -274,21 +597,22 @@ async def download_file(token: str):
             detail="File not found or link expired"
         )
     
-    filepath = file_info['filepath']
-    original_filename = file_info['original_filename']
+    filepath = file_info.filepath
+    original_filename = file_info.original_filename
     
     # Mark as downloaded (one-time use)
     file_manager.mark_downloaded(token)
     
-    # Generate safe filename
+    # Generate safe filename, keeping the real extension (mp4, m4a, opus, ...)
+    extension = os.path.splitext(filepath)[1].lower() or '.mp4'
     safe_filename = "".join(c for c in original_filename if c.isalnum() or c in (' ', '-', '_')).rstrip()
     safe_filename = safe_filename[:200]  # Limit length
-    if not safe_filename.endswith('.mp4'):
-        safe_filename += '.mp4'
+    if not safe_filename.endswith(extension):
+        safe_filename += extension
     
     return FileResponse(
         filepath,
-        media_type='video/mp4',
+        media_type=MEDIA_TYPES.get(extension, 'application/octet-stream'),
         filename=safe_filename,
         headers={
             "Content-Disposition": f'attachment; filename="{safe_filename}"'
@@ -296,12 +620,57 @@ async def download_file(token: str):
     )
 
 
+# Thumbnail variants change rarely; clients revalidate with the ETag after a week
+THUMB_CACHE_CONTROL = "public, max-age=604800, stale-while-revalidate=86400"
+
+
+@app.get("/api/thumb/{video_id}")
+async def get_thumbnail(video_id: str, request: Request, size: str = 'medium', format: Optional[str] = None):
+    """
+    Serve a resized thumbnail from the thumbnail cache.
+    
+    Args:
+        video_id: Video ID (from /api/info)
+        request: Raw request (Accept and If-None-Match headers)
+        size: small, medium or large
+        format: webp or jpeg (default: WebP if the client accepts it)
+    
+    Returns:
+        The image, or 304 if the client's copy is current
+    """
+    if size not in SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(SIZES)}")
+    if format is None:
+        format = 'webp' if 'image/webp' in request.headers.get('accept', '') else 'jpeg'
+    elif format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    
+    try:
+        variant = await thumbnail_cache.get(video_id, size, format)
+    except ThumbnailNotFound:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    except ThumbnailError:
+        raise HTTPException(status_code=502, detail="Thumbnail unavailable")
+    
+    headers = {'ETag': variant.etag, 'Cache-Control': THUMB_CACHE_CONTROL, 'Vary': 'Accept'}
+    if request.headers.get('if-none-match') == variant.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=variant.data, media_type=variant.media_type, headers=headers)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
     return {"status": "healthy"}
 
 
+@app.get("/api/metrics")
+async def metrics():
+    """Rate limiter hit counts per budget."""
+    return {"rate_limit": rate_limiter.stats()}
+
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,445 @@
+"""
+Predictive warm-up of popular videos during idle capacity.
+
+Requests are heavily skewed towards a few videos at a time. With
+PREFETCH=1, every /api/info and /api/download is counted by a popularity
+tracker (request counts per video that decay exponentially with
+PREFETCH_HALF_LIFE_SECONDS, keyed by video_url's cache key). While the
+executor has idle capacity, the most popular videos whose metadata is not
+cached are extracted in the background, so the next request for them
+skips extraction.
+
+With PREFETCH_DOWNLOADS=1 the most requested quality of each popular
+video is also downloaded into PREFETCH_DIR. A job for that video and
+quality (the whole video, not a clip) is then served by linking the
+prefetched file into the download directory instead of downloading it.
+Prefetched downloads are bounded by a hard budget: PREFETCH_DISK_BYTES on
+disk (least recently used evicted first) and PREFETCH_BANDWIDTH_BYTES per
+hour. Warm-ups run one at a time and only start while no user work is
+waiting for the executor.
+"""
+import asyncio
+import os
+import shutil
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from structured_log import get_logger
+from downloader import (
+    OFFERED_QUALITIES,
+    cancel_download,
+    download_video,
+    executor_stats,
+    get_video_info,
+    info_cached,
+    plan_download,
+    remove_job_files,
+)
+from video_url import PLATFORM_YOUTUBE, VIDEO_ID_RE, VideoKey, cache_key
+
+log = get_logger('prefetch')
+
+PREFETCH = os.environ.get('PREFETCH', '0') == '1'
+
+# Candidates per round: the K most requested videos
+TOP_K = int(os.environ.get('PREFETCH_TOP_K', '10'))
+
+# Decayed request count a video needs before it is warmed
+MIN_SCORE = float(os.environ.get('PREFETCH_MIN_SCORE', '3'))
+
+# A request counts half as much after this long
+HALF_LIFE_SECONDS = float(os.environ.get('PREFETCH_HALF_LIFE_SECONDS', '1800'))
+
+# Seconds between checks for idle capacity
+INTERVAL_SECONDS = float(os.environ.get('PREFETCH_INTERVAL_SECONDS', '15'))
+
+PREFETCH_DOWNLOADS = os.environ.get('PREFETCH_DOWNLOADS', '0') == '1'
+PREFETCH_DIR = os.environ.get('PREFETCH_DIR', 'prefetch_cache')
+DISK_BYTES = int(os.environ.get('PREFETCH_DISK_BYTES', str(2 * 1024 ** 3)))
+BANDWIDTH_BYTES = int(os.environ.get('PREFETCH_BANDWIDTH_BYTES', str(1024 ** 3)))
+
+# Prefetched files older than this are dropped (formats and links go stale)
+FILE_SECONDS = int(os.environ.get('PREFETCH_FILE_SECONDS', '21600'))
+
+# Videos tracked at once; the least popular are forgotten first
+MAX_TRACKED = 10000
+
+# A video whose warm-up failed is not retried for this long
+FAILURE_SECONDS = 600
+
+BANDWIDTH_WINDOW_SECONDS = 3600
+
+# Prefetch downloads are named like jobs: prefetch-<quality>-<video_id>.<ext>
+JOB_PREFIX = 'prefetch-'
+
+
+@dataclass(slots=True)
+class Popularity:
+    """Decayed request counts of one video (as of `updated`)."""
+    url: str
+    score: float = 0.0
+    updated: float = 0.0
+    qualities: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class PrefetchedFile:
+    path: str
+    size: int
+    created: float
+
+
+class PopularityTracker:
+    """Exponentially decayed request counts per video."""
+    
+    def __init__(self, half_life: float = HALF_LIFE_SECONDS, max_entries: int = MAX_TRACKED):
+        self.half_life = half_life
+        self.max_entries = max_entries
+        self._entries: Dict[str, Popularity] = {}
+    
+    def _decay(self, entry: Popularity, now: float):
+        factor = 0.5 ** ((now - entry.updated) / self.half_life)
+        entry.score *= factor
+        for quality in entry.qualities:
+            entry.qualities[quality] *= factor
+        entry.updated = now
+    
+    def record(self, key: VideoKey, quality: Optional[str] = None, now: Optional[float] = None):
+        """Count a request for a video (and the quality it asked for, if it is an offered one)."""
+        now = time.time() if now is None else now
+        entry = self._entries.get(key.cache_key)
+        if entry is None:
+            if len(self._entries) >= self.max_entries:
+                self._forget(now)
+            entry = self._entries[key.cache_key] = Popularity(url=key.url, updated=now)
+        self._decay(entry, now)
+        entry.score += 1
+        if quality and quality.lower() in OFFERED_QUALITIES:
+            quality = quality.lower()
+            entry.qualities[quality] = entry.qualities.get(quality, 0.0) + 1
+    
+    def _forget(self, now: float):
+        # Drop the least popular tenth at once so this runs rarely
+        for entry in self._entries.values():
+            self._decay(entry, now)
+        ranked = sorted(self._entries, key=lambda k: self._entries[k].score)
+        for video in ranked[:max(1, len(ranked) // 10)]:
+            del self._entries[video]
+    
+    def top(self, k: int, min_score: float = 0.0, now: Optional[float] = None) -> List[Tuple[str, Popularity]]:
+        """The k most popular videos scoring at least min_score, most popular first."""
+        now = time.time() if now is None else now
+        for entry in self._entries.values():
+            self._decay(entry, now)
+        ranked = sorted(self._entries.items(), key=lambda item: item[1].score, reverse=True)
+        return [(video, entry) for video, entry in ranked[:k] if entry.score >= min_score]
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _top_quality(entry: Popularity) -> Optional[str]:
+    if not entry.qualities:
+        return None
+    return max(entry.qualities, key=entry.qualities.get)
+
+
+class Prefetcher:
+    """Warms metadata and downloads of popular videos from a background task."""
+    
+    def __init__(
+        self,
+        enabled: bool = PREFETCH,
+        downloads: bool = PREFETCH_DOWNLOADS,
+        directory: str = PREFETCH_DIR,
+        disk_bytes: int = DISK_BYTES,
+        bandwidth_bytes: int = BANDWIDTH_BYTES,
+        top_k: int = TOP_K,
+        min_score: float = MIN_SCORE,
+        interval: float = INTERVAL_SECONDS,
+    ):
+        """
+        Initialize the prefetcher.
+        
+        Args:
+            enabled: Track popularity and warm metadata
+            downloads: Also download the most requested quality
+            directory: Where prefetched files are kept
+            disk_bytes: Cap on prefetched bytes on disk
+            bandwidth_bytes: Cap on prefetched bytes downloaded per hour
+            top_k: Videos considered per round
+            min_score: Decayed request count a video needs
+            interval: Seconds between rounds
+        """
+        self.enabled = enabled
+        self.downloads = enabled and downloads
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self.bandwidth_bytes = bandwidth_bytes
+        self.top_k = top_k
+        self.min_score = min_score
+        self.interval = interval
+        self.tracker = PopularityTracker()
+        # (cache key, quality) -> file, least recently used first
+        self._files: "OrderedDict[Tuple[str, str], PrefetchedFile]" = OrderedDict()
+        self._disk_size = 0
+        # (time, bytes) of downloads in the last BANDWIDTH_WINDOW_SECONDS
+        self._transfers: Deque[Tuple[float, int]] = deque()
+        self._failures: Dict[Tuple[str, Optional[str]], float] = {}
+        self._current_job: Optional[str] = None
+        self.warmed = 0
+        self.downloaded = 0
+        self.downloaded_bytes = 0
+        self.hits = 0
+        self.skipped_budget = 0
+        self.failed = 0
+        if self.downloads:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+    
+    def _load(self):
+        """Pick up files prefetched before a restart; remove anything else."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stem, ext = os.path.splitext(entry.name)
+            parts = stem.split('-', 2)
+            stat = entry.stat()
+            if (len(parts) != 3 or f"{parts[0]}-" != JOB_PREFIX or not VIDEO_ID_RE.fullmatch(parts[2])
+                    or ext in ('.part', '.ytdl', '.temp', '.tmp') or now - stat.st_mtime > FILE_SECONDS):
+                os.remove(entry.path)
+                continue
+            key = (VideoKey(PLATFORM_YOUTUBE, parts[2]).cache_key, parts[1])
+            entries.append((stat.st_mtime, key, PrefetchedFile(entry.path, stat.st_size, stat.st_mtime)))
+        for _, key, prefetched in sorted(entries, key=lambda item: item[0]):
+            self._files[key] = prefetched
+            self._disk_size += prefetched.size
+        self._evict(0)
+    
+    def record(self, key: VideoKey, quality: Optional[str] = None):
+        """Count a request (called for every validated /api/info and /api/download)."""
+        if self.enabled:
+            self.tracker.record(key, quality)
+    
+    async def run(self, paused: Callable[[], bool] = lambda: False, allow_downloads: bool = True):
+        """
+        Warm popular videos until cancelled.
+        
+        Args:
+            paused: Returns True while warm-ups must not start (e.g. drained server)
+            allow_downloads: False when downloads run on worker processes
+        """
+        if not self.enabled:
+            return
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                if paused() or not _idle():
+                    continue
+                try:
+                    await self.step(allow_downloads)
+                except Exception:
+                    log.exception("Prefetch round failed")
+        finally:
+            if self._current_job:
+                cancel_download(self._current_job)
+    
+    async def step(self, allow_downloads: bool = True) -> bool:
+        """
+        Run the most useful single warm-up, if any.
+        
+        Metadata of popular videos comes first (it is cheap and helps every
+        request), then downloads of their most requested quality.
+        
+        Returns:
+            True if something was warmed
+        """
+        now = time.time()
+        self._failures = {attempt: until for attempt, until in self._failures.items() if until > now}
+        self._evict(0)
+        candidates = self.tracker.top(self.top_k, self.min_score, now)
+        for video, entry in candidates:
+            if info_cached(entry.url) or self._failures.get((video, None), 0) > now:
+                continue
+            info = await get_video_info(entry.url)
+            if not info['success']:
+                self._fail(video, None, info['error'])
+                return False
+            self.warmed += 1
+            log.info("Prefetched metadata", extra={'video': video, 'score': round(entry.score, 1)})
+            return True
+        
+        if not (self.downloads and allow_downloads):
+            return False
+        # Files of more popular videos are never evicted to make room for less popular ones
+        ahead = set()
+        for video, entry in candidates:
+            quality = _top_quality(entry)
+            if quality is None:
+                continue
+            if (video, quality) not in self._files and self._failures.get((video, quality), 0) <= now:
+                return await self._download(video, entry.url, quality, ahead)
+            ahead.add((video, quality))
+        return False
+    
+    async def _download(self, video: str, url: str, quality: str, keep: Set[Tuple[str, str]]) -> bool:
+        info = await get_video_info(url)
+        if not info['success']:
+            self._fail(video, None, info['error'])
+            return False
+        plan = plan_download(info, quality)
+        estimated = plan['estimated_bytes'] if plan else None
+        # Without a size estimate the budget cannot be enforced
+        if not estimated or estimated > self._bandwidth_left() or not self._evict(estimated, keep):
+            self.skipped_budget += 1
+            self._fail(video, quality, "Over the prefetch budget")
+            return False
+        
+        video_id = video.split(':', 1)[1]
+        job_id = f"{JOB_PREFIX}{quality}-{video_id}"
+        self._current_job = job_id
+        transfer = (time.time(), estimated)
+        self._transfers.append(transfer)
+        try:
+            success, message, filepath = await download_video(
+                url, self.directory, quality, job_id, format_spec=plan['format'],
+            )
+        finally:
+            self._current_job = None
+        if not success or not filepath:
+            remove_job_files(self.directory, job_id)
+            self._fail(video, quality, message)
+            return False
+        
+        size = os.path.getsize(filepath)
+        # Charge what was actually transferred instead of the estimate
+        if transfer in self._transfers:
+            self._transfers.remove(transfer)
+            self._transfers.append((transfer[0], size))
+        self._files[(video, quality)] = PrefetchedFile(filepath, size, time.time())
+        self._disk_size += size
+        # The real size can exceed the estimate; the disk budget holds regardless
+        if not self._evict(0, keep | {(video, quality)}):
+            self._evict(0)
+        self.downloaded += 1
+        self.downloaded_bytes += size
+        log.info("Prefetched download", extra={'video': video, 'quality': quality, 'bytes': size})
+        return True
+    
+    def _fail(self, video: str, quality: Optional[str], error: str):
+        self.failed += 1
+        self._failures[(video, quality)] = time.time() + FAILURE_SECONDS
+        log.info("Prefetch skipped", extra={'video': video, 'quality': quality, 'error': error})
+    
+    def _bandwidth_left(self) -> int:
+        cutoff = time.time() - BANDWIDTH_WINDOW_SECONDS
+        while self._transfers and self._transfers[0][0] < cutoff:
+            self._transfers.popleft()
+        return self.bandwidth_bytes - sum(size for _, size in self._transfers)
+    
+    def _evict(self, incoming: int, keep: Set[Tuple[str, str]] = frozenset()) -> bool:
+        """
+        Drop expired files, then least recently used ones (except `keep`) until `incoming` more bytes fit.
+        
+        Returns:
+            False (evicting nothing beyond the expired files) if they cannot fit
+        """
+        now = time.time()
+        for key in [key for key, f in self._files.items() if now - f.created > FILE_SECONDS]:
+            self._remove(key)
+        evictable = [key for key in self._files if key not in keep]
+        kept_size = self._disk_size - sum(self._files[key].size for key in evictable)
+        if kept_size + incoming > self.disk_bytes:
+            return False
+        for key in evictable:
+            if self._disk_size + incoming <= self.disk_bytes:
+                break
+            self._remove(key)
+        return True
+    
+    def _remove(self, key: Tuple[str, str]):
+        prefetched = self._files.pop(key)
+        self._disk_size -= prefetched.size
+        try:
+            os.remove(prefetched.path)
+        except OSError:
+            pass
+    
+    async def claim(self, url: str, quality: str, dest_dir: str, job_id: str) -> Optional[str]:
+        """
+        Serve a job from a prefetched file, if there is one for this video and quality.
+        
+        The file is hard-linked into dest_dir under the job's name (copied
+        when dest_dir is on another filesystem) and stays prefetched for
+        the next job.
+        
+        Returns:
+            Path of the job's file, or None to download as usual
+        """
+        if not self.downloads:
+            return None
+        key = (cache_key(url), quality.lower())
+        prefetched = self._files.get(key)
+        if prefetched is None:
+            return None
+        dest = os.path.join(dest_dir, job_id + os.path.splitext(prefetched.path)[1])
+        try:
+            await asyncio.to_thread(_link_or_copy, prefetched.path, dest)
+        except OSError as e:
+            log.warning("Cannot use prefetched file", extra={'filepath': prefetched.path, 'error': str(e)})
+            self._remove(key)
+            return None
+        self._files.move_to_end(key)
+        self.hits += 1
+        return dest
+    
+    def stats(self) -> Dict:
+        """Counters, budget use and the current top videos for the admin API."""
+        return {
+            'enabled': self.enabled,
+            'downloads': self.downloads,
+            'tracked': len(self.tracker),
+            'warmed': self.warmed,
+            'downloaded': self.downloaded,
+            'downloaded_bytes': self.downloaded_bytes,
+            'hits': self.hits,
+            'failed': self.failed,
+            'skipped_budget': self.skipped_budget,
+            'files': len(self._files),
+            'disk_bytes': self._disk_size,
+            'disk_budget_bytes': self.disk_bytes,
+            'bandwidth_left_bytes': self._bandwidth_left(),
+            'top': [
+                {
+                    'video': video,
+                    'score': round(entry.score, 2),
+                    'quality': _top_quality(entry),
+                    'metadata_cached': info_cached(entry.url),
+                    'prefetched': (video, _top_quality(entry)) in self._files,
+                }
+                for video, entry in self.tracker.top(self.top_k)
+            ],
+        }
+
+
+def _idle() -> bool:
+    """True while no work waits for the executor and a worker would stay free for users."""
+    stats = executor_stats()
+    return stats['queued'] == 0 and stats['running'] < stats['max_workers'] - 1
+
+
+def _link_or_copy(src: str, dest: str):
+    try:
+        os.link(src, dest)
+    except OSError:
+        tmp = dest + '.tmp'
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+
+
+# Global prefetcher (disabled unless PREFETCH is set)
+prefetcher = Prefetcher()
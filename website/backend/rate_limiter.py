@@ -0,0 +1,409 @@
+"""
+Per-client rate limiting and quota accounting.
+
+Budgets are kept per client (IP address, or API key for known keys; behind
+a trusted reverse proxy the address comes from X-Forwarded-For):
+  - extractions: /api/info and /api/download calls in a sliding window
+  - thumbnails: /api/thumb calls in a sliding window (a miss fetches upstream)
+  - concurrent jobs: unfinished download jobs at the same time
+  - daily bytes: estimated bytes downloaded in a sliding 24 hour window
+
+Sliding windows are approximated with two fixed windows (the previous
+window's count weighted by how much of it still overlaps), which needs two
+counters per key instead of a timestamp per request. Counters live in a
+pluggable backend: in memory by default, or Redis so several nodes share
+the same budgets. Calls into a backend that does network round trips are
+made in a thread (RateLimiter.call), off the event loop.
+
+CORS preflights (OPTIONS) are never counted, and the middleware is meant
+to sit inside CORSMiddleware so browsers can read its 429 responses.
+"""
+import asyncio
+import ipaddress
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional, Tuple
+
+
+DAY_SECONDS = 24 * 3600
+
+# Paths that trigger a yt-dlp extraction
+EXTRACTION_PATHS = ('/api/info', '/api/download')
+
+# Prefix of the thumbnail proxy, whose misses fetch from the video site's CDN
+THUMBNAIL_PREFIX = '/api/thumb/'
+
+# Peers whose X-Forwarded-For is believed: loopback and private networks,
+# where hosting platforms' (Railway, Render) edge proxies connect from
+DEFAULT_TRUSTED_PROXIES = '127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,100.64.0.0/10,fc00::/7'
+
+
+def parse_rate(value: str) -> Tuple[int, float]:
+    """
+    Parse a rate given as 'count/seconds' (e.g. '30/60').
+    
+    Returns:
+        Tuple of (limit, window in seconds); a limit of 0 disables the budget
+    """
+    count, _, seconds = value.partition('/')
+    return int(count), float(seconds or 60)
+
+
+class RateLimitBackend(ABC):
+    """Storage for sliding-window counters; subclass to share them between nodes."""
+    
+    # Whether hit/peek block on I/O (and should run off the event loop)
+    blocking = False
+    
+    @abstractmethod
+    def hit(self, key: str, limit: float, window: float, cost: float = 1) -> Tuple[bool, float]:
+        """
+        Count `cost` against a key unless that would exceed the limit.
+        
+        Args:
+            key: Counter key
+            limit: Maximum count within the window
+            window: Window length in seconds
+            cost: Amount to add (1 per request, or a number of bytes)
+        
+        Returns:
+            Tuple of (allowed, seconds until enough budget frees up)
+        """
+    
+    @abstractmethod
+    def peek(self, key: str, window: float) -> float:
+        """Return the current sliding-window count for a key."""
+
+
+def _retry_after(previous: float, current: float, elapsed: float, window: float,
+                 limit: float, cost: float) -> float:
+    """Seconds until previous * weight + current + cost fits in the limit."""
+    if current + cost > limit or previous <= 0:
+        # Only the next window helps
+        return window - elapsed
+    # The previous window's weight falls linearly to zero over this window
+    weight_needed = (limit - current - cost) / previous
+    return max(0.0, window * (1 - weight_needed) - elapsed)
+
+
+class MemoryBackend(RateLimitBackend):
+    """In-process counters (one node only)."""
+    
+    def __init__(self, prune_every: int = 10000):
+        # key -> [window index, previous window count, current window count]
+        self._counters: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._prune_every = prune_every
+        self._ops = 0
+    
+    def _counter(self, key: str, window: float, now: float) -> list:
+        index = int(now // window)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = [index, 0, 0]
+        elif counter[0] != index:
+            # Roll forward; anything older than the previous window has expired
+            counter[1] = counter[2] if counter[0] == index - 1 else 0
+            counter[2] = 0
+            counter[0] = index
+        return counter
+    
+    def _estimate(self, counter: list, window: float, now: float) -> Tuple[float, float]:
+        elapsed = now - counter[0] * window
+        return counter[1] * (1 - elapsed / window) + counter[2], elapsed
+    
+    def hit(self, key: str, limit: float, window: float, cost: float = 1) -> Tuple[bool, float]:
+        now = time.time()
+        with self._lock:
+            self._ops += 1
+            if self._ops % self._prune_every == 0:
+                self._prune(now)
+            counter = self._counter(key, window, now)
+            estimate, elapsed = self._estimate(counter, window, now)
+            if estimate + cost > limit:
+                return False, _retry_after(counter[1], counter[2], elapsed, window, limit, cost)
+            counter[2] += cost
+            return True, 0.0
+    
+    def peek(self, key: str, window: float) -> float:
+        now = time.time()
+        with self._lock:
+            counter = self._counter(key, window, now)
+            return self._estimate(counter, window, now)[0]
+    
+    def _prune(self, now: float):
+        # Keys are prefixed with their window length (see RateLimiter._key)
+        stale = []
+        for key, counter in self._counters.items():
+            window = float(key.split(':', 1)[0])
+            if int(now // window) - counter[0] > 1:
+                stale.append(key)
+        for key in stale:
+            del self._counters[key]
+    
+    def __len__(self):
+        return len(self._counters)
+
+
+class RedisBackend(RateLimitBackend):
+    """Counters in Redis, shared by every node (requires the `redis` package)."""
+    
+    blocking = True
+    
+    # Check and increment in one step, so concurrent requests on several
+    # nodes cannot all pass the check before any of them has counted.
+    # KEYS: previous, current; ARGV: previous weight, limit, cost, TTL.
+    # Counts are returned as strings (Lua numbers would be truncated).
+    HIT_SCRIPT = """
+local previous = tonumber(redis.call('GET', KEYS[1]) or '0')
+local current = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[1]) + current + tonumber(ARGV[3]) > tonumber(ARGV[2]) then
+    return {0, tostring(previous), tostring(current)}
+end
+redis.call('INCRBYFLOAT', KEYS[2], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return {1, tostring(previous), tostring(current)}
+"""
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self._hit = self.client.register_script(self.HIT_SCRIPT)
+    
+    def _keys(self, key: str, window: float, now: float) -> Tuple[str, str, float]:
+        index = int(now // window)
+        return f"ratelimit:{key}:{index - 1}", f"ratelimit:{key}:{index}", now - index * window
+    
+    def hit(self, key: str, limit: float, window: float, cost: float = 1) -> Tuple[bool, float]:
+        now = time.time()
+        previous_key, current_key, elapsed = self._keys(key, window, now)
+        allowed, previous, current = self._hit(
+            keys=[previous_key, current_key],
+            args=[repr(1 - elapsed / window), repr(float(limit)), repr(float(cost)), int(window * 2) + 1],
+        )
+        if not int(allowed):
+            return False, _retry_after(float(previous), float(current), elapsed, window, limit, cost)
+        return True, 0.0
+    
+    def peek(self, key: str, window: float) -> float:
+        now = time.time()
+        previous_key, current_key, elapsed = self._keys(key, window, now)
+        previous, current = (float(v or 0) for v in self.client.mget(previous_key, current_key))
+        return previous * (1 - elapsed / window) + current
+
+
+class RateLimiter:
+    """Budgets per client on top of a counter backend, with hit metrics."""
+    
+    def __init__(
+        self,
+        backend: Optional[RateLimitBackend] = None,
+        extractions: str = "30/60",
+        thumbnails: str = "120/60",
+        concurrent_jobs: int = 3,
+        daily_bytes: int = 0,
+        api_keys: Tuple[str, ...] = (),
+        trusted_proxies: Tuple[str, ...] = (),
+    ):
+        """
+        Initialize the limiter.
+        
+        Args:
+            backend: Counter storage (in memory if None)
+            extractions: Extraction budget as 'count/seconds' (0 count disables)
+            thumbnails: Thumbnail budget as 'count/seconds' (0 count disables)
+            concurrent_jobs: Unfinished jobs allowed per client (0 disables)
+            daily_bytes: Estimated bytes per client per 24 hours (0 disables)
+            api_keys: Keys accepted in the X-API-Key header; each gets its own budget
+            trusted_proxies: Addresses or networks of reverse proxies whose
+                X-Forwarded-For header identifies the client
+        """
+        self.backend = backend or MemoryBackend()
+        self.extraction_limit, self.extraction_window = parse_rate(extractions)
+        self.thumbnail_limit, self.thumbnail_window = parse_rate(thumbnails)
+        self.concurrent_jobs = concurrent_jobs
+        self.daily_bytes = daily_bytes
+        self.api_keys = frozenset(api_keys)
+        self.trusted_proxies = tuple(ipaddress.ip_network(proxy.strip(), strict=False) for proxy in trusted_proxies)
+        self.metrics: Dict[str, Dict[str, int]] = {
+            budget: {'allowed': 0, 'limited': 0}
+            for budget in ('extractions', 'thumbnails', 'concurrent_jobs', 'daily_bytes')
+        }
+    
+    def _trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+    
+    def client_key(self, scope: Dict) -> str:
+        """
+        Identify the client of an ASGI request (API key if known, else IP).
+        
+        When the connection comes from a trusted proxy, the address is the
+        right-most X-Forwarded-For entry that is not itself a trusted proxy:
+        entries to its left were supplied by the client and can be forged.
+        """
+        forwarded = []
+        for name, value in scope.get('headers', ()):
+            if name == b'x-api-key':
+                api_key = value.decode('latin-1')
+                if api_key in self.api_keys:
+                    return f"key:{api_key}"
+            elif name == b'x-forwarded-for':
+                forwarded.extend(value.decode('latin-1').split(','))
+        client = scope.get('client')
+        address = client[0] if client else None
+        if address and self.trusted_proxies and self._trusted(address):
+            for hop in reversed(forwarded):
+                hop = hop.strip()
+                if hop:
+                    address = hop
+                    if not self._trusted(hop):
+                        break
+        return f"ip:{address or 'unknown'}"
+    
+    @staticmethod
+    def _key(budget: str, window: float, client: str) -> str:
+        return f"{window:g}:{budget}:{client}"
+    
+    async def call(self, check: Callable, *args):
+        """Run a check (e.g. check_extraction) in a thread if the backend blocks, else inline."""
+        if self.backend.blocking:
+            return await asyncio.to_thread(check, *args)
+        return check(*args)
+    
+    def _count(self, budget: str, allowed: bool) -> bool:
+        self.metrics[budget]['allowed' if allowed else 'limited'] += 1
+        return allowed
+    
+    def check_extraction(self, client: str) -> Tuple[bool, float]:
+        """Count one extraction call; returns (allowed, retry_after)."""
+        if self.extraction_limit <= 0:
+            return True, 0.0
+        allowed, retry_after = self.backend.hit(
+            self._key('extractions', self.extraction_window, client),
+            self.extraction_limit, self.extraction_window
+        )
+        self._count('extractions', allowed)
+        return allowed, retry_after
+    
+    def check_thumbnail(self, client: str) -> Tuple[bool, float]:
+        """Count one thumbnail call; returns (allowed, retry_after)."""
+        if self.thumbnail_limit <= 0:
+            return True, 0.0
+        allowed, retry_after = self.backend.hit(
+            self._key('thumbnails', self.thumbnail_window, client),
+            self.thumbnail_limit, self.thumbnail_window
+        )
+        self._count('thumbnails', allowed)
+        return allowed, retry_after
+    
+    def check_concurrent_jobs(self, active_jobs: int) -> bool:
+        """Check whether a client with `active_jobs` unfinished jobs may start another."""
+        if self.concurrent_jobs <= 0:
+            return True
+        return self._count('concurrent_jobs', active_jobs < self.concurrent_jobs)
+    
+    def check_daily_bytes(self, client: str) -> bool:
+        """Check whether a client has any download quota left today."""
+        if self.daily_bytes <= 0:
+            return True
+        used = self.backend.peek(self._key('daily_bytes', DAY_SECONDS, client), DAY_SECONDS)
+        return self._count('daily_bytes', used < self.daily_bytes)
+    
+    def charge_bytes(self, client: Optional[str], size: Optional[int]) -> bool:
+        """
+        Charge a planned download against the client's daily quota.
+        
+        Returns:
+            False if the download would exceed the quota (nothing is charged)
+        """
+        if self.daily_bytes <= 0 or not client or not size:
+            return True
+        allowed, _ = self.backend.hit(
+            self._key('daily_bytes', DAY_SECONDS, client), self.daily_bytes, DAY_SECONDS, size
+        )
+        return self._count('daily_bytes', allowed)
+    
+    def stats(self) -> Dict:
+        """Limiter hit counts for the metrics endpoint."""
+        stats = {'budgets': self.metrics}
+        if isinstance(self.backend, MemoryBackend):
+            stats['tracked_keys'] = len(self.backend)
+        return stats
+
+
+class RateLimitMiddleware:
+    """ASGI middleware enforcing the extraction, thumbnail, concurrency and byte budgets."""
+    
+    def __init__(self, app, limiter: RateLimiter, active_jobs: Callable[[str], int]):
+        """
+        Args:
+            app: ASGI application
+            limiter: Rate limiter
+            active_jobs: Returns the number of unfinished jobs of a client
+        """
+        self.app = app
+        self.limiter = limiter
+        self.active_jobs = active_jobs
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'OPTIONS':
+            return await self.app(scope, receive, send)
+        if scope['path'].startswith(THUMBNAIL_PREFIX):
+            allowed, retry_after = await self.limiter.call(self.limiter.check_thumbnail, self.limiter.client_key(scope))
+            if not allowed:
+                return await self._reject(send, "Too many requests", retry_after)
+            return await self.app(scope, receive, send)
+        if scope['path'] not in EXTRACTION_PATHS:
+            return await self.app(scope, receive, send)
+        
+        client = self.limiter.client_key(scope)
+        # Made available to the endpoint as request.state.rate_limit_client
+        scope.setdefault('state', {})['rate_limit_client'] = client
+        
+        if scope['path'] == '/api/download' and scope['method'] == 'POST':
+            if not self.limiter.check_concurrent_jobs(self.active_jobs(client)):
+                return await self._reject(send, "Too many downloads in progress", 5)
+            if not await self.limiter.call(self.limiter.check_daily_bytes, client):
+                return await self._reject(send, "Daily download quota exceeded", 3600)
+        
+        allowed, retry_after = await self.limiter.call(self.limiter.check_extraction, client)
+        if not allowed:
+            return await self._reject(send, "Too many requests", retry_after)
+        
+        return await self.app(scope, receive, send)
+    
+    async def _reject(self, send, message: str, retry_after: float):
+        body = json.dumps({'success': False, 'error': message}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 429,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(max(1, int(retry_after + 0.999))).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def limiter_from_env() -> RateLimiter:
+    """Build the rate limiter from RATE_LIMIT_* environment variables."""
+    redis_url = os.environ.get('RATE_LIMIT_REDIS_URL')
+    return RateLimiter(
+        backend=RedisBackend(redis_url) if redis_url else MemoryBackend(),
+        extractions=os.environ.get('RATE_LIMIT_EXTRACTIONS', '30/60'),
+        thumbnails=os.environ.get('RATE_LIMIT_THUMBNAILS', '120/60'),
+        concurrent_jobs=int(os.environ.get('RATE_LIMIT_CONCURRENT_JOBS', '3')),
+        daily_bytes=int(os.environ.get('RATE_LIMIT_DAILY_BYTES', str(20 * 1024 ** 3))),
+        api_keys=tuple(k for k in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',') if k),
+        trusted_proxies=tuple(
+            p for p in os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', DEFAULT_TRUSTED_PROXIES).split(',') if p.strip()
+        ),
+    )
@@ -0,0 +1,255 @@
+"""
+Scratch staging for in-flight downloads.
+
+With SCRATCH_DIR set (e.g. a tmpfs mount or local NVMe), a job downloads,
+merges and converts in the scratch directory, and only the finished file
+is published into the serving directory. Publishing is atomic: a rename on
+the same filesystem, otherwise a copy to a temporary name in the serving
+directory followed by a rename. Cleanup and /api/file therefore never see
+half-written files, and the write churn of fragments and intermediates
+stays off the persistent volume.
+
+Scratch space is reserved per job from its planned size. A job that does
+not fit under SCRATCH_MAX_BYTES or the free space of the scratch
+filesystem (or whose size is unknown) downloads straight into the serving
+directory as before. If the scratch filesystem fills up anyway (the plan
+underestimated, or something else wrote to it), the job's scratch files
+are dropped and it is downloaded again into the serving directory.
+"""
+import asyncio
+import errno
+import os
+import shutil
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from downloader import remove_job_files
+from structured_log import get_logger
+
+log = get_logger('scratch')
+
+# Reserved per job, as a multiple of the planned size: separate video and
+# audio files plus the merged output can briefly exist side by side
+WRITE_FACTOR = 2.0
+
+
+class ScratchSpace:
+    """Hands out work directories for jobs and publishes their results."""
+    
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 0):
+        """
+        Initialize the scratch space.
+        
+        Args:
+            path: Scratch directory (None disables staging)
+            max_bytes: Cap on bytes reserved at once (0: only the free space limits it)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._reserved: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.staged = 0
+        self.fallbacks = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+    
+    def acquire(self, job_id: str, estimated_bytes: Optional[int], fallback_dir: str) -> str:
+        """
+        Pick the directory a job downloads into.
+        
+        A job that already has files somewhere (resumed after a restart)
+        keeps using that directory so its partial files are picked up.
+        
+        Args:
+            job_id: Job identifier
+            estimated_bytes: Planned download size (None if unknown)
+            fallback_dir: Serving directory, used when the job is not staged
+        
+        Returns:
+            Work directory for the job
+        """
+        if not self.path:
+            return fallback_dir
+        if _has_job_files(self.path, job_id):
+            return self.path
+        if _has_job_files(fallback_dir, job_id) or not estimated_bytes:
+            return fallback_dir
+        
+        needed = int(estimated_bytes * WRITE_FACTOR)
+        with self._lock:
+            reserved = sum(self._reserved.values())
+            try:
+                free = shutil.disk_usage(self.path).free
+            except OSError:
+                free = 0
+            # Reserved space is promised to running jobs even while they have not written it yet
+            fits = reserved + needed <= free and (not self.max_bytes or reserved + needed <= self.max_bytes)
+            if fits:
+                self._reserved[job_id] = needed
+                self.staged += 1
+            else:
+                self.fallbacks += 1
+        if not fits:
+            log.info("Scratch space full, downloading to disk",
+                     extra={'job_id': job_id, 'needed_bytes': needed, 'reserved_bytes': reserved})
+            return fallback_dir
+        return self.path
+    
+    def release(self, job_id: str):
+        """Return a job's reservation."""
+        with self._lock:
+            self._reserved.pop(job_id, None)
+    
+    async def download(
+        self,
+        download: Callable[..., Awaitable[Tuple[bool, str, Optional[str]]]],
+        url: str,
+        output_dir: str,
+        quality: str,
+        job_id: str,
+        *args,
+        estimated_bytes: Optional[int] = None,
+        **kwargs,
+    ) -> Tuple[bool, str, Optional[str]]:
+        """
+        Run a download (downloader.download_video) in a work directory and publish its result.
+        
+        Args:
+            download: Download coroutine function
+            url, output_dir, quality, job_id, *args, **kwargs: Its arguments
+            estimated_bytes: Planned size, used to reserve scratch space
+        
+        Returns:
+            The download's (success, message, filepath), with filepath in output_dir
+        """
+        work_dir = self.acquire(job_id, estimated_bytes, output_dir)
+        try:
+            try:
+                success, message, filepath = await download(url, work_dir, quality, job_id, *args, **kwargs)
+            except OSError as e:
+                if e.errno != errno.ENOSPC or work_dir == output_dir:
+                    raise
+                success, message, filepath = False, str(e), None
+            if not success and work_dir != output_dir and _out_of_space(message):
+                log.warning("Scratch space ran out, downloading to disk instead",
+                            extra={'job_id': job_id, 'error': message})
+                self.release(job_id)
+                remove_job_files(work_dir, job_id)
+                with self._lock:
+                    self.fallbacks += 1
+                work_dir = output_dir
+                success, message, filepath = await download(url, work_dir, quality, job_id, *args, **kwargs)
+            if success and filepath:
+                # A copy across filesystems can take a while; keep it off the event loop
+                filepath = await asyncio.to_thread(self.publish, filepath, output_dir)
+        finally:
+            self.release(job_id)
+        return success, message, filepath
+    
+    def publish(self, filepath: str, dest_dir: str) -> str:
+        """
+        Move a finished file into the serving directory atomically.
+        
+        Args:
+            filepath: Finished file in a work directory
+            dest_dir: Serving directory
+        
+        Returns:
+            Path of the published file
+        """
+        dest = os.path.join(dest_dir, os.path.basename(filepath))
+        if os.path.abspath(os.path.dirname(filepath)) == os.path.abspath(dest_dir):
+            return filepath
+        try:
+            os.replace(filepath, dest)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Different filesystems: copy under a temporary name, then rename into place
+            tmp = dest + '.publish.tmp'
+            try:
+                with open(filepath, 'rb') as src, open(tmp, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 4 * 1024 * 1024)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.replace(tmp, dest)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            os.remove(filepath)
+        return dest
+    
+    def sweep(self, max_age_seconds: float, keep_job_ids: Iterable[str] = ()) -> int:
+        """
+        Delete scratch files left behind by jobs that are gone (e.g. after a crash).
+        
+        Args:
+            max_age_seconds: Only files older than this are removed
+            keep_job_ids: Jobs whose files must stay (still running or resumable)
+        
+        Returns:
+            Number of files removed
+        """
+        if not self.path:
+            return 0
+        keep = tuple(f"{job_id}." for job_id in keep_job_ids)
+        now = time.time()
+        removed = 0
+        try:
+            entries = list(os.scandir(self.path))
+        except OSError:
+            return 0
+        for entry in entries:
+            if (keep and entry.name.startswith(keep)) or not entry.is_file():
+                continue
+            try:
+                if now - entry.stat().st_mtime > max_age_seconds:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                log.warning("Error deleting scratch file", extra={'filepath': entry.path, 'error': str(e)})
+        return removed
+    
+    def stats(self) -> Dict:
+        """Scratch reservations and usage for the admin API."""
+        with self._lock:
+            reserved = sum(self._reserved.values())
+            jobs = len(self._reserved)
+        stats = {
+            'path': self.path,
+            'max_bytes': self.max_bytes,
+            'reserved_bytes': reserved,
+            'jobs': jobs,
+            'staged': self.staged,
+            'fallbacks': self.fallbacks,
+        }
+        if self.path:
+            try:
+                stats['free_bytes'] = shutil.disk_usage(self.path).free
+            except OSError:
+                stats['free_bytes'] = None
+        return stats
+
+
+def _has_job_files(directory: str, job_id: str) -> bool:
+    prefix = f"{job_id}."
+    try:
+        return any(name.startswith(prefix) for name in os.listdir(directory))
+    except OSError:
+        return False
+
+
+def _out_of_space(message: Optional[str]) -> bool:
+    """Whether a failed download's message reports a full filesystem (yt-dlp and FFmpeg pass it on as text)."""
+    return bool(message) and os.strerror(errno.ENOSPC) in message
+
+
+# Global scratch space (disabled unless SCRATCH_DIR is set)
+scratch_space = ScratchSpace(
+    path=os.environ.get('SCRATCH_DIR') or None,
+    max_bytes=int(os.environ.get('SCRATCH_MAX_BYTES', '0')),
+)
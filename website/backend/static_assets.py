@@ -0,0 +1,205 @@
+"""
+Fingerprinted, precompressed static assets.
+
+The build step (run at deploy time, from website/):
+    python backend/static_assets.py
+
+copies website/static into website/build/static. CSS and JS files also get
+a copy named after their content hash (style.css -> style.3f9a1c0b2e.css),
+and the HTML pages are rewritten to reference those. Every text file gets
+gzip and, with the `brotli` package installed, brotli siblings
+(style.3f9a1c0b2e.css.gz / .br), compressed once at maximum level.
+
+At runtime PrecompressedStaticFiles serves the build when it exists (the
+source directory otherwise, for development): it picks the precompressed
+sibling the client accepts, and marks fingerprinted files immutable so
+browsers and CDNs never ask for them again. Everything else, HTML
+included, is revalidated through its ETag.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import stat
+from typing import Dict, Set
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+WEBSITE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join(WEBSITE_DIR, 'static')
+BUILD_DIR = os.environ.get('STATIC_BUILD_DIR', os.path.join(WEBSITE_DIR, 'build', 'static'))
+MANIFEST = 'manifest.json'
+
+# Files renamed by content hash; HTML references them, so the pages are rewritten
+FINGERPRINTED = ('.css', '.js')
+
+# Files precompressed at build time
+COMPRESSIBLE = ('.html', '.css', '.js', '.svg', '.json', '.txt', '.xml')
+
+# Smaller files are not worth a compressed sibling
+MIN_COMPRESS_BYTES = 256
+
+FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{10}\.[a-z0-9]+$')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _fingerprinted_name(relpath: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(relpath)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _compress(path: str, data: bytes):
+    """Write .gz/.br siblings of a file when they are smaller than it."""
+    if len(data) < MIN_COMPRESS_BYTES:
+        return
+    # mtime=0 keeps the output (and so its ETag) identical across builds
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(data):
+            _write(path + suffix, compressed)
+
+
+def build(source_dir: str = SOURCE_DIR, build_dir: str = BUILD_DIR) -> Dict[str, str]:
+    """
+    Build the static directory served in production.
+    
+    The new build is written next to the old one and swapped in when
+    complete, so a running server never sees a half-written build.
+    
+    Args:
+        source_dir: Static sources (website/static)
+        build_dir: Output directory
+    
+    Returns:
+        Manifest: source path -> fingerprinted path (relative, '/'-separated)
+    """
+    files: Dict[str, bytes] = {}
+    for root, _, names in os.walk(source_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, source_dir).replace(os.sep, '/')] = f.read()
+    
+    manifest = {
+        relpath: _fingerprinted_name(relpath, data)
+        for relpath, data in files.items() if relpath.endswith(FINGERPRINTED)
+    }
+    output: Dict[str, bytes] = {}
+    for relpath, data in files.items():
+        if relpath.endswith('.html'):
+            text = data.decode('utf-8')
+            for original, hashed in manifest.items():
+                text = text.replace(f'/static/{original}', f'/static/{hashed}')
+            data = text.encode('utf-8')
+        # Unhashed names stay available for pages cached before a deploy
+        output[relpath] = data
+        if relpath in manifest:
+            output[manifest[relpath]] = data
+    
+    staging = build_dir + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    for relpath, data in output.items():
+        path = os.path.join(staging, *relpath.split('/'))
+        _write(path, data)
+        if relpath.endswith(COMPRESSIBLE):
+            _compress(path, data)
+    _write(os.path.join(staging, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    
+    previous = build_dir + '.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.isdir(build_dir):
+        os.rename(build_dir, previous)
+    os.rename(staging, build_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+
+def _accepted_encodings(header: str) -> Set[str]:
+    """Encodings named in an Accept-Encoding header, minus those refused with q=0."""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if name and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def static_directory() -> str:
+    """The build directory if it has been built, else the sources."""
+    if os.path.isfile(os.path.join(BUILD_DIR, MANIFEST)):
+        return BUILD_DIR
+    return SOURCE_DIR
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves .br/.gz siblings and caches fingerprinted files forever."""
+    
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        headers = {
+            'Cache-Control': IMMUTABLE if FINGERPRINT_RE.search(full_path) else REVALIDATE,
+        }
+        media_type = None
+        accepted = _accepted_encodings(request_headers.get('accept-encoding', ''))
+        for encoding, suffix in ENCODINGS:
+            try:
+                compressed_stat = os.stat(full_path + suffix)
+            except OSError:
+                continue
+            headers['Vary'] = 'Accept-Encoding'
+            if encoding in accepted and stat.S_ISREG(compressed_stat.st_mode):
+                headers['Content-Encoding'] = encoding
+                # The content type is the original file's, not the archive's
+                media_type = mimetypes.guess_type(full_path)[0] or 'text/plain'
+                full_path, stat_result = full_path + suffix, compressed_stat
+                break
+        
+        response = FileResponse(
+            full_path, status_code=status_code, stat_result=stat_result, headers=headers, media_type=media_type,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def main():
+    manifest = build()
+    print(f"Built {BUILD_DIR} ({len(manifest)} fingerprinted, brotli {'on' if brotli else 'off'})")
+    for original, hashed in sorted(manifest.items()):
+        print(f"  {original} -> {hashed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Streaming merge: video and audio are piped straight into one FFmpeg
+stream-copy process while they download, so the MP4 is written once.
+
+The regular yt-dlp path writes the video stream and the audio stream to
+their own files and then merges them into a third, so every byte reaches
+the disk at least twice. Here each stream is fetched in ranged chunks (as
+yt-dlp does, to avoid throttling) by its own thread and written to a pipe
+that FFmpeg reads as an input; only the muxed output touches the disk.
+
+Only direct HTTP(S) formats whose codecs can be copied into MP4 qualify,
+and only on POSIX (FFmpeg reads the extra inputs from inherited pipe fds).
+Anything else, or any failure, falls back to the regular path.
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Callable, Dict, List, Optional, Tuple
+
+from format_planner import MP4_AUDIO_CODECS, MP4_VIDEO_CODECS
+
+
+# Range request size, same as yt-dlp's http_chunk_size in the regular path
+CHUNK_SIZE = 10 * 1024 * 1024
+
+# Size of each read from the HTTP response / write into the pipe
+BLOCK_SIZE = 256 * 1024
+
+# Attempts per range request before the stream is given up
+RETRIES = 5
+
+_CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(?:\d+|\*)')
+
+
+class StreamMergeError(Exception):
+    """The streaming merge failed; the caller falls back to separate files."""
+
+
+def _codec(fmt: Dict, key: str) -> Optional[str]:
+    codec = fmt.get(key)
+    return codec.split('.')[0].lower() if codec and codec != 'none' else None
+
+
+def streamable_formats(info: Dict) -> Optional[Tuple[Dict, Dict]]:
+    """
+    Pick the (video, audio) pair of a processed yt-dlp info dict if it can be streamed.
+    
+    Returns:
+        Tuple of (video format, audio format), or None
+    """
+    if os.name != 'posix':
+        return None
+    requested = info.get('requested_formats') or []
+    if len(requested) != 2:
+        return None
+    video, audio = requested
+    if _codec(video, 'vcodec') not in MP4_VIDEO_CODECS or _codec(audio, 'acodec') not in MP4_AUDIO_CODECS:
+        return None
+    for fmt in requested:
+        if fmt.get('protocol') not in ('http', 'https') or not fmt.get('url') or fmt.get('fragments'):
+            return None
+    return video, audio
+
+
+def _expected_size(fmt: Dict) -> Optional[int]:
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    return int(size) if size else None
+
+
+def _check_range(response, start: int, end: int):
+    """
+    Make sure a response carries the requested range, starting at `start`.
+    
+    A server that ignores Range answers 200 with the whole file (or a range
+    from elsewhere), which would be piped in at the wrong position and
+    silently corrupt the output.
+    
+    Raises:
+        StreamMergeError: If the response is not a 206 for that range
+    """
+    if response.status != 206:
+        raise StreamMergeError(f"Range request bytes={start}-{end} answered with HTTP {response.status}")
+    content_range = response.headers.get('Content-Range', '')
+    match = _CONTENT_RANGE_RE.fullmatch(content_range.strip())
+    if not match or int(match.group(1)) != start or int(match.group(2)) > end:
+        raise StreamMergeError(f"Range request bytes={start}-{end} answered with Content-Range {content_range!r}")
+
+
+def _pump(fmt: Dict, pipe_fd: int, on_bytes: Callable[[int], None], stop: threading.Event):
+    """Download one format in ranged chunks into a pipe."""
+    headers = dict(fmt.get('http_headers') or {})
+    size = _expected_size(fmt) if fmt.get('filesize') else None
+    offset = 0
+    with os.fdopen(pipe_fd, 'wb', buffering=0) as pipe:
+        while not stop.is_set():
+            end = offset + CHUNK_SIZE - 1
+            if size:
+                end = min(end, size - 1)
+            wanted = end - offset + 1
+            received = 0
+            for attempt in range(RETRIES):
+                request = urllib.request.Request(
+                    fmt['url'], headers={**headers, 'Range': f"bytes={offset + received}-{end}"}
+                )
+                try:
+                    with urllib.request.urlopen(request, timeout=30) as response:
+                        _check_range(response, offset + received, end)
+                        while not stop.is_set():
+                            block = response.read(BLOCK_SIZE)
+                            if not block:
+                                break
+                            pipe.write(block)
+                            received += len(block)
+                            on_bytes(len(block))
+                    break
+                except urllib.error.HTTPError as e:
+                    if e.code == 416:
+                        # Asked past the end: the previous chunk was the last one
+                        return
+                    if attempt == RETRIES - 1:
+                        raise
+                except (urllib.error.URLError, OSError) as e:
+                    if isinstance(e, BrokenPipeError) or attempt == RETRIES - 1:
+                        raise
+                time.sleep(attempt + 1)
+            offset += received
+            if received < wanted or (size and offset >= size):
+                return
+
+
+def stream_merge(
+    video: Dict,
+    audio: Dict,
+    ffmpeg: str,
+    output_file: str,
+    cancelled: Callable[[], bool],
+    on_progress: Optional[Callable[[int, Optional[int], Optional[float]], None]] = None,
+):
+    """
+    Download a video and an audio format and mux them into `output_file` in one pass.
+    
+    The output is written to `output_file + '.part'` and renamed when FFmpeg
+    has finished, so a complete file is never confused with a partial one.
+    
+    Args:
+        video: yt-dlp format dict of the video stream (with url/http_headers)
+        audio: yt-dlp format dict of the audio stream
+        ffmpeg: FFmpeg executable
+        output_file: Final MP4 path
+        cancelled: Returns True when the job has been cancelled
+        on_progress: Called with (downloaded bytes, expected total, bytes/s)
+    
+    Raises:
+        StreamMergeError: If a download or FFmpeg failed (the partial output is removed)
+    """
+    part_file = output_file + '.part'
+    video_read, video_write = os.pipe()
+    audio_read, audio_write = os.pipe()
+    process = subprocess.Popen(
+        [
+            ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+            '-i', f'pipe:{video_read}', '-i', f'pipe:{audio_read}',
+            '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-f', 'mp4', part_file,
+        ],
+        pass_fds=(video_read, audio_read),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    os.close(video_read)
+    os.close(audio_read)
+    
+    sizes = [_expected_size(video), _expected_size(audio)]
+    total = sum(sizes) if all(sizes) else None
+    started = time.monotonic()
+    downloaded = 0
+    lock = threading.Lock()
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    
+    def on_bytes(count: int):
+        nonlocal downloaded
+        with lock:
+            downloaded += count
+            done = downloaded
+        if cancelled():
+            stop.set()
+        elif on_progress:
+            on_progress(done, total, done / max(time.monotonic() - started, 1e-3))
+    
+    def run(fmt: Dict, pipe_fd: int):
+        try:
+            _pump(fmt, pipe_fd, on_bytes, stop)
+        except BaseException as e:
+            errors.append(e)
+            # Stop the other stream too; killing FFmpeg unblocks its writes
+            stop.set()
+            process.kill()
+    
+    pumps = [
+        threading.Thread(target=run, args=(video, video_write), daemon=True),
+        threading.Thread(target=run, args=(audio, audio_write), daemon=True),
+    ]
+    for pump in pumps:
+        pump.start()
+    for pump in pumps:
+        pump.join()
+    if stop.is_set():
+        process.kill()
+    stderr = process.communicate()[1].decode('utf-8', 'replace').strip()
+    
+    if stop.is_set() or errors or process.returncode != 0:
+        try:
+            os.remove(part_file)
+        except OSError:
+            pass
+        if errors:
+            raise StreamMergeError(f"Stream download failed: {errors[0]}")
+        if stop.is_set():
+            raise StreamMergeError("Cancelled")
+        raise StreamMergeError(f"FFmpeg exited with {process.returncode}: {stderr[-500:]}")
+    os.replace(part_file, output_file)
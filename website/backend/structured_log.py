@@ -0,0 +1,185 @@
+"""
+Structured, non-blocking logging.
+
+Records are written as one JSON object per line (or plain text with
+LOG_FORMAT=text). Logging calls only put the record on a queue; a listener
+thread formats and writes them, so request handlers and download threads
+never wait on stdout.
+
+Each record carries the context of the job it belongs to (job_id,
+video_id, stage), so one job can be traced with a single filter such as
+`jq 'select(.job_id == "...")'`. The context is kept in a context variable,
+which follows the job into executor threads (see downloader._run_in_executor).
+
+High-volume records (download progress) are sampled: a record logged with
+`extra={'sample': key}` is passed at most once per LOG_SAMPLE_SECONDS per
+key and job.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextvars import ContextVar, Token
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+
+# Parent of every logger in the backend (see get_logger)
+ROOT_LOGGER = 'ytdl'
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_SAMPLE_SECONDS = float(os.environ.get('LOG_SAMPLE_SECONDS', '5'))
+
+_context: ContextVar[Dict] = ContextVar('log_context', default={})
+
+# Attributes of a plain LogRecord; anything else was passed in `extra`
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for a backend module (a child of the 'ytdl' logger)."""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def bind_log_context(**fields) -> Token:
+    """
+    Add fields (job_id, video_id, stage, ...) to the current log context.
+    
+    Returns:
+        Token for reset_log_context
+    """
+    return _context.set({**_context.get(), **fields})
+
+
+def reset_log_context(token: Token):
+    """Restore the log context from before bind_log_context."""
+    _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log context onto each record."""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Passes a sampled record at most once per interval per (sample key, job)."""
+    
+    def __init__(self, interval: float):
+        super().__init__()
+        self.interval = interval
+        self._last: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample = getattr(record, 'sample', None)
+        if sample is None:
+            return True
+        key = (sample, getattr(record, 'job_id', None))
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last.get(key, float('-inf')) < self.interval:
+                return False
+            self._last[key] = now
+            if len(self._last) > 10000:
+                # Forget keys of jobs that stopped logging
+                self._last = {k: t for k, t in self._last.items() if now - t < self.interval}
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, context and extras."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and name != 'sample':
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable single-line records for local development."""
+    
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s %(message)s')
+    
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        job_id = getattr(record, 'job_id', None)
+        return f"[{job_id}] {line}" if job_id else line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that keeps the traceback separate from the message."""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, stream=None):
+    """
+    Route the backend's loggers through a queue to a writer thread.
+    
+    Safe to call more than once; later calls only change the level.
+    
+    Args:
+        level: Minimum level (DEBUG shows sampled download progress)
+        fmt: 'json' or 'text'
+        stream: Output stream (default: stdout)
+    """
+    global _listener, _handler
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel(level)
+    if _listener is not None:
+        return
+    
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(TextFormatter() if fmt == 'text' else JsonFormatter())
+    
+    _handler = _QueueHandler(queue.SimpleQueue())
+    # Filters run in the calling thread, where the job's log context is set
+    _handler.addFilter(ContextFilter())
+    _handler.addFilter(SamplingFilter(LOG_SAMPLE_SECONDS))
+    logger.addHandler(_handler)
+    logger.propagate = False
+    
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        logging.getLogger(ROOT_LOGGER).removeHandler(_handler)
+        _listener = _handler = None
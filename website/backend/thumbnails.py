@@ -0,0 +1,353 @@
+"""
+Thumbnail proxy with resized, cached variants.
+
+The upstream thumbnail of a video is fetched once, decoded once and
+re-encoded at a few widths as WebP and JPEG. The variants are kept in a
+memory LRU in front of a disk LRU, both bounded in bytes, so /api/thumb
+serves small images from cache instead of every page view pulling the
+full-size original from the video site's CDN.
+
+Upstream URLs come from /api/info (registered per video ID when the video
+is extracted) or, for IDs never seen, from THUMB_URL_TEMPLATE. Concurrent
+misses for one video share a single upstream fetch, and failed fetches
+are remembered for a minute so a broken thumbnail cannot hammer upstream.
+Only IDs that are valid YouTube video IDs (video_url.VIDEO_ID_RE) are
+fetched, and /api/thumb is rate-limited per client (rate_limiter).
+
+Resizing requires Pillow (`pip install Pillow`); without it the original
+image is cached and served as is.
+"""
+import asyncio
+import hashlib
+import io
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from structured_log import get_logger
+from video_url import VIDEO_ID_RE
+
+log = get_logger('thumbnails')
+
+# Variant name -> width in pixels (the page shows 200px, full width on phones)
+SIZES = {'small': 200, 'medium': 400, 'large': 640}
+
+FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+QUALITY = 80
+
+# Upstream for video IDs that /api/info has not registered
+URL_TEMPLATE = os.environ.get('THUMB_URL_TEMPLATE', 'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg')
+
+# Largest upstream image accepted
+MAX_SOURCE_BYTES = 5 * 1024 * 1024
+
+# A failed upstream fetch is not retried for this long
+FAILURE_SECONDS = 60
+
+# Video IDs whose upstream URL is remembered
+REGISTRY_SIZE = 10000
+
+# Failed video IDs remembered at most
+FAILURES_SIZE = 10000
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ThumbnailError(Exception):
+    """The upstream thumbnail could not be fetched or decoded."""
+
+
+class ThumbnailNotFound(ThumbnailError):
+    """No thumbnail is known for the video ID."""
+
+
+@dataclass(slots=True)
+class Variant:
+    """One cached rendition of a thumbnail."""
+    data: bytes
+    media_type: str
+    etag: str
+
+
+def _variant(data: bytes, media_type: str) -> Variant:
+    return Variant(data, media_type, f'"{hashlib.sha1(data).hexdigest()[:20]}"')
+
+
+def _sniff(data: bytes) -> str:
+    """Media type of an image from its magic bytes."""
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def _fetch(url: str) -> bytes:
+    """Download an upstream image (blocking)."""
+    request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            content_type = response.headers.get('Content-Type', '')
+            if not content_type.startswith('image/'):
+                raise ThumbnailError(f"Upstream returned {content_type or 'no content type'}")
+            data = response.read(MAX_SOURCE_BYTES + 1)
+    except urllib.error.HTTPError as e:
+        if e.code == 404:
+            raise ThumbnailNotFound(f"Upstream returned HTTP {e.code}") from e
+        raise ThumbnailError(f"Upstream returned HTTP {e.code}") from e
+    except (urllib.error.URLError, OSError) as e:
+        raise ThumbnailError(f"Upstream fetch failed: {e}") from e
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ThumbnailError("Upstream image too large")
+    return data
+
+
+def _render(source: bytes) -> Dict[str, bytes]:
+    """
+    Encode every size/format variant of a source image (blocking).
+    
+    Returns:
+        Variant key ('small.webp', ...) -> encoded bytes; just 'original'
+        without Pillow
+    """
+    if Image is None:
+        return {'original': source}
+    try:
+        image = Image.open(io.BytesIO(source))
+        # JPEG sources decode straight at a reduced scale when that still covers the largest variant
+        largest = max(SIZES.values())
+        image.draft('RGB', (largest, max(1, image.height * largest // max(image.width, 1))))
+        image.load()
+    except Exception as e:
+        raise ThumbnailError(f"Cannot decode upstream image: {e}") from e
+    image = image.convert('RGB')
+    variants = {}
+    # Largest first, each variant resized from the previous one
+    for size, width in sorted(SIZES.items(), key=lambda item: -item[1]):
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))),
+                                 Image.LANCZOS, reducing_gap=3.0)
+        for fmt in FORMATS:
+            buffer = io.BytesIO()
+            if fmt == 'webp':
+                # method 2: a few percent larger than the default, three times faster
+                image.save(buffer, 'WEBP', quality=QUALITY, method=2)
+            else:
+                image.save(buffer, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+            variants[f'{size}.{fmt}'] = buffer.getvalue()
+    return variants
+
+
+class ThumbnailCache:
+    """Memory and disk LRU of thumbnail variants in front of the upstream CDN."""
+    
+    def __init__(self, cache_dir: str, memory_bytes: int, disk_bytes: int, url_template: str = URL_TEMPLATE):
+        """
+        Initialize the cache.
+        
+        Args:
+            cache_dir: Directory for cached variants (created if missing)
+            memory_bytes: Cap on variant bytes held in memory
+            disk_bytes: Cap on variant bytes kept in cache_dir
+            url_template: Upstream URL for unregistered IDs, with {video_id}
+        """
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.url_template = url_template
+        self._memory: "OrderedDict[str, Variant]" = OrderedDict()
+        self._memory_size = 0
+        # File name -> size, least recently used first; guarded by _disk_lock
+        # because the files are read and written on worker threads
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+        self._sources: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Video ID -> (retry time, error), oldest first (every entry lives FAILURE_SECONDS)
+        self._failures: "OrderedDict[str, Tuple[float, ThumbnailError]]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_size += size
+    
+    def register(self, video_id: str, url: str):
+        """Remember the upstream thumbnail URL reported by extraction."""
+        if not VIDEO_ID_RE.fullmatch(video_id) or not url.startswith(('http://', 'https://')):
+            return
+        self._sources[video_id] = url
+        self._sources.move_to_end(video_id)
+        while len(self._sources) > REGISTRY_SIZE:
+            self._sources.popitem(last=False)
+    
+    def source_url(self, video_id: str) -> Optional[str]:
+        url = self._sources.get(video_id)
+        if url is None and self.url_template:
+            url = self.url_template.format(video_id=video_id)
+        return url
+    
+    async def get(self, video_id: str, size: str, fmt: str) -> Variant:
+        """
+        Get a thumbnail variant, fetching and rendering the video's thumbnail on a miss.
+        
+        Args:
+            video_id: Video ID
+            size: Key of SIZES
+            fmt: Key of FORMATS (ignored without Pillow)
+        
+        Raises:
+            ThumbnailNotFound: If the ID is invalid or has no thumbnail
+            ThumbnailError: If the upstream fetch or decode failed
+        """
+        if not VIDEO_ID_RE.fullmatch(video_id):
+            raise ThumbnailNotFound("Invalid video ID")
+        key = f'{video_id}.{size}.{fmt}' if Image is not None else f'{video_id}.original'
+        
+        variant = self._memory_get(key)
+        if variant is not None:
+            self.memory_hits += 1
+            return variant
+        variant = await asyncio.to_thread(self._disk_get, key)
+        if variant is not None:
+            self.disk_hits += 1
+            self._memory_put(key, variant)
+            return variant
+        
+        failure = self._failures.get(video_id)
+        if failure and failure[0] > time.monotonic():
+            raise failure[1]
+        # Concurrent misses for one video wait for the same fetch
+        pending = self._inflight.get(video_id)
+        if pending is None:
+            pending = self._inflight[video_id] = asyncio.ensure_future(self._load(video_id))
+            pending.add_done_callback(lambda _: self._inflight.pop(video_id, None))
+        variants = await asyncio.shield(pending)
+        return variants[key]
+    
+    async def _load(self, video_id: str) -> Dict[str, Variant]:
+        url = self.source_url(video_id)
+        if url is None:
+            raise ThumbnailNotFound("No thumbnail known for this video")
+        self.fetches += 1
+        try:
+            source = await asyncio.to_thread(_fetch, url)
+            rendered = await asyncio.to_thread(_render, source)
+            await asyncio.to_thread(self._disk_put, video_id, rendered)
+        except ThumbnailError as e:
+            self.fetch_errors += 1
+            self._remember_failure(video_id, e)
+            log.warning("Thumbnail fetch failed", extra={'video_id': video_id, 'error': str(e)})
+            raise
+        self._failures.pop(video_id, None)
+        variants = {}
+        for name, data in rendered.items():
+            key = f'{video_id}.{name}'
+            variants[key] = _variant(data, _sniff(data))
+            self._memory_put(key, variants[key])
+        return variants
+    
+    def _remember_failure(self, video_id: str, error: ThumbnailError):
+        now = time.monotonic()
+        self._failures.pop(video_id, None)
+        self._failures[video_id] = (now + FAILURE_SECONDS, error)
+        # Expired entries are at the front
+        while self._failures:
+            oldest_id, (retry_at, _) = next(iter(self._failures.items()))
+            if retry_at > now and len(self._failures) <= FAILURES_SIZE:
+                break
+            del self._failures[oldest_id]
+    
+    def _memory_get(self, key: str) -> Optional[Variant]:
+        variant = self._memory.get(key)
+        if variant is not None:
+            self._memory.move_to_end(key)
+        return variant
+    
+    def _memory_put(self, key: str, variant: Variant):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old.data)
+        self._memory[key] = variant
+        self._memory_size += len(variant.data)
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted.data)
+    
+    def _disk_get(self, key: str) -> Optional[Variant]:
+        with self._disk_lock:
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+            try:
+                with open(os.path.join(self.cache_dir, key), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                self._disk_size -= self._disk.pop(key)
+                return None
+        return _variant(data, _sniff(data))
+    
+    def _disk_put(self, video_id: str, rendered: Dict[str, bytes]):
+        with self._disk_lock:
+            for name, data in rendered.items():
+                key = f'{video_id}.{name}'
+                path = os.path.join(self.cache_dir, key)
+                try:
+                    with open(path + '.tmp', 'wb') as f:
+                        f.write(data)
+                    os.replace(path + '.tmp', path)
+                except OSError as e:
+                    log.warning("Cannot cache thumbnail", extra={'file': key, 'error': str(e)})
+                    continue
+                self._disk_size += len(data) - self._disk.pop(key, 0)
+                self._disk[key] = len(data)
+            while self._disk_size > self.disk_bytes and self._disk:
+                name, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+    
+    def stats(self) -> Dict:
+        """Cache sizes and hit counts for the admin API."""
+        return {
+            'resizing': Image is not None,
+            'memory_entries': len(self._memory),
+            'memory_bytes': self._memory_size,
+            'disk_entries': len(self._disk),
+            'disk_bytes': self._disk_size,
+            'registered': len(self._sources),
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'fetches': self.fetches,
+            'fetch_errors': self.fetch_errors,
+        }
+
+
+# Global thumbnail cache
+thumbnail_cache = ThumbnailCache(
+    cache_dir=os.environ.get('THUMB_CACHE_DIR', 'thumbnail_cache'),
+    memory_bytes=int(os.environ.get('THUMB_CACHE_MEMORY_BYTES', str(16 * 1024 * 1024))),
+    disk_bytes=int(os.environ.get('THUMB_CACHE_DISK_BYTES', str(256 * 1024 * 1024))),
+)
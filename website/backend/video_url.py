@@ -0,0 +1,143 @@
+"""
+Video URL validation and canonicalization.
+
+Every request URL is parsed here before anything else touches it, so
+garbage and unsupported links are rejected without an executor slot or a
+network round trip, and the many forms of one video's link
+(youtu.be/ID, /shorts/ID, m.youtube.com/watch?v=ID&t=42, ...) map to one
+VideoKey. The key's cache_key is what the metadata cache, thumbnail cache
+and popularity tracking index by; its url is what yt-dlp is given.
+
+Pure Python with precompiled patterns: a parse takes a few microseconds
+(see benchmarks/url_parse.py, which also fuzzes the parser).
+"""
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+
+# Longer input is rejected before any pattern runs
+MAX_URL_LENGTH = 2048
+
+PLATFORM_YOUTUBE = 'youtube'
+
+VIDEO_ID_RE = re.compile(r'[A-Za-z0-9_-]{11}')
+PLAYLIST_ID_RE = re.compile(r'[A-Za-z0-9_-]{2,64}')
+
+# Scheme and host are case-insensitive, the path and query are not
+_URL_RE = re.compile(r"""
+    (?i:https?://)?
+    (?P<host>(?i:(?:www\.|m\.|music\.)?youtube\.com|(?:www\.)?youtube-nocookie\.com|(?:www\.)?youtu\.be))
+    (?::\d{1,5})?
+    (?P<path>/[^?#\s]*)?
+    (?:\?(?P<query>[^#\s]*))?
+    (?:\#\S*)?
+""", re.VERBOSE)
+
+# Paths that carry the video ID themselves
+_ID_PATH_RE = re.compile(r'/(?:shorts|embed|v|e|live)/(?P<id>[A-Za-z0-9_-]{11})/?')
+_SHORT_PATH_RE = re.compile(r'/(?P<id>[A-Za-z0-9_-]{11})/?')
+
+_VIDEO_PARAM_RE = re.compile(r'(?:^|&)v=([^&]*)')
+_LIST_PARAM_RE = re.compile(r'(?:^|&)list=([^&]*)')
+
+# Anything URL-shaped (with or without a scheme), to tell "not YouTube" from "not a URL"
+_OTHER_URL_RE = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*://\S+|[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+(?:[/?#]\S*)?')
+
+
+class InvalidVideoURL(ValueError):
+    """The input is not a supported video URL (the message is safe to show to users)."""
+
+
+@dataclass(frozen=True, slots=True)
+class VideoKey:
+    """Canonical identity of a requested video."""
+    platform: str
+    video_id: str
+    # The playlist the link was opened from; it does not change what is downloaded
+    playlist_id: Optional[str] = None
+    
+    @property
+    def cache_key(self) -> str:
+        """Key shared by every cache and dedupe layer."""
+        return f"{self.platform}:{self.video_id}"
+    
+    @property
+    def url(self) -> str:
+        """Canonical URL of the single video (no playlist, timestamp or tracking parameters)."""
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+
+def _query_param(pattern: re.Pattern, query: Optional[str]) -> Optional[str]:
+    if not query:
+        return None
+    match = pattern.search(query)
+    return match.group(1) if match else None
+
+
+def parse_video_url(url: str) -> VideoKey:
+    """
+    Validate a video URL and return its canonical key.
+    
+    Args:
+        url: URL as entered by the user (surrounding whitespace and a
+            missing scheme are tolerated)
+    
+    Returns:
+        VideoKey of the video
+    
+    Raises:
+        InvalidVideoURL: If the input is not a link to a single supported video
+    """
+    if not isinstance(url, str):
+        raise InvalidVideoURL("URL must be a string")
+    url = url.strip()
+    if not url:
+        raise InvalidVideoURL("URL is empty")
+    if len(url) > MAX_URL_LENGTH:
+        raise InvalidVideoURL("URL is too long")
+    
+    match = _URL_RE.fullmatch(url)
+    if match is None:
+        if _OTHER_URL_RE.fullmatch(url):
+            raise InvalidVideoURL("Only YouTube video URLs are supported")
+        raise InvalidVideoURL("Not a valid URL")
+    
+    host = match.group('host').lower()
+    path = match.group('path') or '/'
+    query = match.group('query')
+    
+    if host.endswith('youtu.be'):
+        id_match = _SHORT_PATH_RE.fullmatch(path)
+        video_id = id_match.group('id') if id_match else None
+    elif path in ('/watch', '/watch/'):
+        video_id = _query_param(_VIDEO_PARAM_RE, query)
+    else:
+        id_match = _ID_PATH_RE.fullmatch(path)
+        video_id = id_match.group('id') if id_match else None
+    
+    playlist_id = _query_param(_LIST_PARAM_RE, query)
+    if playlist_id is not None and not PLAYLIST_ID_RE.fullmatch(playlist_id):
+        playlist_id = None
+    
+    if video_id is None:
+        if playlist_id is not None:
+            raise InvalidVideoURL("Playlist URLs are not supported; open one of its videos instead")
+        raise InvalidVideoURL("URL does not point to a YouTube video")
+    if not VIDEO_ID_RE.fullmatch(video_id):
+        raise InvalidVideoURL("URL has an invalid video ID")
+    return VideoKey(PLATFORM_YOUTUBE, video_id, playlist_id)
+
+
+def cache_key(url: str) -> str:
+    """
+    Cache key of a URL: its VideoKey's, or the URL itself if it does not parse.
+    
+    Requests are validated before they reach the caches, so the fallback
+    only applies to callers that bypass the API (worker payloads written
+    by older versions, scripts).
+    """
+    try:
+        return parse_video_url(url).cache_key
+    except InvalidVideoURL:
+        return url
@@ -0,0 +1,253 @@
+"""
+Completion webhooks, so API clients do not have to poll /api/status.
+
+A download request may carry a `callback_url`. When the job completes,
+fails or is cancelled, a JSON POST is sent there, signed with
+WEBHOOK_SECRET:
+
+    X-Webhook-Timestamp: <unix seconds of this attempt>
+    X-Webhook-Signature: sha256=<hex HMAC-SHA256 of "<timestamp>.<body>">
+    X-Webhook-Delivery: <ID shared by every attempt of one delivery>
+
+Deliveries go through a bounded in-memory queue drained by a few sender
+tasks and are retried with exponential backoff. When the queue is full,
+new deliveries are dropped (and counted) instead of piling up behind a
+slow receiver. Callbacks are refused unless WEBHOOK_SECRET is set.
+"""
+import asyncio
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import os
+import socket
+import ssl
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from structured_log import get_logger
+
+log = get_logger('webhooks')
+
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+
+# Deliveries waiting to be sent; more are dropped
+QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+
+# Attempts per delivery (backoff 1s, 2s, 4s, ... between them)
+RETRIES = int(os.environ.get('WEBHOOK_RETRIES', '5'))
+
+# Deliveries sent at the same time
+SENDERS = 4
+
+TIMEOUT_SECONDS = 10
+
+# Callbacks to loopback/private addresses are refused unless this is set
+ALLOW_PRIVATE = os.environ.get('WEBHOOK_ALLOW_PRIVATE', '0') == '1'
+
+
+class WebhookError(Exception):
+    """A delivery attempt failed."""
+
+
+@dataclass(slots=True)
+class Delivery:
+    """One webhook to send, with its retry state."""
+    url: str
+    job_id: str
+    body: bytes
+    delivery_id: str
+    attempt: int = 0
+
+
+def validate_callback_url(url: str) -> Optional[str]:
+    """
+    Check a callback URL from a download request.
+    
+    Returns:
+        An error message, or None if the URL is acceptable
+    """
+    if not WEBHOOK_SECRET:
+        return "Callbacks are not enabled on this server"
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return "Callback URL must be an http(s) URL"
+    return None
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    """Signature header value for a body sent at `timestamp`."""
+    digest = hmac.new(secret.encode(), timestamp.encode() + b'.' + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def _resolve(hostname: str, port: int) -> str:
+    """
+    Resolve a callback host to the address the delivery connects to.
+    
+    Unless ALLOW_PRIVATE is set, hosts with any non-public address are
+    refused. The delivery then connects to exactly this address, so a
+    second lookup (DNS rebinding) cannot swap in a private one.
+    """
+    try:
+        addresses = socket.getaddrinfo(hostname, port, proto=socket.IPPROTO_TCP)
+    except OSError as e:
+        raise WebhookError(f"Cannot resolve {hostname}: {e}") from e
+    if not addresses:
+        raise WebhookError(f"Cannot resolve {hostname}")
+    if not ALLOW_PRIVATE:
+        for address in addresses:
+            if not ipaddress.ip_address(address[4][0]).is_global:
+                raise WebhookError(f"{hostname} resolves to a non-public address")
+    return addresses[0][4][0]
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection to a given address; Host still names the original host."""
+    
+    def __init__(self, host: str, address: str, **kwargs):
+        super().__init__(host, **kwargs)
+        self.address = address
+    
+    def connect(self):
+        self.sock = socket.create_connection((self.address, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection to a given address, with SNI and certificate checks for the original host."""
+    
+    def __init__(self, host: str, address: str, **kwargs):
+        self.tls = ssl.create_default_context()
+        super().__init__(host, context=self.tls, **kwargs)
+        self.address = address
+    
+    def connect(self):
+        sock = socket.create_connection((self.address, self.port), self.timeout)
+        self.sock = self.tls.wrap_socket(sock, server_hostname=self.host)
+
+
+def _post(delivery: Delivery, secret: str):
+    """Send one delivery attempt (blocking)."""
+    parsed = urlparse(delivery.url)
+    https = parsed.scheme == 'https'
+    try:
+        port = parsed.port or (443 if https else 80)
+    except ValueError as e:
+        raise WebhookError(str(e)) from e
+    address = _resolve(parsed.hostname, port)
+    connection_class = _PinnedHTTPSConnection if https else _PinnedHTTPConnection
+    connection = connection_class(parsed.hostname, address, port=port, timeout=TIMEOUT_SECONDS)
+    path = (parsed.path or '/') + (f"?{parsed.query}" if parsed.query else '')
+    timestamp = str(int(time.time()))
+    try:
+        connection.request('POST', path, body=delivery.body, headers={
+            'Content-Type': 'application/json',
+            'User-Agent': 'ytvideodownloader-webhook',
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Signature': sign(secret, timestamp, delivery.body),
+            'X-Webhook-Delivery': delivery.delivery_id,
+        })
+        response = connection.getresponse()
+        response.read()
+    except (http.client.HTTPException, OSError) as e:
+        raise WebhookError(str(e) or type(e).__name__) from e
+    finally:
+        connection.close()
+    # Redirects are not followed: they could point anywhere, including private addresses
+    if response.status >= 300:
+        raise WebhookError(f"HTTP {response.status}")
+
+
+class WebhookDispatcher:
+    """Queues job notifications and delivers them from background tasks."""
+    
+    def __init__(self, secret: str = WEBHOOK_SECRET, queue_size: int = QUEUE_SIZE,
+                 retries: int = RETRIES, senders: int = SENDERS):
+        self.secret = secret
+        self.retries = retries
+        self.senders = senders
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+    
+    def start(self):
+        """Start the sender tasks (on the running event loop)."""
+        if self.secret and not self._tasks:
+            self._tasks = [asyncio.create_task(self._sender()) for _ in range(self.senders)]
+    
+    async def stop(self):
+        """Stop sending; queued deliveries and pending retries are dropped."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def notify(self, job_id: str, job):
+        """FileManager status listener: queue a webhook when a job with a callback finishes."""
+        if not self.secret or not job.callback_url or job.active:
+            return
+        payload = {
+            'event': f"job.{job.status.value}",
+            'job_id': job_id,
+            'status': job.status.value,
+            'token': job.token,
+            'download_path': f"/api/file/{job.token}" if job.token else None,
+            'error': job.error,
+            'timestamp': time.time(),
+        }
+        self._enqueue(Delivery(
+            url=job.callback_url,
+            job_id=job_id,
+            body=json.dumps(payload).encode(),
+            delivery_id=str(uuid.uuid4()),
+        ))
+    
+    def _enqueue(self, delivery: Delivery):
+        try:
+            self._queue.put_nowait(delivery)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            log.warning("Webhook queue full, dropping delivery", extra={'job_id': delivery.job_id})
+    
+    async def _sender(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            delivery = await self._queue.get()
+            try:
+                await asyncio.to_thread(_post, delivery, self.secret)
+                self.delivered += 1
+            except WebhookError as e:
+                delivery.attempt += 1
+                if delivery.attempt < self.retries:
+                    self.retried += 1
+                    # Wait outside the queue so other deliveries keep flowing
+                    loop.call_later(2 ** (delivery.attempt - 1), self._enqueue, delivery)
+                else:
+                    self.failed += 1
+                    log.warning("Webhook delivery failed", extra={
+                        'job_id': delivery.job_id, 'attempts': delivery.attempt, 'error': str(e),
+                    })
+            finally:
+                self._queue.task_done()
+    
+    def stats(self) -> Dict:
+        """Delivery counters for the admin API."""
+        return {
+            'enabled': bool(self.secret),
+            'queued': self._queue.qsize(),
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
+
+
+# Global dispatcher, fed by file_manager status changes (see main.py)
+webhook_dispatcher = WebhookDispatcher()
@@ -0,0 +1,141 @@
+"""
+Download worker: runs queued downloads so the API process only serves HTTP.
+
+Usage (from website/backend, with the same JOB_QUEUE_URL as the API and
+access to its download directory):
+    JOB_QUEUE_URL=sqlite:///jobs-queue.db python worker.py --concurrency 2
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import time
+import uuid
+from typing import Dict, Optional
+
+from structured_log import bind_log_context, get_logger, reset_log_context, setup_logging
+from job_queue import LEASE_SECONDS, JobQueue, queue_from_url
+from scratch import scratch_space
+from downloader import cancel_download, download_video, resize_executor, warm_up
+from fragment_downloader import fragment_engine
+
+log = get_logger('worker')
+
+# Progress is written to the queue at most this often per download
+PROGRESS_SECONDS = 1.0
+
+# How long an idle worker waits before looking for work again
+IDLE_SECONDS = 1.0
+
+# Scratch files untouched for this long are removed when a worker starts
+SCRATCH_SWEEP_SECONDS = 3600
+
+
+class Worker:
+    """Claims downloads from the queue and runs them, `concurrency` at a time."""
+    
+    def __init__(self, job_queue: JobQueue, concurrency: int = 2, name: Optional[str] = None):
+        self.queue = job_queue
+        self.concurrency = concurrency
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.stopping = asyncio.Event()
+    
+    async def run(self):
+        """Run until stop() is called; downloads in progress are finished first."""
+        setup_logging()
+        log.info("Worker started", extra={'worker': self.name, 'concurrency': self.concurrency})
+        # One executor thread per concurrent download
+        resize_executor(self.concurrency)
+        # Leftovers of crashed runs (their jobs were requeued); other workers' files stay fresh
+        scratch_space.sweep(SCRATCH_SWEEP_SECONDS)
+        await warm_up()
+        await asyncio.gather(*(self._slot() for _ in range(self.concurrency)))
+        await fragment_engine.close()
+        log.info("Worker stopped", extra={'worker': self.name})
+    
+    def stop(self):
+        self.stopping.set()
+    
+    async def _slot(self):
+        while not self.stopping.is_set():
+            claimed = self.queue.claim(self.name)
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(*claimed)
+    
+    async def _process(self, job_id: str, payload: Dict):
+        log_context = bind_log_context(job_id=job_id, worker=self.name)
+        last_report = 0.0
+        
+        def on_progress(**progress):
+            # Called from the download thread for every chunk
+            nonlocal last_report
+            now = time.monotonic()
+            if progress.get('stage') == 'downloading' and now - last_report < PROGRESS_SECONDS:
+                return
+            last_report = now
+            if not self.queue.heartbeat(job_id, progress):
+                cancel_download(job_id)
+        
+        # Keeps the lease while nothing reports progress (e.g. during an FFmpeg merge)
+        heartbeat_task = asyncio.create_task(self._keep_alive(job_id))
+        try:
+            log.info("Download claimed", extra={'url': payload['url']})
+            success, message, filepath = await scratch_space.download(
+                download_video,
+                payload['url'],
+                payload['output_path'],
+                payload['quality'],
+                job_id,
+                payload.get('start'),
+                payload.get('end'),
+                payload.get('precise_cut', False),
+                payload.get('format_spec'),
+                on_progress=on_progress,
+                estimated_bytes=payload.get('estimated_bytes'),
+            )
+        except Exception as e:
+            log.exception("Download raised")
+            success, message, filepath = False, str(e), None
+        finally:
+            heartbeat_task.cancel()
+        self.queue.finish(job_id, {'success': success, 'message': message, 'filepath': filepath})
+        log.info("Download finished", extra={'success': success, 'result': message})
+        reset_log_context(log_context)
+    
+    async def _keep_alive(self, job_id: str):
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            if not self.queue.heartbeat(job_id):
+                cancel_download(job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued downloads.")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get('WORKER_CONCURRENCY', '2')),
+                        help="Downloads run at the same time")
+    parser.add_argument("--queue", default=os.environ.get('JOB_QUEUE_URL'),
+                        help="Queue URL (default: JOB_QUEUE_URL)")
+    args = parser.parse_args()
+    job_queue = queue_from_url(args.queue)
+    if job_queue is None:
+        parser.error("a queue is required (--queue or JOB_QUEUE_URL)")
+    
+    worker = Worker(job_queue, args.concurrency)
+    
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        await worker.run()
+    
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Disk write benchmark for the download/merge step.
+
+Downloads the same video with the regular path (video and audio to their
+own files, then merged into a third) and with the streaming merge (both
+streams piped into one FFmpeg process), each in a fresh child process, and
+reports the bytes written to disk per job next to the size of the output.
+
+Bytes written are the block writes of the child and its FFmpeg processes
+(getrusage RUSAGE_CHILDREN, Linux). Files deleted before they reach the
+disk still count, since the pages were dirtied. The download directory
+must be on a real block device: tmpfs writes are not counted.
+
+Needs network access and FFmpeg.
+
+Usage:
+    python benchmarks/disk_io.py --url https://www.youtube.com/watch?v=...
+    python benchmarks/disk_io.py --url ... --quality 720p --runs 3 --save disk.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict
+
+WEBSITE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(WEBSITE_DIR, "backend")
+
+# mode -> STREAMING_MERGE setting
+MODES = {"separate": "0", "streaming": "1"}
+
+
+def child(url: str, quality: str, output_dir: str):
+    """Plan and download one job the way the server does, then print the result as JSON."""
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+    import downloader
+
+    info = asyncio.run(downloader.get_video_info(url))
+    if not info["success"]:
+        print(json.dumps({"success": False, "message": info["error"]}))
+        return
+    plan = downloader.plan_download(info, quality)
+    job_id = str(uuid.uuid4())
+    success, message, filepath = downloader._sync_download_video(
+        url, output_dir, quality, job_id, format_spec=plan["format"] if plan else None
+    )
+    print(json.dumps({
+        "success": success,
+        "message": message,
+        "format": plan["format"] if plan else None,
+        "output_bytes": os.path.getsize(filepath) if filepath else 0,
+    }))
+
+
+def run_job(mode: str, url: str, quality: str, scratch: str) -> Dict:
+    """Download once in a child process and measure the bytes it wrote."""
+    output_dir = tempfile.mkdtemp(prefix=f"{mode}-", dir=scratch)
+    env = {**os.environ, "STREAMING_MERGE": MODES[mode], "LOG_LEVEL": "WARNING"}
+    before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", url, quality, output_dir],
+        env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - start
+    written = (resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock - before) * 512
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("{\"success\"")]
+    result = json.loads(lines[-1]) if lines else {"success": False, "message": proc.stderr.strip()[-500:]}
+    if not result["success"]:
+        raise RuntimeError(f"{mode} download failed: {result['message']}")
+    return {
+        "seconds": round(elapsed, 2),
+        "disk_bytes": written,
+        "output_bytes": result["output_bytes"],
+        "write_amplification": round(written / result["output_bytes"], 2) if result["output_bytes"] else None,
+        "format": result["format"],
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(*sys.argv[2:5])
+        return
+
+    parser = argparse.ArgumentParser(description="Measure disk bytes written per download job.")
+    parser.add_argument("--url", required=True, help="Video to download")
+    parser.add_argument("--quality", default="1080p", help="Quality to request (default: 1080p)")
+    parser.add_argument("--runs", type=int, default=1, help="Downloads per mode")
+    parser.add_argument("--mode", choices=sorted(MODES), action="append", help="Only run this mode")
+    parser.add_argument("--dir", help="Scratch directory (default: a temp dir; must not be tmpfs)")
+    parser.add_argument("--save", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="diskbench-", dir=args.dir)
+    results = {"url": args.url, "quality": args.quality, "modes": {}}
+    try:
+        for mode in args.mode or list(MODES):
+            runs = [run_job(mode, args.url, args.quality, scratch) for _ in range(args.runs)]
+            summary = {
+                "format": runs[0]["format"],
+                "output_bytes": runs[0]["output_bytes"],
+                "disk_bytes": int(statistics.median(r["disk_bytes"] for r in runs)),
+                "seconds": statistics.median(r["seconds"] for r in runs),
+                "runs": runs,
+            }
+            summary["write_amplification"] = (
+                round(summary["disk_bytes"] / summary["output_bytes"], 2) if summary["output_bytes"] else None
+            )
+            results["modes"][mode] = summary
+            print(f"{mode:<10} format {summary['format']:<10} output {summary['output_bytes'] / 1e6:8.1f} MB  "
+                  f"written {summary['disk_bytes'] / 1e6:8.1f} MB  x{summary['write_amplification']}  "
+                  f"{summary['seconds']:.1f}s")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Fragmented download benchmark: yt-dlp's fragment threads vs the asyncio engine.
+
+Starts a fake DASH origin in a child process (fixed-size fragments behind
+an artificial per-request latency) and downloads the same fragmented
+format for many concurrent jobs twice:
+
+- ytdlp: one thread per job (like the executor), each running yt-dlp's
+  DASH downloader with concurrent_fragment_downloads=8
+- asyncio: every job on one event loop through fragment_downloader, with
+  its shared connection pool and per-host limit
+
+Reports wall time, throughput, peak OS threads of the benchmark process
+and the number of TCP connections the origin accepted.
+
+Needs no network access; the asyncio mode needs httpx.
+
+Usage:
+    python benchmarks/fragments.py
+    python benchmarks/fragments.py --jobs 32 --fragments 200 --latency-ms 50 --save fragments.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+
+WEBSITE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(WEBSITE_DIR, "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+MODES = ("ytdlp", "asyncio")
+
+
+def serve(port: int, fragment_bytes: int, latency: float):
+    """Run the fake origin: GET /frag/<n> returns fragment_bytes after `latency` seconds."""
+    body = os.urandom(fragment_bytes)
+    connections = 0
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            nonlocal connections
+            with lock:
+                connections += 1
+            super().setup()
+
+        def do_GET(self):
+            if self.path == "/stats":
+                payload = json.dumps({"connections": connections}).encode()
+            elif self.path.startswith("/frag/"):
+                time.sleep(latency)
+                payload = body
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    print("ready", flush=True)
+    server.serve_forever()
+
+
+def dash_format(base: str, fragments: int) -> Dict:
+    """A yt-dlp format dict for a DASH video stream served by the fake origin."""
+    return {
+        "format_id": "dash",
+        "url": f"{base}/manifest.mpd",
+        "protocol": "http_dash_segments",
+        "fragment_base_url": f"{base}/frag/",
+        "fragments": [{"path": str(i)} for i in range(fragments)],
+        "ext": "mp4",
+        "vcodec": "avc1.4d401f",
+        "acodec": "none",
+    }
+
+
+def os_threads() -> int:
+    """Threads of this process (all OS threads on Linux, Python threads elsewhere)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+
+def measure(run: Callable[[], None]) -> Dict:
+    """Run a benchmark body, sampling the thread count while it runs."""
+    peak = os_threads()
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(0.01):
+            peak = max(peak, os_threads())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        run()
+    finally:
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    # The sampler itself is not part of either engine
+    return {"seconds": round(elapsed, 3), "peak_threads": peak - 1}
+
+
+def run_ytdlp(fmt: Dict, jobs: int, output_dir: str):
+    import yt_dlp
+
+    def job(index: int):
+        opts = {
+            "outtmpl": os.path.join(output_dir, f"ytdlp-{index}.%(ext)s"),
+            "concurrent_fragment_downloads": 8,
+            "fragment_retries": 10,
+            "quiet": True,
+            "no_warnings": True,
+            "noprogress": True,
+        }
+        info = {
+            "id": f"bench{index}",
+            "title": f"bench{index}",
+            "extractor": "generic",
+            "extractor_key": "Generic",
+            "webpage_url": fmt["url"],
+            "formats": [dict(fmt)],
+        }
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            ydl.process_ie_result(info, download=True)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(job, range(jobs)))
+
+
+def run_asyncio(fmt: Dict, jobs: int, output_dir: str):
+    from fragment_downloader import FragmentEngine
+
+    async def main():
+        engine = FragmentEngine()
+        try:
+            await asyncio.gather(*(
+                engine.download(fmt, os.path.join(output_dir, f"asyncio-{index}.mp4"), lambda n: None, lambda: False)
+                for index in range(jobs)
+            ))
+        finally:
+            await engine.close()
+
+    asyncio.run(main())
+
+
+def origin_connections(base: str) -> int:
+    import urllib.request
+
+    with urllib.request.urlopen(f"{base}/stats") as response:
+        return json.load(response)["connections"]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]))
+        return
+
+    parser = argparse.ArgumentParser(description="Compare fragment download engines against a local origin.")
+    parser.add_argument("--jobs", type=int, default=16, help="Concurrent downloads")
+    parser.add_argument("--fragments", type=int, default=100, help="Fragments per download")
+    parser.add_argument("--fragment-kb", type=int, default=256, help="Fragment size in KiB")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Origin latency per request")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the fake origin")
+    parser.add_argument("--mode", choices=MODES, action="append", help="Only run this mode")
+    parser.add_argument("--save", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    base = f"http://127.0.0.1:{args.port}"
+    fmt = dash_format(base, args.fragments)
+    total_bytes = args.jobs * args.fragments * args.fragment_kb * 1024
+    results = {
+        "jobs": args.jobs,
+        "fragments": args.fragments,
+        "fragment_kb": args.fragment_kb,
+        "latency_ms": args.latency_ms,
+        "modes": {},
+    }
+    runners = {"ytdlp": run_ytdlp, "asyncio": run_asyncio}
+
+    for mode in args.mode or MODES:
+        # A fresh origin per mode so its connection count is per engine
+        origin = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", str(args.port),
+             str(args.fragment_kb * 1024), str(args.latency_ms / 1000)],
+            stdout=subprocess.PIPE, text=True,
+        )
+        output_dir = tempfile.mkdtemp(prefix=f"fragbench-{mode}-")
+        try:
+            origin.stdout.readline()
+            result = measure(lambda: runners[mode](fmt, args.jobs, output_dir))
+            written = sum(entry.stat().st_size for entry in os.scandir(output_dir) if entry.is_file())
+            if written != total_bytes:
+                raise RuntimeError(f"{mode}: wrote {written} bytes, expected {total_bytes}")
+            result["mb_per_second"] = round(total_bytes / 1e6 / result["seconds"], 1)
+            result["connections"] = origin_connections(base) - 1
+        finally:
+            origin.terminate()
+            origin.wait()
+            shutil.rmtree(output_dir, ignore_errors=True)
+        results["modes"][mode] = result
+        print(f"{mode:<8} {result['seconds']:7.2f}s  {result['mb_per_second']:8.1f} MB/s  "
+              f"peak threads {result['peak_threads']:4d}  connections {result['connections']:5d}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,507 @@
+"""
+Load-test scenario runner for the cheap API endpoints.
+
+Drives the FastAPI app in-process over ASGI (no sockets, no real yt-dlp
+calls) so the numbers reflect the app, the event loop and the FileManager
+data structures rather than the network.
+
+Usage:
+    python benchmarks/loadtest.py                          # run all scenarios
+    python benchmarks/loadtest.py -s status_storm --jobs 10000
+    python benchmarks/loadtest.py --save baseline.json
+    python benchmarks/loadtest.py --compare baseline.json --thresholds thresholds.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+# The job journal is on, as in production, but seeded jobs and tokens go to a throwaway one
+JOURNAL_DIR = tempfile.mkdtemp(prefix="loadtest-journal-")
+os.environ["JOB_JOURNAL_FILE"] = os.path.join(JOURNAL_DIR, "jobs.journal")
+# Every simulated request comes from one client, so per-client budgets are off
+os.environ["RATE_LIMIT_EXTRACTIONS"] = "0/60"
+os.environ["RATE_LIMIT_THUMBNAILS"] = "0/60"
+os.environ["RATE_LIMIT_CONCURRENT_JOBS"] = "0"
+os.environ["RATE_LIMIT_DAILY_BYTES"] = "0"
+
+import main  # noqa: E402
+from file_manager import file_manager  # noqa: E402
+from thumbnails import ThumbnailCache  # noqa: E402
+
+
+# Default regression thresholds, relative to a saved baseline
+DEFAULT_THRESHOLDS = {
+    "max_p99_ratio": 1.5,    # p99 latency may grow by at most 50%
+    "min_rps_ratio": 0.7,    # throughput may drop by at most 30%
+    "max_error_rate": 0.0,   # no failed requests allowed
+}
+
+
+async def asgi_request(app, method: str, path: str, body: Optional[bytes] = None,
+                       extra_headers: Tuple[Tuple[bytes, bytes], ...] = ()) -> Tuple[int, int]:
+    """
+    Send a single request to an ASGI app in-process.
+
+    Args:
+        app: ASGI application
+        method: HTTP method
+        path: Request path, optionally with a query string
+        body: Optional JSON request body
+        extra_headers: Additional (name, value) request headers
+
+    Returns:
+        Tuple of (status_code, response_bytes)
+    """
+    path, _, query = path.partition("?")
+    headers = [(b"host", b"loadtest"), *extra_headers]
+    if body is not None:
+        headers.append((b"content-type", b"application/json"))
+        headers.append((b"content-length", str(len(body)).encode()))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("loadtest", 80),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body or b"", "more_body": False}
+        # Block like a real idle connection until the app is done
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    status = 0
+    size = 0
+
+    async def send(message):
+        nonlocal status, size
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, size
+
+
+async def run_load(make_request: Callable, total: int, concurrency: int) -> Dict:
+    """
+    Issue `total` requests with at most `concurrency` in flight.
+
+    Args:
+        make_request: Callable taking the request index and returning a coroutine
+            resolving to (status_code, response_bytes)
+        total: Number of requests to send
+        concurrency: Maximum in-flight requests
+
+    Returns:
+        Latency and throughput summary
+    """
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                status, _ = await make_request(i)
+                if status >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return summarize(latencies, errors, elapsed)
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    """Build a result record from raw latencies."""
+    ordered = sorted(latencies)
+    count = len(ordered)
+
+    def pct(p: float) -> float:
+        if not ordered:
+            return 0.0
+        return ordered[min(count - 1, int(p * count))] * 1000
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "error_rate": errors / count if count else 0.0,
+        "elapsed_s": round(elapsed, 4),
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(pct(0.50), 3),
+        "p95_ms": round(pct(0.95), 3),
+        "p99_ms": round(pct(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def seed_jobs(count: int) -> List[str]:
+    """Create `count` jobs in a mix of states and return their IDs."""
+    job_ids = []
+    states = ('pending', 'processing', 'completed', 'failed')
+    for i in range(count):
+        job_id = file_manager.create_job()
+        state = states[i % len(states)]
+        if state == 'completed':
+            file_manager.update_job(job_id, status=state, progress=100, token=f"token-{i}")
+        elif state == 'failed':
+            file_manager.update_job(job_id, status=state, error="seeded failure")
+        else:
+            file_manager.update_job(job_id, status=state, progress=i % 100)
+        job_ids.append(job_id)
+    return job_ids
+
+
+def seed_files(count: int, file_count: int, file_size: int) -> List[str]:
+    """
+    Write a few small files into the download dir and create `count` tokens for them.
+
+    Tokens are one-time use, so every request needs its own token.
+    """
+    payload = os.urandom(file_size)
+    paths = []
+    for i in range(file_count):
+        path = os.path.join(file_manager.download_dir, f"loadtest-{i}.mp4")
+        with open(path, "wb") as f:
+            f.write(payload)
+        paths.append(path)
+    return [file_manager.create_token(paths[i % file_count], f"Load test {i}") for i in range(count)]
+
+
+def reset_state(download_dir: str):
+    """Drop all jobs and tokens and point the file manager at a scratch dir."""
+    file_manager.clear()
+    file_manager.download_dir = download_dir
+
+
+async def fake_get_video_info(url: str) -> Dict:
+    """Stubbed extractor: returns canned metadata without touching the network."""
+    return {
+        'success': True,
+        'title': f'Stub video for {url}',
+        'duration': 212,
+        'thumbnail': 'https://example.invalid/thumb.jpg',
+        'uploader': 'Load Test',
+        'view_count': 0,
+        'upload_date': '20240101',
+    }
+
+
+def start_image_server(image: bytes) -> Tuple[ThreadingHTTPServer, Dict[str, int]]:
+    """Serve `image` for every GET on a local port, counting requests."""
+    counts = {"requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            counts["requests"] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(image)))
+            self.end_headers()
+            self.wfile.write(image)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, counts
+
+
+def sample_thumbnail() -> bytes:
+    """A full-size (1280x720) JPEG like the ones video sites serve."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8" + os.urandom(150 * 1024)
+    import io
+    from PIL import ImageFilter
+    # Blurred noise compresses about like a photo
+    image = Image.effect_noise((1280, 720), 40).filter(ImageFilter.GaussianBlur(3)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+# Scenarios ----------------------------------------------------------------
+
+async def scenario_health(args) -> Dict:
+    """Baseline: the cheapest endpoint."""
+    return await run_load(lambda i: asgi_request(main.app, "GET", "/health"), args.requests, args.concurrency)
+
+
+async def scenario_status_storm(args) -> Dict:
+    """Many clients polling /api/status for a large population of jobs."""
+    job_ids = seed_jobs(args.jobs)
+    result = await run_load(
+        lambda i: asgi_request(main.app, "GET", f"/api/status/{job_ids[i % len(job_ids)]}"),
+        args.requests,
+        args.concurrency,
+    )
+    result["jobs"] = len(file_manager.jobs)
+    return result
+
+
+async def scenario_job_churn(args) -> Dict:
+    """Jobs created and moved through their states on top of a large population (journal writes)."""
+    seed_jobs(args.jobs)
+
+    async def request(i):
+        job_id = file_manager.create_job(
+            request={"url": f"https://youtu.be/churn{i % 500:06d}"}, client="ip:127.0.0.1"
+        )
+        file_manager.update_job(job_id, status="processing", progress=25)
+        file_manager.update_job(job_id, status="completed", progress=100, token=f"churn-{i}")
+        return 200, 0
+
+    result = await run_load(request, args.requests, args.concurrency)
+    file_manager.journal.flush()
+    result["jobs"] = len(file_manager.jobs)
+    result["journal"] = file_manager.journal.stats()
+    return result
+
+
+async def scenario_info_stub(args) -> Dict:
+    """/api/info with the extractor replaced by a canned response."""
+    original = main.get_video_info
+    main.get_video_info = fake_get_video_info
+    try:
+        return await run_load(
+            lambda i: asgi_request(
+                main.app, "POST", "/api/info",
+                json.dumps({"url": f"https://www.youtube.com/watch?v=loadtest{i % 500:03d}"}).encode(),
+            ),
+            args.requests,
+            args.concurrency,
+        )
+    finally:
+        main.get_video_info = original
+
+
+async def scenario_file_serve(args) -> Dict:
+    """/api/file with pre-seeded files, one fresh token per request."""
+    tokens = seed_files(args.requests, args.files, args.file_size)
+    result = await run_load(
+        lambda i: asgi_request(main.app, "GET", f"/api/file/{tokens[i]}"),
+        args.requests,
+        args.concurrency,
+    )
+    result["tokens"] = len(file_manager.tokens)
+    return result
+
+
+async def scenario_cleanup_during_serve(args) -> Dict:
+    """Status polling and file serving while cleanup sweeps run on the same loop."""
+    job_ids = seed_jobs(args.jobs)
+    tokens = seed_files(args.requests, args.files, args.file_size)
+    sweeps = 0
+    sweep_times: List[float] = []
+    done = asyncio.Event()
+
+    async def sweeper():
+        nonlocal sweeps
+        while not done.is_set():
+            start = time.perf_counter()
+            file_manager.cleanup_old_files()
+            sweep_times.append(time.perf_counter() - start)
+            sweeps += 1
+            await asyncio.sleep(args.sweep_interval)
+
+    def request(i):
+        if i % 2:
+            return asgi_request(main.app, "GET", f"/api/status/{job_ids[i % len(job_ids)]}")
+        return asgi_request(main.app, "GET", f"/api/file/{tokens[i]}")
+
+    sweeper_task = asyncio.create_task(sweeper())
+    try:
+        result = await run_load(request, args.requests, args.concurrency)
+    finally:
+        done.set()
+        await sweeper_task
+
+    result["jobs"] = len(file_manager.jobs)
+    result["cleanup_sweeps"] = sweeps
+    result["cleanup_max_ms"] = round(max(sweep_times) * 1000, 3) if sweep_times else 0.0
+    return result
+
+
+async def scenario_thumbnail_proxy(args) -> Dict:
+    """/api/thumb for a set of videos against a local image server (cold, then cached)."""
+    image = sample_thumbnail()
+    server, counts = start_image_server(image)
+    original = main.thumbnail_cache
+    main.thumbnail_cache = ThumbnailCache(
+        cache_dir=os.path.join(file_manager.download_dir, "thumbs"),
+        memory_bytes=16 * 1024 * 1024,
+        disk_bytes=256 * 1024 * 1024,
+        url_template=f"http://127.0.0.1:{server.server_address[1]}/vi/{{video_id}}.jpg",
+    )
+    served = []
+
+    async def request(i):
+        status, size = await asgi_request(
+            main.app, "GET", f"/api/thumb/video{i % args.videos:06d}?size=small",
+            extra_headers=((b"accept", b"image/webp,image/*"),),
+        )
+        served.append(size)
+        return status, size
+
+    try:
+        result = await run_load(request, args.requests, args.concurrency)
+    finally:
+        main.thumbnail_cache = original
+        server.shutdown()
+        server.server_close()
+    result["upstream_fetches"] = counts["requests"]
+    result["source_bytes"] = len(image)
+    result["served_bytes_avg"] = int(sum(served) / len(served)) if served else 0
+    return result
+
+
+SCENARIOS = {
+    "health": scenario_health,
+    "status_storm": scenario_status_storm,
+    "job_churn": scenario_job_churn,
+    "info_stub": scenario_info_stub,
+    "file_serve": scenario_file_serve,
+    "cleanup_during_serve": scenario_cleanup_during_serve,
+    "thumbnail_proxy": scenario_thumbnail_proxy,
+}
+
+
+# Baselines ----------------------------------------------------------------
+
+def compare(results: Dict, baseline: Dict, thresholds: Dict) -> List[str]:
+    """
+    Compare results against a baseline.
+
+    Args:
+        results: Fresh scenario results
+        baseline: Previously saved scenario results
+        thresholds: Global thresholds, optionally overridden per scenario
+            under a "scenarios" key
+
+    Returns:
+        List of human-readable regression descriptions (empty if none)
+    """
+    failures = []
+    for name, current in results.items():
+        limits = dict(DEFAULT_THRESHOLDS)
+        limits.update({k: v for k, v in thresholds.items() if k != "scenarios"})
+        limits.update(thresholds.get("scenarios", {}).get(name, {}))
+
+        if current["error_rate"] > limits["max_error_rate"]:
+            failures.append(f"{name}: error rate {current['error_rate']:.4f} > {limits['max_error_rate']}")
+
+        if "max_p99_ms" in limits and current["p99_ms"] > limits["max_p99_ms"]:
+            failures.append(f"{name}: p99 {current['p99_ms']}ms > {limits['max_p99_ms']}ms")
+
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base["p99_ms"] and current["p99_ms"] > base["p99_ms"] * limits["max_p99_ratio"]:
+            failures.append(
+                f"{name}: p99 {current['p99_ms']}ms vs baseline {base['p99_ms']}ms "
+                f"(limit x{limits['max_p99_ratio']})"
+            )
+        if base["rps"] and current["rps"] < base["rps"] * limits["min_rps_ratio"]:
+            failures.append(
+                f"{name}: {current['rps']} req/s vs baseline {base['rps']} req/s "
+                f"(limit x{limits['min_rps_ratio']})"
+            )
+    return failures
+
+
+async def run_scenarios(names: List[str], args) -> Dict:
+    """Run each scenario against a fresh scratch directory."""
+    results = {}
+    original_dir = file_manager.download_dir
+    for name in names:
+        with tempfile.TemporaryDirectory(prefix="loadtest-") as scratch:
+            reset_state(scratch)
+            results[name] = await SCENARIOS[name](args)
+        reset_state(original_dir)
+        r = results[name]
+        print(f"{name:<22} {r['requests']:>7} req  {r['rps']:>9} req/s  "
+              f"p50 {r['p50_ms']:>8}ms  p99 {r['p99_ms']:>8}ms  errors {r['errors']}")
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load-test the cheap API endpoints in-process.")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("-n", "--requests", type=int, default=5000, help="Requests per scenario")
+    parser.add_argument("-c", "--concurrency", type=int, default=200, help="Concurrent in-flight requests")
+    parser.add_argument("--jobs", type=int, default=10000, help="Jobs seeded for status scenarios")
+    parser.add_argument("--files", type=int, default=8, help="Distinct files seeded for file scenarios")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="Bytes per seeded file")
+    parser.add_argument("--videos", type=int, default=50, help="Distinct videos for the thumbnail scenario")
+    parser.add_argument("--sweep-interval", type=float, default=0.05, help="Seconds between cleanup sweeps")
+    parser.add_argument("--save", help="Write results as a JSON baseline to this path")
+    parser.add_argument("--compare", help="Compare results against this JSON baseline")
+    parser.add_argument("--thresholds", help="JSON file overriding the default regression thresholds")
+    args = parser.parse_args()
+
+    names = args.scenario or list(SCENARIOS)
+    try:
+        results = asyncio.run(run_scenarios(names, args))
+    finally:
+        file_manager.journal.close()
+        shutil.rmtree(JOURNAL_DIR, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        thresholds = {}
+        if args.thresholds:
+            with open(args.thresholds) as f:
+                thresholds = json.load(f)
+        failures = compare(results, baseline, thresholds)
+        if failures:
+            print("\nRegressions:")
+            for failure in failures:
+                print(f"  - {failure}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main_cli()
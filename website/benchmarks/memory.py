@@ -0,0 +1,171 @@
+"""
+Memory benchmark for FileManager job and token records.
+
+Builds N jobs (a realistic mix of states, with request parameters, client
+keys, format plans and tokens for completed jobs) and reports the traced
+memory per job for the slotted records, next to the same data stored as
+free-form dicts (the previous layout). Both sides include the same
+secondary indexes (jobs by status, active jobs by client, token count by
+file), so the difference is the record layout itself.
+
+Usage:
+    python benchmarks/memory.py
+    python benchmarks/memory.py --jobs 200000 --save memory.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Callable, Dict
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+from file_manager import FileManager, JobStatus  # noqa: E402
+
+STATES = ("completed", "completed", "completed", "failed", "processing", "cancelled")
+
+
+def _request(i: int) -> Dict:
+    return {
+        "url": f"https://www.youtube.com/watch?v=video{i:06d}",
+        "quality": "1080p",
+        "start": None,
+        "end": None,
+        "precise_cut": False,
+    }
+
+
+def _plan() -> Dict:
+    return {
+        "format": "137+140", "height": 1080, "fps": 30, "vcodec": "avc1", "acodec": "mp4a",
+        "ext": "mp4", "estimated_bytes": 123456789, "needs_merge": True, "needs_transcode": False,
+    }
+
+
+def build_records(count: int, download_dir: str) -> FileManager:
+    """Fill a FileManager the way the server does."""
+    manager = FileManager(download_dir=download_dir)
+    for i in range(count):
+        job_id = manager.create_job(request=_request(i), client=f"ip:10.0.{i % 50}.1")
+        state = STATES[i % len(STATES)]
+        manager.update_job(job_id, status="processing", progress=25, plan=_plan())
+        if state == "completed":
+            path = os.path.join(download_dir, f"{job_id}.mp4")
+            token = manager.create_token(path, f"Video {i}")
+            manager.update_job(job_id, status=state, progress=100, filepath=path, token=token)
+        elif state == "failed":
+            manager.update_job(job_id, status=state, error="Download failed: HTTP Error 403")
+        else:
+            manager.update_job(job_id, status=state)
+    return manager
+
+
+def build_dicts(count: int, download_dir: str) -> Dict:
+    """The same data in the previous layout: one dict per job and per token, plus the same indexes."""
+    jobs, tokens = {}, {}
+    by_status = {status.value: set() for status in JobStatus}
+    active_by_client, token_count_by_path = {}, {}
+    for i in range(count):
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        job = jobs[job_id] = {
+            "status": "pending", "progress": 0, "filepath": None, "error": None, "token": None,
+            "created_at": now, "last_seen": now, "request": _request(i),
+            "client": f"ip:10.0.{i % 50}.1",
+        }
+        state = STATES[i % len(STATES)]
+        job.update(status="processing", progress=25, plan=_plan())
+        if state == "completed":
+            path = os.path.join(download_dir, f"{job_id}.mp4")
+            token = str(uuid.uuid4())
+            tokens[token] = {
+                "filepath": path, "created_at": time.time(), "downloaded": False,
+                "original_filename": f"Video {i}",
+            }
+            token_count_by_path[path] = token_count_by_path.get(path, 0) + 1
+            job.update(status=state, progress=100, filepath=path, token=token)
+        elif state == "failed":
+            job.update(status=state, error="Download failed: HTTP Error 403")
+        else:
+            job.update(status=state)
+        by_status[job["status"]].add(job_id)
+        if job["status"] in ("pending", "processing"):
+            active_by_client.setdefault(job["client"], set()).add(job_id)
+    return {
+        "jobs": jobs, "tokens": tokens, "by_status": by_status,
+        "active_by_client": active_by_client, "token_count_by_path": token_count_by_path,
+    }
+
+
+def measure(build: Callable, count: int, download_dir: str) -> Dict:
+    """Traced memory held by the result of build(count)."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build(count, download_dir)
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {"result": result, "bytes": held, "bytes_per_job": round(held / count, 1)}
+
+
+def measure_status_reads(manager: FileManager, reads: int) -> Dict:
+    """Time and allocations of status lookups (what /api/status does per poll)."""
+    job_ids = list(manager.jobs)
+
+    def read_all():
+        completed = 0
+        for i in range(reads):
+            job = manager.get_job(job_ids[i % len(job_ids)])
+            completed += job.status is JobStatus.COMPLETED
+        return completed
+
+    # Timed without tracing (tracemalloc slows every allocation down)
+    start = time.perf_counter()
+    read_all()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    read_all()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {"ns_per_read": round(elapsed / reads * 1e9, 1), "bytes_allocated": allocated}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure memory per job/token record.")
+    parser.add_argument("--jobs", type=int, default=100000, help="Number of jobs to create")
+    parser.add_argument("--reads", type=int, default=1000000, help="Status lookups to time")
+    parser.add_argument("--save", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="membench-") as scratch:
+        slotted = measure(build_records, args.jobs, scratch)
+        dicts = measure(build_dicts, args.jobs, scratch)
+        reads = measure_status_reads(slotted["result"], args.reads)
+
+    results = {
+        "jobs": args.jobs,
+        "slotted_bytes_per_job": slotted["bytes_per_job"],
+        "dict_bytes_per_job": dicts["bytes_per_job"],
+        "saving": round(1 - slotted["bytes"] / dicts["bytes"], 3),
+        "status_read": reads,
+    }
+    print(f"{args.jobs} jobs")
+    print(f"  slotted records  {results['slotted_bytes_per_job']:>8} bytes/job")
+    print(f"  dict records     {results['dict_bytes_per_job']:>8} bytes/job")
+    print(f"  saving           {results['saving'] * 100:>7.1f}%")
+    print(f"  status read      {reads['ns_per_read']:>8} ns, {reads['bytes_allocated']} bytes allocated")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Cold-start benchmark for the CLI, GUI and web backend.
+
+Each target is imported in a fresh interpreter with `-X importtime`; the
+script reports wall-clock import time, the total self/cumulative time
+reported by the interpreter and the slowest top-level imports. With
+--server it also measures how long uvicorn takes to answer /health.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --server
+    python benchmarks/startup.py --save startup.json
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+WEBSITE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(WEBSITE_DIR, "backend")
+REPO_DIR = os.path.dirname(WEBSITE_DIR)
+
+# name -> (module to import, working directory)
+TARGETS = {
+    "backend": ("main", BACKEND_DIR),
+    "cli": ("youtube_downloader", REPO_DIR),
+    "gui": ("youtube_downloader_gui", REPO_DIR),
+}
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def measure_import(module: str, cwd: str) -> Optional[Dict]:
+    """
+    Import `module` in a fresh interpreter and parse `-X importtime` output.
+
+    Returns:
+        Timing record, or None if the module cannot be imported here
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        return None
+
+    top_level = []
+    module_us = 0
+    yt_dlp_loaded = False
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        yt_dlp_loaded = yt_dlp_loaded or name == "yt_dlp"
+        if name == module:
+            module_us = int(cumulative_us)
+        # Direct children of the target module are indented two extra spaces
+        elif len(indent) == 3:
+            top_level.append((name, int(cumulative_us)))
+
+    top_level.sort(key=lambda entry: entry[1], reverse=True)
+    return {
+        "wall_ms": wall * 1000,
+        "import_ms": module_us / 1000,
+        "slowest": [(name, round(us / 1000, 1)) for name, us in top_level[:5]],
+        "yt_dlp_loaded": yt_dlp_loaded,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_server_ready(timeout: float = 30.0) -> Optional[float]:
+    """Start uvicorn and return seconds until /health responds (None on timeout)."""
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        return None
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def summarize(samples: List[float]) -> Dict:
+    return {
+        "min_ms": round(min(samples), 1),
+        "median_ms": round(statistics.median(samples), 1),
+        "max_ms": round(max(samples), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import and server-ready time.")
+    parser.add_argument("-t", "--target", action="append", choices=sorted(TARGETS),
+                        help="Entry point to measure (repeatable, default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--server", action="store_true", help="Also measure uvicorn time-to-/health")
+    parser.add_argument("--save", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.target or list(TARGETS):
+        module, cwd = TARGETS[name]
+        runs = [measure_import(module, cwd) for _ in range(args.runs)]
+        if any(run is None for run in runs):
+            print(f"{name:<8} skipped (cannot import {module} in this environment)")
+            continue
+        results[name] = {
+            "import": summarize([run["import_ms"] for run in runs]),
+            "wall": summarize([run["wall_ms"] for run in runs]),
+            "yt_dlp_at_import": runs[-1]["yt_dlp_loaded"],
+            "slowest": runs[-1]["slowest"],
+        }
+        r = results[name]
+        print(f"{name:<8} import {r['import']['median_ms']:>7}ms  "
+              f"interpreter+import {r['wall']['median_ms']:>7}ms  "
+              f"yt_dlp at import: {r['yt_dlp_at_import']}")
+        for mod, ms in r["slowest"]:
+            print(f"           {mod:<30} {ms:>7}ms")
+
+    if args.server:
+        samples = [measure_server_ready() for _ in range(args.runs)]
+        ready = [s * 1000 for s in samples if s is not None]
+        if ready:
+            results["server_ready"] = summarize(ready)
+            print(f"server   ready in {results['server_ready']['median_ms']}ms (median)")
+        else:
+            print("server   did not become ready")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
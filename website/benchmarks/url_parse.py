@@ -0,0 +1,233 @@
+"""
+URL canonicalization micro-benchmark and fuzzer for backend/video_url.py.
+
+bench (default): times parse_video_url over a corpus of valid link forms
+and of rejected input, next to what yt-dlp spends before its first network
+request on the same strings (finding the extractor whose pattern matches,
+which for garbage means trying every extractor down to the generic one).
+
+fuzz: mutates valid URLs and generates random strings, and checks that the
+parser only ever raises InvalidVideoURL, that accepted input yields a
+well-formed key whose canonical URL parses back to the same video, that
+every link form of a random video ID maps to one cache key, and that no
+input takes pathologically long (regex backtracking). Exits 1 on failure.
+
+Usage:
+    python benchmarks/url_parse.py
+    python benchmarks/url_parse.py --iterations 200000 --save url_parse.json
+    python benchmarks/url_parse.py --fuzz 1000000 --seed 7
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+from video_url import (  # noqa: E402
+    MAX_URL_LENGTH,
+    PLAYLIST_ID_RE,
+    VIDEO_ID_RE,
+    InvalidVideoURL,
+    VideoKey,
+    parse_video_url,
+)
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+VALID = [
+    f"https://www.youtube.com/watch?v={VIDEO_ID}",
+    f"https://youtu.be/{VIDEO_ID}?si=Ab3dEf6hIj9k",
+    f"https://m.youtube.com/watch?feature=share&v={VIDEO_ID}&t=42s",
+    f"https://www.youtube.com/watch?v={VIDEO_ID}&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf&index=3",
+    f"https://www.youtube.com/shorts/{VIDEO_ID}",
+    f"https://www.youtube-nocookie.com/embed/{VIDEO_ID}?start=30",
+    f"https://music.youtube.com/watch?v={VIDEO_ID}",
+    f"youtube.com/watch?v={VIDEO_ID}",
+]
+
+INVALID = [
+    "",
+    "hello world",
+    "https://vimeo.com/76979871",
+    "https://www.youtube.com/playlist?list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf",
+    "https://www.youtube.com/watch?v=tooshort",
+    "https://www.youtube.com.example.com/watch?v=" + VIDEO_ID,
+    "javascript:alert(1)",
+    "https://example.com/" + "a" * 500,
+]
+
+# Link forms of a video ID that must all share its cache key
+FORMS = [
+    "https://www.youtube.com/watch?v={id}",
+    "http://youtube.com/watch?v={id}&t=1",
+    "https://m.youtube.com/watch?app=desktop&v={id}",
+    "HTTPS://WWW.YOUTUBE.COM/watch?v={id}",
+    "https://youtu.be/{id}",
+    "youtu.be/{id}?t=10",
+    "https://www.youtube.com/shorts/{id}/",
+    "https://www.youtube.com/embed/{id}?autoplay=1",
+    "https://www.youtube.com/live/{id}?feature=share",
+    "https://www.youtube-nocookie.com/embed/{id}",
+    "https://music.youtube.com/watch?v={id}&list=RDAMVM{id}",
+    "  https://www.youtube.com/watch?v={id}#comments  ",
+]
+
+ID_ALPHABET = string.ascii_letters + string.digits + "-_"
+NOISE = string.printable + "\u00e9\u200b\u202e\ufeff\u0000%&?#=/:."
+
+# A single parse slower than this is treated as runaway backtracking
+MAX_PARSE_SECONDS = 0.005
+
+
+def time_per_call(fn: Callable[[str], object], inputs: List[str], iterations: int) -> float:
+    """Mean seconds per call of fn, cycling through inputs."""
+    count = len(inputs)
+    start = time.perf_counter()
+    for i in range(iterations):
+        try:
+            fn(inputs[i % count])
+        except InvalidVideoURL:
+            pass
+    return (time.perf_counter() - start) / iterations
+
+
+def ytdlp_matcher() -> Callable[[str], object]:
+    """What yt-dlp does with a URL before any network request: find a suitable extractor."""
+    from yt_dlp.extractor import gen_extractor_classes
+
+    extractors = list(gen_extractor_classes())
+
+    def match(url: str):
+        for extractor in extractors:
+            if extractor.suitable(url):
+                return extractor.ie_key()
+        return None
+
+    return match
+
+
+def bench(args) -> Dict:
+    results = {}
+    print(f"{'input':<10} {'parser':<12} {'per call':>12} {'calls/s':>12}")
+    matchers = {"video_url": parse_video_url}
+    try:
+        matchers["yt-dlp"] = ytdlp_matcher()
+    except ImportError:
+        print("yt-dlp not installed, skipping its column")
+    for corpus_name, corpus in (("valid", VALID), ("invalid", INVALID)):
+        for name, fn in matchers.items():
+            # yt-dlp tries ~1800 extractor patterns per URL, so it gets fewer iterations
+            iterations = args.iterations if name == "video_url" else max(len(corpus), args.iterations // 1000)
+            time_per_call(fn, corpus, min(iterations, 1000))  # warm up (compiles yt-dlp's patterns)
+            seconds = time_per_call(fn, corpus, iterations)
+            results[f"{corpus_name}/{name}"] = {"us_per_call": round(seconds * 1e6, 3)}
+            print(f"{corpus_name:<10} {name:<12} {seconds * 1e6:10.2f}us {1 / seconds:12,.0f}")
+    return results
+
+
+def mutate(rng: random.Random, url: str) -> str:
+    """Apply a few random edits to a string."""
+    chars = list(url)
+    for _ in range(rng.randint(1, 4)):
+        op = rng.random()
+        position = rng.randint(0, len(chars))
+        if op < 0.3 and chars:
+            del chars[min(position, len(chars) - 1)]
+        elif op < 0.6:
+            chars.insert(position, rng.choice(NOISE))
+        elif op < 0.8 and chars:
+            chars[min(position, len(chars) - 1)] = rng.choice(NOISE)
+        elif op < 0.9:
+            chars[position:position] = list(rng.choice(("&v=", "?list=", "/shorts/", "://", "%2F", "#")))
+        else:
+            chars = [c.swapcase() for c in chars]
+    return "".join(chars)
+
+
+def random_input(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.6:
+        return mutate(rng, rng.choice(VALID + INVALID))
+    if kind < 0.9:
+        return "".join(rng.choice(NOISE) for _ in range(rng.randint(0, 200)))
+    # Long repetitive input, the usual trigger for catastrophic backtracking
+    piece = rng.choice(("a.", "youtube.com/", "?v=&", "/" * 3, "https://", "x" * 7))
+    return piece * rng.randint(1, MAX_URL_LENGTH // len(piece) + 5)
+
+
+def check(url: str, failures: List[str]) -> Optional[VideoKey]:
+    """Parse one input and record every broken invariant."""
+    start = time.perf_counter()
+    try:
+        key = parse_video_url(url)
+    except InvalidVideoURL:
+        key = None
+    except Exception as e:
+        failures.append(f"{url!r}: raised {type(e).__name__}: {e}")
+        return None
+    elapsed = time.perf_counter() - start
+    if elapsed > MAX_PARSE_SECONDS:
+        # Re-time before blaming the parser for a GC pause or a descheduled process
+        elapsed = min(time_per_call(parse_video_url, [url], 1) for _ in range(3))
+        if elapsed > MAX_PARSE_SECONDS:
+            failures.append(f"{url!r}: took {elapsed * 1000:.1f}ms")
+    if key is None:
+        return None
+    if not VIDEO_ID_RE.fullmatch(key.video_id):
+        failures.append(f"{url!r}: malformed video ID {key.video_id!r}")
+    if key.playlist_id is not None and not PLAYLIST_ID_RE.fullmatch(key.playlist_id):
+        failures.append(f"{url!r}: malformed playlist ID {key.playlist_id!r}")
+    if parse_video_url(key.url) != VideoKey(key.platform, key.video_id):
+        failures.append(f"{url!r}: canonical URL {key.url!r} does not parse back to the video")
+    return key
+
+
+def fuzz(args) -> Dict:
+    rng = random.Random(args.seed)
+    failures: List[str] = []
+    accepted = 0
+    start = time.perf_counter()
+    for _ in range(args.fuzz):
+        if check(random_input(rng), failures) is not None:
+            accepted += 1
+    # Equivalent forms of random IDs
+    forms = max(1, args.fuzz // 100)
+    for _ in range(forms):
+        video_id = "".join(rng.choice(ID_ALPHABET) for _ in range(11))
+        keys = {parse_video_url(form.format(id=video_id)).cache_key for form in FORMS}
+        if keys != {f"youtube:{video_id}"}:
+            failures.append(f"{video_id}: forms map to {sorted(keys)}")
+    elapsed = time.perf_counter() - start
+
+    print(f"fuzzed {args.fuzz} inputs (seed {args.seed}, {accepted} accepted) "
+          f"and {forms} IDs x {len(FORMS)} forms in {elapsed:.1f}s: {len(failures)} failures")
+    for failure in failures[:20]:
+        print(f"  {failure}")
+    return {"inputs": args.fuzz, "accepted": accepted, "seed": args.seed, "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and fuzz the video URL parser.")
+    parser.add_argument("--iterations", type=int, default=100000, help="Parses per timing")
+    parser.add_argument("--fuzz", type=int, default=0, help="Fuzz this many inputs instead of benchmarking")
+    parser.add_argument("--seed", type=int, default=0, help="Fuzzer random seed")
+    parser.add_argument("--save", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = fuzz(args) if args.fuzz else bench(args)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+    if args.fuzz and results["failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ const getInfoBtn = document.getElementById('get-info-btn');
 const downloadBtn = document.getElementById('download-btn');
 const newDownloadBtn = document.getElementById('new-download-btn');
 const retryBtn = document.getElementById('retry-btn');
+const cancelBtn = document.getElementById('cancel-btn');
 
 const videoInfoSection = document.getElementById('video-info');
 const progressSection = document.getElementById('progress-section');
@@ -33,6 +34,14 @@ getInfoBtn.addEventListener('click', handleGetInfo);
 downloadBtn.addEventListener('click', handleDownload);
 newDownloadBtn.addEventListener('click', resetForm);
 retryBtn.addEventListener('click', resetForm);
+cancelBtn.addEventListener('click', handleCancel);
+
+// Cancel a running job when the tab is closed so the server stops downloading it
+window.addEventListener('pagehide', () => {
+    if (currentJobId && pollingInterval) {
+        navigator.sendBeacon(`${API_BASE}/api/cancel/${currentJobId}`);
+    }
+});
 
 // Allow Enter key in URL input to trigger get info
 videoUrlInput.addEventListener('keypress', (e) => {
@@ -49,6 +58,52 @@ function formatDuration(seconds) {
     return `${mins}:${secs.toString().padStart(2, '0')}`;
 }
 
+// Format a byte count (e.g. 1.2 GB)
+function formatSize(bytes) {
+    const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+    let i = 0;
+    while (bytes >= 1024 && i < units.length - 1) {
+        bytes /= 1024;
+        i++;
+    }
+    return `${bytes.toFixed(i === 0 ? 0 : 1)} ${units[i]}`;
+}
+
+// Show the thumbnail through the resizing proxy, or straight from upstream
+function showThumbnail(data) {
+    videoThumbnail.onerror = null;
+    if (!data.video_id) {
+        videoThumbnail.removeAttribute('srcset');
+        videoThumbnail.src = data.thumbnail || '';
+        return;
+    }
+    const base = `${API_BASE}/api/thumb/${encodeURIComponent(data.video_id)}`;
+    videoThumbnail.onerror = () => {
+        // Proxy failed: fall back to the original image
+        videoThumbnail.onerror = null;
+        videoThumbnail.removeAttribute('srcset');
+        videoThumbnail.src = data.thumbnail || '';
+    };
+    videoThumbnail.sizes = '(max-width: 768px) 100vw, 200px';
+    videoThumbnail.srcset = `${base}?size=small 200w, ${base}?size=medium 400w, ${base}?size=large 640w`;
+    videoThumbnail.src = `${base}?size=medium`;
+}
+
+// Add the estimated download size to each quality option
+function showEstimates(estimates) {
+    for (const option of qualitySelect.options) {
+        if (!option.dataset.label) {
+            option.dataset.label = option.textContent;
+        }
+        const plan = estimates ? estimates[option.value] : null;
+        let text = option.dataset.label;
+        if (plan && plan.estimated_bytes) {
+            text += ` (~${formatSize(plan.estimated_bytes)})`;
+        }
+        option.textContent = text;
+    }
+}
+
 // Show error
 function showError(message) {
     hideAllSections();
@@ -114,14 +169,15 @@ async function handleGetInfo() {
         
         if (data.success) {
             // Display video info
-            videoThumbnail.src = data.thumbnail;
+            showThumbnail(data);
             videoTitle.textContent = data.title;
             videoUploader.textContent = data.uploader;
             videoDuration.textContent = formatDuration(data.duration);
+            showEstimates(data.estimates);
             
             videoInfoSection.classList.remove('hidden');
         } else {
-            showError(data.error || 'Failed to fetch video information');
+            showError(data.error || data.detail || 'Failed to fetch video information');
         }
     } catch (error) {
         showError(`Network error: ${error.message}`);
@@ -164,7 +220,7 @@ async function handleDownload() {
             // Start polling for status
             startPolling();
         } else {
-            showError(data.error || 'Failed to start download');
+            showError(data.error || data.detail || 'Failed to start download');
             downloadBtn.disabled = false;
         }
     } catch (error) {
@@ -173,6 +229,22 @@ async function handleDownload() {
     }
 }
 
+// Handle Cancel
+async function handleCancel() {
+    if (!currentJobId) {
+        return;
+    }
+    
+    cancelBtn.disabled = true;
+    try {
+        await fetch(`${API_BASE}/api/cancel/${currentJobId}`, { method: 'POST' });
+    } catch (error) {
+        console.error('Cancel error:', error);
+    } finally {
+        cancelBtn.disabled = false;
+    }
+}
+
 // Start polling for job status
 function startPolling() {
     pollingInterval = setInterval(async () => {
@@ -186,7 +258,7 @@ function startPolling() {
                 clearInterval(pollingInterval);
                 pollingInterval = null;
                 showDownloadReady(data.token);
-            } else if (data.status === 'failed') {
+            } else if (data.status === 'failed' || data.status === 'cancelled') {
                 clearInterval(pollingInterval);
                 pollingInterval = null;
                 showError(data.error || 'Download failed');
@@ -207,7 +279,8 @@ function updateProgress(data) {
         'pending': 'Waiting to start...',
         'processing': `Processing video... ${progress}%`,
         'completed': 'Download complete!',
-        'failed': 'Download failed'
+        'failed': 'Download failed',
+        'cancelled': 'Download cancelled'
     };
     
     progressText.textContent = statusMessages[data.status] || 'Processing...';
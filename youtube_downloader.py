@@ -1,45 +1,35 @@
-import yt_dlp
 import os
 import sys
-import subprocess
-import shutil
+import argparse
+import threading
 
+# Shared with the web backend, which is deployed on its own from website/
+from website.backend.ffmpeg_probe import (
+    check_ffmpeg,
+    get_ffmpeg_capabilities,
+    parse_timestamp,
+    ydl_audio_options,
+    ydl_ffmpeg_options,
+    ydl_section_options,
+)
 
-def check_ffmpeg():
+# yt-dlp takes a few hundred milliseconds to import, so it is imported lazily
+# (see preload_yt_dlp) instead of at module top.
+
+
+def preload_yt_dlp():
     """
-    Check if ffmpeg is installed and accessible.
-    Returns True if available, False otherwise.
-    Also adds FFmpeg to PATH if found in common winget locations.
+    Start importing yt-dlp in a background thread.
+    A later `import yt_dlp` blocks only until this import has finished.
     """
-    # Check if ffmpeg is in PATH
-    if shutil.which('ffmpeg') is not None:
-        return True
-    
-    # Check common winget installation locations
-    winget_base = os.path.join(os.environ.get('LOCALAPPDATA', ''), 
-                               'Microsoft', 'WinGet', 'Packages')
-    
-    if os.path.exists(winget_base):
-        for item in os.listdir(winget_base):
-            if 'ffmpeg' in item.lower():
-                # Look for ffmpeg.exe in subdirectories
-                package_dir = os.path.join(winget_base, item)
-                for root, dirs, files in os.walk(package_dir):
-                    if 'ffmpeg.exe' in files:
-                        ffmpeg_dir = root
-                        # Add to PATH for this session
-                        os.environ['PATH'] = ffmpeg_dir + os.pathsep + os.environ.get('PATH', '')
-                        return True
-    
-    # Try to run ffmpeg command
-    try:
-        subprocess.run(['ffmpeg', '-version'], 
-                      stdout=subprocess.PIPE, 
-                      stderr=subprocess.PIPE, 
-                      check=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+    def _load():
+        try:
+            import yt_dlp  # noqa: F401
+        except ImportError:
+            pass
+    thread = threading.Thread(target=_load, daemon=True)
+    thread.start()
+    return thread
 
 
 def print_ffmpeg_warning():
@@ -67,24 +57,37 @@ def print_ffmpeg_warning():
         sys.exit(0)
 
 
-def download_video(url, output_path='downloads'):
+def download_video(url, output_path='downloads', audio_only=False, start=None, end=None, precise_cut=False):
     """
     Download a YouTube video in HD quality.
     
     Args:
         url (str): YouTube video URL
         output_path (str): Directory to save the downloaded video
+        audio_only (bool): Download only the audio track (m4a/opus)
+        start (float): Optional clip start in seconds
+        end (float): Optional clip end in seconds
+        precise_cut (bool): Re-encode cut edges instead of snapping to keyframes
     """
+    import yt_dlp
+    
     # Create output directory if it doesn't exist
     if not os.path.exists(output_path):
         os.makedirs(output_path)
     
+    # Merge/convert strategy comes from the cached FFmpeg capabilities
+    ffmpeg_caps = get_ffmpeg_capabilities()
+    if ffmpeg_caps:
+        # HD Quality: Prefer 1080p with best codecs (VP9/AV1 for video, Opus for audio)
+        video_format = 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=1080]+bestaudio/best[height<=1080]/best'
+    else:
+        # Without FFmpeg streams cannot be merged, so only single-file formats work
+        video_format = 'best[height<=1080][ext=mp4]/best[height<=1080]/best'
+    
     # Configure yt-dlp options for faster HD downloads
     ydl_opts = {
-        # HD Quality: Prefer 1080p with best codecs (VP9/AV1 for video, Opus for audio)
-        'format': 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=1080]+bestaudio/best[height<=1080]/best',
+        'format': video_format,
         'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
-        'merge_output_format': 'mp4',
         
         # Speed optimizations
         'concurrent_fragment_downloads': 8,  # Download fragments in parallel
@@ -96,15 +99,18 @@ def download_video(url, output_path='downloads'):
         # Quality settings
         'prefer_free_formats': False,  # Don't prefer free formats, prefer quality
         
-        # Post-processing
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }],
-        
         'quiet': False,
         'no_warnings': False,
     }
+    if audio_only:
+        # Audio only: best audio stream, stream-copied to m4a/opus
+        ydl_opts.update(ydl_audio_options(ffmpeg_caps))
+    else:
+        # Post-processing: merge to MP4, converting only if FFmpeg can encode
+        ydl_opts.update(ydl_ffmpeg_options(ffmpeg_caps))
+    
+    # Clip mode: only the requested time range is downloaded
+    ydl_opts.update(ydl_section_options(start, end, precise_cut))
     
     try:
         print(f"\n🎬 Starting download from: {url}")
@@ -118,7 +124,9 @@ def download_video(url, output_path='downloads'):
             
             print(f"📹 Video: {video_title}")
             print(f"⏱️  Duration: {duration // 60}:{duration % 60:02d}")
-            print(f"\n⬇️  Downloading in HD quality...\n")
+            if start is not None or end is not None:
+                print(f"✂️  Clip: {start or 0:g}s → {'end' if end is None else f'{end:g}s'}")
+            print(f"\n⬇️  Downloading {'audio only' if audio_only else 'in HD quality'}...\n")
             
             # Download the video
             ydl.download([url])
@@ -131,12 +139,33 @@ def download_video(url, output_path='downloads'):
         sys.exit(1)
 
 
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Download YouTube videos in HD quality.")
+    parser.add_argument('url', nargs='?', help="YouTube video URL (prompted if omitted)")
+    parser.add_argument('output_path', nargs='?', default='downloads', help="Output directory (default: downloads)")
+    parser.add_argument('--audio', action='store_true', help="Download audio only (m4a/opus, no video)")
+    parser.add_argument('--start', type=parse_timestamp, help="Clip start, in seconds or [H:]MM:SS")
+    parser.add_argument('--end', type=parse_timestamp, help="Clip end, in seconds or [H:]MM:SS")
+    parser.add_argument('--precise-cut', action='store_true',
+                        help="Re-encode clip edges for frame-accurate cuts (default: cut on keyframes)")
+    args = parser.parse_args(argv)
+    if args.start is not None and args.end is not None and args.end <= args.start:
+        parser.error("--end must be after --start")
+    return args
+
+
 def main():
     """Main function to handle user input and start download."""
+    args = parse_args()
+    
     print("\n" + "="*50)
     print("🎥 YouTube Video Downloader (HD)")
     print("="*50 + "\n")
     
+    # Load yt-dlp while we check for FFmpeg and wait for the URL
+    preload_yt_dlp()
+    
     # Check for ffmpeg
     if not check_ffmpeg():
         print_ffmpeg_warning()
@@ -144,8 +173,8 @@ def main():
         print("✅ FFmpeg detected - ready for HD downloads!\n")
     
     # Get URL from user
-    if len(sys.argv) > 1:
-        url = sys.argv[1]
+    if args.url:
+        url = args.url
     else:
         url = input("Enter YouTube video URL: ").strip()
     
@@ -153,13 +182,14 @@ def main():
         print("❌ No URL provided. Exiting.")
         sys.exit(1)
     
-    # Optional: custom output path
-    if len(sys.argv) > 2:
-        output_path = sys.argv[2]
-    else:
-        output_path = 'downloads'
-    
-    download_video(url, output_path)
+    download_video(
+        url,
+        args.output_path,
+        audio_only=args.audio,
+        start=args.start,
+        end=args.end,
+        precise_cut=args.precise_cut
+    )
 
 
 if __name__ == "__main__":
@@ -1,47 +1,39 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
-import yt_dlp
 import os
+import json
+import uuid
+import queue
 import threading
-import subprocess
-import shutil
 
+# Shared with the web backend, which is deployed on its own from website/
+from website.backend.ffmpeg_probe import (
+    check_ffmpeg,
+    get_ffmpeg_capabilities,
+    parse_timestamp,
+    ydl_audio_options,
+    ydl_ffmpeg_options,
+    ydl_section_options,
+)
+from website.backend.format_planner import plan_audio, plan_format
 
-def check_ffmpeg():
+# yt-dlp takes a few hundred milliseconds to import, so it is imported lazily
+# (see preload_yt_dlp) instead of at module top.
+
+
+def preload_yt_dlp():
     """
-    Check if ffmpeg is installed and accessible.
-    Returns True if available, False otherwise.
-    Also adds FFmpeg to PATH if found in common winget locations.
+    Start importing yt-dlp in a background thread.
+    A later `import yt_dlp` blocks only until this import has finished.
     """
-    # Check if ffmpeg is in PATH
-    if shutil.which('ffmpeg') is not None:
-        return True
-    
-    # Check common winget installation locations
-    winget_base = os.path.join(os.environ.get('LOCALAPPDATA', ''), 
-                               'Microsoft', 'WinGet', 'Packages')
-    
-    if os.path.exists(winget_base):
-        for item in os.listdir(winget_base):
-            if 'ffmpeg' in item.lower():
-                # Look for ffmpeg.exe in subdirectories
-                package_dir = os.path.join(winget_base, item)
-                for root, dirs, files in os.walk(package_dir):
-                    if 'ffmpeg.exe' in files:
-                        ffmpeg_dir = root
-                        # Add to PATH for this session
-                        os.environ['PATH'] = ffmpeg_dir + os.pathsep + os.environ.get('PATH', '')
-                        return True
-    
-    # Try to run ffmpeg command
-    try:
-        subprocess.run(['ffmpeg', '-version'], 
-                      stdout=subprocess.PIPE, 
-                      stderr=subprocess.PIPE, 
-                      check=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+    def _load():
+        try:
+            import yt_dlp  # noqa: F401
+        except ImportError:
+            pass
+    thread = threading.Thread(target=_load, daemon=True)
+    thread.start()
+    return thread
 
 
 def show_ffmpeg_warning():
@@ -76,33 +68,165 @@ Continue anyway? (Some videos may still download, but quality may be limited)"""
     return response
 
 
+# Where the download queue is persisted between app restarts
+QUEUE_FILE = os.path.join(os.path.expanduser('~'), '.youtube_downloader_queue.json')
+
+# Queue item states
+QUEUED = 'queued'
+DOWNLOADING = 'downloading'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+# Quality option for audio-only downloads
+AUDIO_ONLY = "Audio Only (M4A/Opus)"
+
+# States that are finished and will not be picked up again
+FINISHED_STATES = (CANCELLED, COMPLETED, FAILED)
+
+# How often the Tk loop drains pending UI updates (milliseconds)
+UI_REFRESH_MS = 100
+
+# Maximum number of lines kept in the status log (oldest are dropped)
+LOG_MAX_LINES = 500
+
+
+def format_bytes(num):
+    """Format a byte count (or bytes/second) for display."""
+    if num is None:
+        return 'N/A'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if num < 1024:
+            return f"{num:.1f}{unit}"
+        num /= 1024
+    return f"{num:.1f}TiB"
+
+
+def format_eta(seconds):
+    """Format an ETA in seconds as M:SS or H:MM:SS."""
+    if seconds is None:
+        return 'N/A'
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes}:{secs:02d}"
+
+
+def progress_bar_text(percent, width=10):
+    """Render a small text progress bar for the queue list."""
+    filled = int(width * percent / 100)
+    return '█' * filled + '░' * (width - filled) + f" {percent:5.1f}%"
+
+
+class QueueItem:
+    """A single entry in the download queue."""
+
+    # Fields persisted to the queue file
+    PERSISTED = ('id', 'url', 'output_path', 'quality', 'start', 'end',
+                 'status', 'title', 'percent', 'error')
+    
+    def __init__(self, url, output_path, quality, item_id=None, status=QUEUED,
+                 title=None, percent=0.0, error=None, start=None, end=None):
+        self.id = item_id or uuid.uuid4().hex
+        self.url = url
+        self.output_path = output_path
+        self.quality = quality
+        self.start = start  # Optional clip range in seconds
+        self.end = end
+        self.status = status
+        self.title = title
+        self.percent = percent
+        self.error = error
+        
+        # Runtime-only state
+        self.speed = None
+        self.eta = None
+        self.stop_request = None  # None, PAUSED or CANCELLED
+        self.partial_files = set()
+    
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.PERSISTED}
+
+    @classmethod
+    def from_dict(cls, data):
+        item = cls(
+            data['url'],
+            data['output_path'],
+            data['quality'],
+            item_id=data.get('id'),
+            status=data.get('status', QUEUED),
+            title=data.get('title'),
+            percent=data.get('percent', 0.0),
+            error=data.get('error'),
+            start=data.get('start'),
+            end=data.get('end'),
+        )
+        # A download interrupted by closing the app resumes from its .part file
+        if item.status == DOWNLOADING:
+            item.status = QUEUED
+        return item
+
+
 class YouTubeDownloaderGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("YouTube Video Downloader (HD)")
-        self.root.geometry("700x550")
+        self.root.geometry("760x820")
         self.root.resizable(False, False)
         
         # Set default output path
         self.output_path = os.path.join(os.getcwd(), 'downloads')
         
+        # Download queue: item_id -> QueueItem, in insertion order
+        self.queue_items = {}
+        self.queue_lock = threading.Lock()
+        self.max_concurrent = tk.IntVar(value=2)
+        
+        # Worker threads never touch Tk directly: log lines and finished
+        # items go through this queue, progress only marks items dirty, and
+        # the Tk loop drains both every UI_REFRESH_MS
+        self.ui_updates = queue.Queue()
+        self.dirty_items = set()
+        self.dirty_lock = threading.Lock()
+        
         # Configure style
         style = ttk.Style()
         style.theme_use('clam')
         
         self.setup_ui()
+        self.load_queue()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(UI_REFRESH_MS, self.drain_ui_updates)
+        
+        # The window is usable right away; yt-dlp and the FFmpeg check load
+        # in the background and queued downloads start once FFmpeg is known
+        preload_yt_dlp()
         self.check_ffmpeg_on_start()
         
     def check_ffmpeg_on_start(self):
-        """Check for ffmpeg when the application starts."""
-        if not check_ffmpeg():
+        """Check for ffmpeg in a background thread when the application starts."""
+        def _check():
+            self.ui_updates.put(('ffmpeg', check_ffmpeg()))
+        threading.Thread(target=_check, daemon=True).start()
+        
+    def on_ffmpeg_checked(self, found):
+        """
+        Report the FFmpeg check result (runs on the Tk thread).
+        Returns False if the user chose to quit.
+        """
+        if not found:
             if not show_ffmpeg_warning():
-                self.root.destroy()
-                return
+                self.on_close()
+                return False
             self.log_message("⚠️  WARNING: FFmpeg not detected. Some features may be limited.")
         else:
             self.log_message("✅ FFmpeg detected - ready for HD downloads!")
         self.log_message("="*60)
+        self.pump_queue()
+        return True
         
     def setup_ui(self):
         """Set up the user interface."""
@@ -120,18 +244,19 @@ class YouTubeDownloaderGUI:
         title_label.grid(row=0, column=0, columnspan=3, pady=(0, 20))
         
         # URL Input Section
-        url_label = ttk.Label(main_frame, text="Video URL:", font=("Arial", 11))
-        url_label.grid(row=1, column=0, sticky=tk.W, pady=(0, 5))
+        url_label = ttk.Label(main_frame, text="Video URL(s) - paste one or more, separated by spaces:", font=("Arial", 11))
+        url_label.grid(row=1, column=0, columnspan=3, sticky=tk.W, pady=(0, 5))
         
-        self.url_entry = ttk.Entry(main_frame, width=70, font=("Arial", 10))
+        self.url_entry = ttk.Entry(main_frame, width=76, font=("Arial", 10))
         self.url_entry.grid(row=2, column=0, columnspan=3, pady=(0, 15), ipady=5)
+        self.url_entry.bind("<Return>", lambda event: self.start_download())
         self.url_entry.focus()
         
         # Output Directory Section
         output_label = ttk.Label(main_frame, text="Save to:", font=("Arial", 11))
         output_label.grid(row=3, column=0, sticky=tk.W, pady=(0, 5))
         
-        self.output_entry = ttk.Entry(main_frame, width=55, font=("Arial", 10))
+        self.output_entry = ttk.Entry(main_frame, width=60, font=("Arial", 10))
         self.output_entry.insert(0, self.output_path)
         self.output_entry.grid(row=4, column=0, columnspan=2, pady=(0, 15), ipady=5)
         
@@ -154,7 +279,8 @@ class YouTubeDownloaderGUI:
             "1080p (Full HD)",
             "720p (HD)",
             "480p",
-            "Best Available"
+            "Best Available",
+            AUDIO_ONLY
         ]
         quality_dropdown = ttk.Combobox(
             main_frame, 
@@ -166,10 +292,34 @@ class YouTubeDownloaderGUI:
         )
         quality_dropdown.grid(row=6, column=0, sticky=tk.W, pady=(0, 15))
         
+        # Optional clip range (only the needed part is downloaded)
+        clip_frame = ttk.Frame(main_frame)
+        clip_frame.grid(row=5, column=1, columnspan=2, sticky=tk.E, pady=(0, 5))
+        ttk.Label(clip_frame, text="Clip (optional) from", font=("Arial", 10)).pack(side=tk.LEFT)
+        self.clip_start_entry = ttk.Entry(clip_frame, width=8, font=("Arial", 10))
+        self.clip_start_entry.pack(side=tk.LEFT, padx=(5, 5))
+        ttk.Label(clip_frame, text="to", font=("Arial", 10)).pack(side=tk.LEFT)
+        self.clip_end_entry = ttk.Entry(clip_frame, width=8, font=("Arial", 10))
+        self.clip_end_entry.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # Concurrent downloads
+        concurrency_frame = ttk.Frame(main_frame)
+        concurrency_frame.grid(row=6, column=1, columnspan=2, sticky=tk.E, pady=(0, 15))
+        ttk.Label(concurrency_frame, text="Concurrent downloads:", font=("Arial", 11)).pack(side=tk.LEFT)
+        ttk.Spinbox(
+            concurrency_frame,
+            from_=1,
+            to=8,
+            width=4,
+            textvariable=self.max_concurrent,
+            command=self.pump_queue,
+            state="readonly"
+        ).pack(side=tk.LEFT, padx=(5, 0))
+        
         # Download Button
         self.download_btn = tk.Button(
-            main_frame,
-            text="⬇️  Download Video",
+            main_frame, 
+            text="➕  Add to Queue",
             command=self.start_download,
             font=("Arial", 12, "bold"),
             bg="#CC0000",
@@ -179,30 +329,65 @@ class YouTubeDownloaderGUI:
             cursor="hand2",
             pady=10
         )
-        self.download_btn.grid(row=7, column=0, columnspan=3, pady=(0, 20), sticky=(tk.W, tk.E))
+        self.download_btn.grid(row=7, column=0, columnspan=3, pady=(0, 15), sticky=(tk.W, tk.E))
         
-        # Progress Bar
+        # Queue Panel
+        queue_label = ttk.Label(main_frame, text="Queue:", font=("Arial", 11))
+        queue_label.grid(row=8, column=0, sticky=tk.W, pady=(0, 5))
+        
+        queue_frame = ttk.Frame(main_frame)
+        queue_frame.grid(row=9, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        
+        columns = ("title", "status", "progress", "speed", "eta")
+        self.queue_tree = ttk.Treeview(queue_frame, columns=columns, show="headings", height=8, selectmode="extended")
+        for column, heading, width in (
+            ("title", "Video", 270),
+            ("status", "Status", 90),
+            ("progress", "Progress", 150),
+            ("speed", "Speed", 90),
+            ("eta", "ETA", 60),
+        ):
+            self.queue_tree.heading(column, text=heading)
+            self.queue_tree.column(column, width=width, anchor=tk.W if column == "title" else tk.CENTER)
+        self.queue_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        queue_scroll = ttk.Scrollbar(queue_frame, orient=tk.VERTICAL, command=self.queue_tree.yview)
+        queue_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.queue_tree.configure(yscrollcommand=queue_scroll.set)
+        
+        queue_buttons = ttk.Frame(main_frame)
+        queue_buttons.grid(row=10, column=0, columnspan=3, sticky=tk.W, pady=(5, 10))
+        for text, command in (
+            ("Pause", self.pause_selected),
+            ("Resume", self.resume_selected),
+            ("Cancel", self.cancel_selected),
+            ("Remove", self.remove_selected),
+            ("Clear Finished", self.clear_finished),
+        ):
+            ttk.Button(queue_buttons, text=text, command=command, width=14).pack(side=tk.LEFT, padx=(0, 5))
+            
+        # Overall Progress Bar
         self.progress = ttk.Progressbar(
             main_frame, 
-            mode='indeterminate', 
-            length=660
+            mode='determinate',
+            length=720
         )
-        self.progress.grid(row=8, column=0, columnspan=3, pady=(0, 10))
+        self.progress.grid(row=11, column=0, columnspan=3, pady=(0, 10))
         
         # Status/Log Area
         status_label = ttk.Label(main_frame, text="Status:", font=("Arial", 11))
-        status_label.grid(row=9, column=0, sticky=tk.W, pady=(0, 5))
+        status_label.grid(row=12, column=0, sticky=tk.W, pady=(0, 5))
         
         self.status_text = scrolledtext.ScrolledText(
-            main_frame,
-            width=80,
-            height=12,
+            main_frame, 
+            width=88,
+            height=8,
             font=("Consolas", 9),
             wrap=tk.WORD,
             state=tk.DISABLED,
             bg="#f0f0f0"
         )
-        self.status_text.grid(row=10, column=0, columnspan=3)
+        self.status_text.grid(row=13, column=0, columnspan=3)
         
         # Initial status message will be set by check_ffmpeg_on_start
         
@@ -216,11 +401,64 @@ class YouTubeDownloaderGUI:
             
     def log_message(self, message):
         """Add message to status text area."""
+        self.append_log([message])
+        
+    def append_log(self, messages):
+        """Insert a batch of log lines, keeping only the last LOG_MAX_LINES."""
         self.status_text.config(state=tk.NORMAL)
-        self.status_text.insert(tk.END, message + "\n")
+        self.status_text.insert(tk.END, "\n".join(messages) + "\n")
+        # Every line ends with a newline, so 'end-1c' sits on an empty last line
+        line_count = int(self.status_text.index('end-1c').split('.')[0]) - 1
+        if line_count > LOG_MAX_LINES:
+            self.status_text.delete('1.0', f'{line_count - LOG_MAX_LINES + 1}.0')
         self.status_text.see(tk.END)
         self.status_text.config(state=tk.DISABLED)
-        self.root.update_idletasks()
+        
+    def post_log(self, message):
+        """Queue a log line from any thread."""
+        self.ui_updates.put(('log', message))
+        
+    def mark_dirty(self, item_id):
+        """Flag a queue row for redraw on the next UI frame (any thread)."""
+        with self.dirty_lock:
+            self.dirty_items.add(item_id)
+            
+    def drain_ui_updates(self):
+        """Apply all pending UI updates in one batch (runs on the Tk thread)."""
+        messages = []
+        finished = []
+        ffmpeg_result = None
+        while True:
+            try:
+                kind, payload = self.ui_updates.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'log':
+                messages.append(payload)
+            elif kind == 'finished':
+                finished.append(payload)
+            elif kind == 'ffmpeg':
+                ffmpeg_result = payload
+                
+        if messages:
+            # Only the tail can survive the ring buffer anyway
+            self.append_log(messages[-LOG_MAX_LINES:])
+            
+        with self.dirty_lock:
+            dirty, self.dirty_items = self.dirty_items, set()
+        for item_id in dirty:
+            self.refresh_item(item_id)
+            
+        for item_id, status, error in finished:
+            self.on_item_finished(item_id, status, error)
+            
+        if dirty and not finished:
+            self.update_overall_progress()
+            
+        if ffmpeg_result is not None and not self.on_ffmpeg_checked(ffmpeg_result):
+            return  # Window was closed
+            
+        self.root.after(UI_REFRESH_MS, self.drain_ui_updates)
         
     def clear_log(self):
         """Clear the status text area."""
@@ -229,29 +467,215 @@ class YouTubeDownloaderGUI:
         self.status_text.config(state=tk.DISABLED)
         
     def start_download(self):
-        """Start the download process in a separate thread."""
-        url = self.url_entry.get().strip()
+        """Add the entered URL(s) to the download queue."""
+        urls = self.url_entry.get().split()
         
-        if not url:
+        if not urls:
             messagebox.showwarning("No URL", "Please enter a YouTube video URL.")
             return
             
-        # Disable button and start progress
-        self.download_btn.config(state=tk.DISABLED, text="Downloading...")
-        self.progress.start(10)
-        self.clear_log()
+        try:
+            start = parse_timestamp(self.clip_start_entry.get())
+            end = parse_timestamp(self.clip_end_entry.get())
+            if start is not None and end is not None and end <= start:
+                raise ValueError("Clip end must be after clip start")
+        except ValueError as e:
+            messagebox.showwarning("Invalid Clip", f"Enter clip times as seconds or M:SS.\n\n{e}")
+            return
+            
+        output_path = self.output_entry.get().strip()
+        quality = self.quality_var.get()
+        for url in urls:
+            item = QueueItem(url, output_path, quality, start=start, end=end)
+            with self.queue_lock:
+                self.queue_items[item.id] = item
+            self.insert_tree_row(item)
+            
+        self.log_message(f"➕ Added {len(urls)} video(s) to the queue ({quality})")
+        self.url_entry.delete(0, tk.END)
+        self.save_queue()
+        self.pump_queue()
+        
+    # Queue management -------------------------------------------------------
+    
+    def pump_queue(self):
+        """Start queued items until the concurrency limit is reached."""
+        try:
+            limit = max(1, int(self.max_concurrent.get()))
+        except (tk.TclError, ValueError):
+            limit = 1
+            
+        with self.queue_lock:
+            active = sum(1 for item in self.queue_items.values() if item.status == DOWNLOADING)
+            to_start = []
+            for item in self.queue_items.values():
+                if active >= limit:
+                    break
+                if item.status == QUEUED:
+                    item.status = DOWNLOADING
+                    item.stop_request = None
+                    item.error = None
+                    to_start.append(item)
+                    active += 1
+                    
+        for item in to_start:
+            self.refresh_item(item.id)
+            # Run download in separate thread to keep GUI responsive
+            download_thread = threading.Thread(
+                target=self.download_video,
+                args=(item,),
+                daemon=True
+            )
+            download_thread.start()
+            
+        if to_start:
+            self.save_queue()
+        self.update_overall_progress()
+        
+    def selected_items(self):
+        """Return the queue items currently selected in the list."""
+        with self.queue_lock:
+            return [self.queue_items[i] for i in self.queue_tree.selection() if i in self.queue_items]
+            
+    def pause_selected(self):
+        """Pause selected items; running downloads stop and keep their partial files."""
+        for item in self.selected_items():
+            if item.status == DOWNLOADING:
+                item.stop_request = PAUSED
+            elif item.status == QUEUED:
+                item.status = PAUSED
+                self.refresh_item(item.id)
+        self.save_queue()
         
-        # Run download in separate thread to keep GUI responsive
-        download_thread = threading.Thread(
-            target=self.download_video, 
-            args=(url,),
-            daemon=True
+    def resume_selected(self):
+        """Re-queue paused, cancelled or failed items."""
+        for item in self.selected_items():
+            if item.status in (PAUSED, CANCELLED, FAILED):
+                item.status = QUEUED
+                self.refresh_item(item.id)
+        self.save_queue()
+        self.pump_queue()
+        
+    def cancel_selected(self):
+        """Cancel selected items and discard their partial files."""
+        for item in self.selected_items():
+            if item.status == DOWNLOADING:
+                item.stop_request = CANCELLED
+            elif item.status in (QUEUED, PAUSED):
+                item.status = CANCELLED
+                self.remove_partial_files(item)
+                self.refresh_item(item.id)
+        self.save_queue()
+        
+    def remove_selected(self):
+        """Remove selected items that are not currently downloading."""
+        for item in self.selected_items():
+            if item.status == DOWNLOADING:
+                continue
+            with self.queue_lock:
+                self.queue_items.pop(item.id, None)
+            self.queue_tree.delete(item.id)
+        self.save_queue()
+        self.update_overall_progress()
+        
+    def clear_finished(self):
+        """Remove completed, cancelled and failed items from the list."""
+        with self.queue_lock:
+            finished = [i for i, item in self.queue_items.items() if item.status in FINISHED_STATES]
+            for item_id in finished:
+                del self.queue_items[item_id]
+        for item_id in finished:
+            self.queue_tree.delete(item_id)
+        self.save_queue()
+        self.update_overall_progress()
+        
+    def remove_partial_files(self, item):
+        """Delete .part/.ytdl files left behind by a cancelled download."""
+        for path in list(item.partial_files):
+            for candidate in (path, path + '.ytdl'):
+                try:
+                    if os.path.exists(candidate):
+                        os.remove(candidate)
+                except OSError:
+                    pass
+        item.partial_files.clear()
+        
+    def insert_tree_row(self, item):
+        """Add a row for a queue item."""
+        self.queue_tree.insert("", tk.END, iid=item.id, values=self.tree_values(item))
+        
+    def tree_values(self, item):
+        """Column values for a queue item row."""
+        downloading = item.status == DOWNLOADING
+        return (
+            item.title or item.url,
+            item.status.capitalize(),
+            progress_bar_text(item.percent),
+            format_bytes(item.speed) + '/s' if downloading and item.speed else '',
+            format_eta(item.eta) if downloading and item.eta is not None else '',
         )
-        download_thread.start()
         
-    def get_format_string(self):
+    def refresh_item(self, item_id):
+        """Redraw a queue row (must run on the Tk thread)."""
+        item = self.queue_items.get(item_id)
+        if item is None or not self.queue_tree.exists(item_id):
+            return
+        self.queue_tree.item(item_id, values=self.tree_values(item))
+        
+    def update_overall_progress(self):
+        """Show the average progress of all unfinished items in the main bar."""
+        with self.queue_lock:
+            pending = [item for item in self.queue_items.values() if item.status not in FINISHED_STATES]
+        if pending:
+            self.progress['value'] = sum(item.percent for item in pending) / len(pending)
+        else:
+            self.progress['value'] = 0
+            
+    def save_queue(self):
+        """Persist the queue and settings so they survive an app restart."""
+        with self.queue_lock:
+            data = {
+                'max_concurrent': self.max_concurrent.get(),
+                'items': [item.to_dict() for item in self.queue_items.values()],
+            }
+        try:
+            tmp_path = QUEUE_FILE + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, QUEUE_FILE)
+        except OSError as e:
+            self.log_message(f"⚠️  Could not save queue: {e}")
+            
+    def load_queue(self):
+        """Restore the queue saved by a previous session."""
+        if not os.path.exists(QUEUE_FILE):
+            return
+        try:
+            with open(QUEUE_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log_message(f"⚠️  Could not load saved queue: {e}")
+            return
+            
+        self.max_concurrent.set(data.get('max_concurrent', self.max_concurrent.get()))
+        for entry in data.get('items', []):
+            item = QueueItem.from_dict(entry)
+            self.queue_items[item.id] = item
+            self.insert_tree_row(item)
+            
+        unfinished = sum(1 for item in self.queue_items.values() if item.status not in FINISHED_STATES)
+        if unfinished:
+            self.log_message(f"📋 Restored {unfinished} unfinished download(s) from last session")
+            
+    def on_close(self):
+        """Save the queue before the window closes."""
+        # Running downloads resume from their partial files on next launch
+        self.save_queue()
+        self.root.destroy()
+        
+    def get_format_string(self, quality=None, can_merge=True):
         """Get the format string based on selected quality."""
-        quality = self.quality_var.get()
+        quality = quality or self.quality_var.get()
         
         # Map quality selection to height
         quality_map = {
@@ -265,30 +689,57 @@ class YouTubeDownloaderGUI:
         
         height = quality_map.get(quality, 1080)
         
-        if height == 9999:
+        if not can_merge:
+            # Without FFmpeg streams cannot be merged, so only single-file formats work
+            if height == 9999:
+                return 'best[ext=mp4]/best'
+            return f'best[height<={height}][ext=mp4]/best[height<={height}]/best'
+        elif height == 9999:
             # Best available quality
             return 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best'
         else:
             # Specific quality
             return f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<={height}]+bestaudio/best[height<={height}]/best'
-    
-    def download_video(self, url):
-        """Download the video using yt-dlp."""
-        output_path = self.output_entry.get().strip()
+            
+    def download_video(self, item):
+        """Download a queue item using yt-dlp (runs in a worker thread)."""
+        output_path = item.output_path
+        status, error = FAILED, None
+        try:
+            status = self.run_download(item, output_path)
+            label = item.title or item.url
+            self.post_log(f"✅ Completed: {label} → {output_path}")
+            
+        except Exception as e:
+            label = item.title or item.url
+            if item.stop_request:
+                # Raised by a hook after pause/cancel (DownloadCancelled), or a failure racing it
+                status = item.stop_request
+                if status == CANCELLED:
+                    self.remove_partial_files(item)
+                self.post_log(f"⏸️  {status.capitalize()}: {label}")
+            else:
+                error = str(e)
+                self.post_log(f"❌ Error ({label}): {error}")
+                
+        finally:
+            # The status change is applied on the Tk thread (see on_item_finished)
+            self.ui_updates.put(('finished', (item.id, status, error)))
+            
+    def run_download(self, item, output_path):
+        """Extract, plan and download a queue item; returns COMPLETED or raises."""
+        import yt_dlp
         
         # Create output directory if it doesn't exist
         if not os.path.exists(output_path):
             os.makedirs(output_path)
-        
-        # Get selected quality
-        selected_quality = self.quality_var.get()
             
+        # Merge/convert strategy comes from the cached FFmpeg capabilities
+        ffmpeg_caps = get_ffmpeg_capabilities()
+        
         # Configure yt-dlp options for faster HD downloads
         ydl_opts = {
-            # Quality based on user selection
-            'format': self.get_format_string(),
             'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
-            'merge_output_format': 'mp4',
             
             # Speed optimizations
             'concurrent_fragment_downloads': 8,  # Download fragments in parallel
@@ -296,88 +747,102 @@ class YouTubeDownloaderGUI:
             'retries': 10,  # Retry on failure
             'fragment_retries': 10,  # Retry fragments
             'buffersize': 1024 * 1024 * 2,  # 2MB buffer
+            'continuedl': True,  # Resume paused downloads from .part files
             
             # Quality settings
             'prefer_free_formats': False,  # Don't prefer free formats, prefer quality
             
-            # Post-processing
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }],
-            
             'quiet': True,
             'no_warnings': True,
-            'progress_hooks': [self.progress_hook],
+            'progress_hooks': [lambda d: self.progress_hook(item, d)],
+            # Pause/cancel also apply during extraction and between post-processing steps
+            'match_filter': lambda info, *args, **kwargs: self.check_stop(item),
+            'postprocessor_hooks': [lambda d: self.check_stop(item)],
         }
+        if item.quality == AUDIO_ONLY:
+            # Audio only: best audio stream, stream-copied to m4a/opus
+            ydl_opts.update(ydl_audio_options(ffmpeg_caps))
+        else:
+            # Quality based on user selection
+            ydl_opts['format'] = self.get_format_string(item.quality, can_merge=ffmpeg_caps is not None)
+            # Post-processing: merge to MP4, converting only if FFmpeg can encode
+            ydl_opts.update(ydl_ffmpeg_options(ffmpeg_caps))
+            
+        # Clip mode: only the requested time range is downloaded
+        ydl_opts.update(ydl_section_options(item.start, item.end))
         
-        try:
-            self.log_message(f"🔗 URL: {url}")
-            self.log_message(f"📁 Saving to: {output_path}")
-            self.log_message(f"🎬 Quality: {selected_quality}\n")
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                # Get video info first
-                self.log_message("📋 Fetching video information...")
-                info = ydl.extract_info(url, download=False)
-                video_title = info.get('title', 'Unknown')
-                duration = info.get('duration', 0)
-                uploader = info.get('uploader', 'Unknown')
-                
-                self.log_message(f"📹 Title: {video_title}")
-                self.log_message(f"👤 Channel: {uploader}")
-                self.log_message(f"⏱️  Duration: {duration // 60}:{duration % 60:02d}")
-                self.log_message(f"\n⬇️  Starting download ({selected_quality})...\n")
-                
-                # Download the video
-                ydl.download([url])
-                
-            self.log_message("\n" + "="*60)
-            self.log_message("✅ Download completed successfully!")
-            self.log_message(f"📂 Video saved to: {output_path}")
-            self.log_message("="*60)
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Get video info first
+            info = ydl.extract_info(item.url, download=False)
+            item.title = info.get('title', 'Unknown')
+            duration = info.get('duration', 0) or 0
+            self.mark_dirty(item.id)
+            self.post_log(f"⬇️  Starting: {item.title} ({duration // 60}:{duration % 60:02d}, {item.quality})")
             
-            # Show success message
-            self.root.after(0, lambda: messagebox.showinfo(
-                "Success", 
-                f"Video downloaded successfully!\n\nSaved to:\n{output_path}"
-            ))
+        # Pick the cheapest format meeting the quality from the extracted formats,
+        # keeping the quality-based format string as a fallback
+        plan = self.plan_item_format(item, info, ffmpeg_caps)
+        if plan:
+            ydl_opts['format'] = f"{plan['format']}/{ydl_opts['format']}"
+            size = plan['estimated_bytes']
+            self.post_log(
+                f"📐 Format {plan['format']} ({plan['vcodec'] or 'no video'}/{plan['acodec'] or 'no audio'}), "
+                f"~{format_bytes(size) if size else 'unknown size'}"
+                f"{', needs transcode' if plan['needs_transcode'] else ''}"
+            )
             
-        except Exception as e:
-            error_msg = f"❌ Error: {str(e)}"
-            self.log_message("\n" + error_msg)
-            self.root.after(0, lambda: messagebox.showerror(
-                "Download Error", 
-                f"An error occurred:\n\n{str(e)}"
-            ))
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            # Download the video
+            ydl.download([item.url])
+        item.percent = 100.0
+        return COMPLETED
+        
+    def plan_item_format(self, item, info, ffmpeg_caps):
+        """Choose an explicit format for a queue item from its extracted info."""
+        if item.quality == AUDIO_ONLY:
+            return plan_audio(info, ffmpeg_caps)
+        # Labels start with the planner's quality name ("1080p (Full HD)", "Best Available")
+        return plan_format(info, item.quality.split()[0], ffmpeg_caps)
+        
+    def on_item_finished(self, item_id, status, error):
+        """Record a worker's result, update the UI and start the next item (Tk thread)."""
+        with self.queue_lock:
+            item = self.queue_items.get(item_id)
+            if item is not None:
+                item.status = status
+                item.error = error
+                item.speed = None
+                item.eta = None
+        self.refresh_item(item_id)
+        self.save_queue()
+        self.pump_queue()
+        
+    def check_stop(self, item):
+        """Abort the item's download if pause or cancel was requested (called from yt-dlp hooks)."""
+        if item.stop_request:
+            from yt_dlp.utils import DownloadCancelled
+            # Raising inside a hook makes yt-dlp abort the download
+            raise DownloadCancelled(item.stop_request)
             
-        finally:
-            # Re-enable button and stop progress
-            self.root.after(0, self.reset_ui)
+    def progress_hook(self, item, d):
+        """Hook to record per-item download progress."""
+        self.check_stop(item)
+        
+        if d.get('tmpfilename'):
+            item.partial_files.add(d['tmpfilename'])
             
-    def progress_hook(self, d):
-        """Hook to display download progress."""
         if d['status'] == 'downloading':
-            percent = d.get('_percent_str', 'N/A')
-            speed = d.get('_speed_str', 'N/A')
-            eta = d.get('_eta_str', 'N/A')
-            
-            # Only log every few updates to avoid flooding
-            if hasattr(self, '_last_percent'):
-                if self._last_percent == percent:
-                    return
-            self._last_percent = percent
-            
-            msg = f"⬇️  Progress: {percent} | Speed: {speed} | ETA: {eta}"
-            self.root.after(0, lambda: self.log_message(msg))
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                item.percent = min(100.0, d.get('downloaded_bytes', 0) * 100 / total)
+            item.speed = d.get('speed')
+            item.eta = d.get('eta')
+            # Only the latest values are kept; the row redraws at most once per frame
+            self.mark_dirty(item.id)
             
         elif d['status'] == 'finished':
-            self.root.after(0, lambda: self.log_message("\n🔄 Processing video (merging/converting)..."))
-            
-    def reset_ui(self):
-        """Reset UI elements after download."""
-        self.download_btn.config(state=tk.NORMAL, text="⬇️  Download HD Video")
-        self.progress.stop()
+            label = item.title or item.url
+            self.post_log(f"🔄 Processing: {label} (merging/converting)...")
 
 
 def main():
@@ -389,4 +854,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-